@@ -0,0 +1,54 @@
+# mock_chatgpt_server.py
+# Purpose: Local stand-in for the ChatGPT chat completions API, for exercising the
+#          troubleshooter batch modes without network access or API cost.
+#
+# Usage:
+#   python mock_chatgpt_server.py --port 8765 --delay 0.5 --failure-rate 0.1
+#   CHATGPT_API_URL=http://127.0.0.1:8765/v1/chat/completions python <script using troubleshooter_updated>
+
+import argparse
+import asyncio
+import random
+from aiohttp import web
+
+STATS = web.AppKey('stats', dict)  # Request counters, read by tests
+
+
+def create_app(delay=0.0, failure_rate=0.0, fail_first=0):
+    """Builds an app that answers chat completions with an echo of the prompt after `delay` seconds,
+    returning HTTP 503 for the first `fail_first` requests and a `failure_rate` fraction of the rest
+    to exercise the retry path. app[STATS] counts requests, failures and the peak number in flight."""
+    app = web.Application()
+    stats = app[STATS] = {'requests': 0, 'failed': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+    async def chat_completions(request):
+        stats['requests'] += 1
+        arrival = stats['requests']
+        stats['in_flight'] += 1
+        stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+        try:
+            body = await request.json()
+            await asyncio.sleep(delay)
+        finally:
+            stats['in_flight'] -= 1
+        if arrival <= fail_first or random.random() < failure_rate:
+            stats['failed'] += 1
+            return web.json_response({"error": "mock overload"}, status=503)
+
+        prompt = body.get("messages", [{}])[-1].get("content", "")
+        content = f"# Suggested by mock ({body.get('model')})\n{prompt.split('Current Cell Content:')[-1].strip()}"
+        return web.json_response({"choices": [{"message": {"role": "assistant", "content": content}}]})
+
+    app.router.add_post('/v1/chat/completions', chat_completions)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock ChatGPT chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.5, help="Seconds to wait before answering")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer the first N requests with 503")
+    args = parser.parse_args()
+    web.run_app(create_app(args.delay, args.failure_rate, args.fail_first), host=args.host, port=args.port)
@@ -0,0 +1,97 @@
+# test_troubleshooter.py
+# Purpose: Runs the async batch mode of troubleshooter_updated against mock_chatgpt_server
+#          (concurrency limit, retry with backoff, single save, awaitable from a running loop).
+
+import asyncio
+import importlib
+import time
+
+import nbformat
+import pytest
+from aiohttp import web
+
+from mock_chatgpt_server import STATS, create_app
+
+CELLS = 6
+
+
+@pytest.fixture
+def troubleshooter(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # The module creates its drafts/ directory on import
+    module = importlib.reload(importlib.import_module("troubleshooter_updated"))
+    notebook = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(f"x = {i}") for i in range(CELLS)])
+    nbformat.write(notebook, str(tmp_path / "notebook.ipynb"))
+    monkeypatch.setattr(module, "notebook_path", str(tmp_path / "notebook.ipynb"))
+    monkeypatch.setattr(module, "updated_notebook_path", str(tmp_path / "updated.ipynb"))
+    monkeypatch.setattr(module, "RETRY_BACKOFF_SECONDS", 0.01)
+
+    saves = []
+    save_notebook = module.save_notebook
+    monkeypatch.setattr(module, "save_notebook", lambda nb, path: (saves.append(path), save_notebook(nb, path)))
+    module.saves = saves
+    return module
+
+
+async def serve(module, **options):
+    """Starts the mock server on a free port and points the troubleshooter at it."""
+    app = create_app(**options)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    module.CHATGPT_API_URL = f"http://127.0.0.1:{port}/v1/chat/completions"
+    return app, runner
+
+
+def test_batch_limits_concurrency_retries_and_saves_once(troubleshooter):
+    async def run():
+        app, runner = await serve(troubleshooter, delay=0.05, fail_first=2)
+        try:
+            updated = await troubleshooter.troubleshoot_batch([], list(range(CELLS)), "Modify Cell(s)",
+                                                              max_concurrency=3, use_cache=False)
+        finally:
+            await runner.cleanup()
+        return app[STATS], updated
+
+    stats, updated = asyncio.run(run())
+    assert updated == CELLS
+    assert 1 < stats["max_in_flight"] <= 3
+    assert stats["failed"] == 2
+    assert stats["requests"] == CELLS + 2  # The two 503s were retried
+    assert troubleshooter.saves == [troubleshooter.updated_notebook_path]
+    cells = nbformat.read(troubleshooter.updated_notebook_path, as_version=4).cells
+    assert all(cell.source.startswith("# Suggested by mock") for cell in cells)
+
+
+def test_batch_gives_up_after_max_retries(troubleshooter, monkeypatch):
+    monkeypatch.setattr(troubleshooter, "MAX_RETRIES", 2)
+    monkeypatch.setattr(troubleshooter, "RETRY_BACKOFF_SECONDS", 0.2)
+
+    async def run():
+        app, runner = await serve(troubleshooter, fail_first=1000)
+        try:
+            updated = await troubleshooter.troubleshoot_batch([], [0, 1], "Modify Cell(s)", use_cache=False)
+        finally:
+            await runner.cleanup()
+        return app[STATS], updated
+
+    started = time.perf_counter()
+    stats, updated = asyncio.run(run())
+    assert time.perf_counter() - started >= 0.2  # Backed off once between the two attempts
+    assert updated == 0
+    assert stats["requests"] == 2 * 2
+    assert len(troubleshooter.saves) == 1
+
+
+def test_blocking_entry_point_inside_running_loop_returns_task(troubleshooter):
+    async def run():
+        app, runner = await serve(troubleshooter)
+        try:
+            task = troubleshooter.start_batch_troubleshooting_async([], [0, 1], "Modify Cell(s)", use_cache=False)
+            assert isinstance(task, asyncio.Task)
+            return await task
+        finally:
+            await runner.cleanup()
+
+    assert asyncio.run(run()) == 2
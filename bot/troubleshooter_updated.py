@@ -4,18 +4,41 @@
 
 import nbformat
 import os
+import json
+import hashlib
+import asyncio
+import random
 import requests
 from dotenv import load_dotenv
 
+try:
+    import aiohttp  # Only needed for the async batch mode
+except ImportError:
+    aiohttp = None
+
 # Load API credentials (assuming Gemini or ChatGPT API keys)
 load_dotenv("chatgpt_credentials.env")
 CHATGPT_API_KEY = os.getenv("CHATGPT_API_KEY")
+CHATGPT_API_URL = os.getenv("CHATGPT_API_URL", "https://api.openai.com/v1/chat/completions")  # Point at a mock server for local runs
+CHATGPT_MODEL = "gpt-3.5-turbo"
+CHATGPT_TEMPERATURE = 0.2
+
+# Async batch settings
+MAX_CONCURRENT_REQUESTS = 4   # Cell prompts in flight at once
+MAX_RETRIES = 4               # Attempts per prompt on rate limits, server errors and timeouts
+RETRY_BACKOFF_SECONDS = 1.0   # Base delay, doubled after each failed attempt
+REQUEST_TIMEOUT_SECONDS = 120
 
 # Define paths for the notebook files and output drafts
 notebook_path = "BitBot_Notebook.ipynb"  # Path to the notebook being improved
 updated_notebook_path = "BitBot_Notebook_Updated.ipynb"  # Path to save the updated notebook
 output_dir = "drafts/"  # Directory to save draft improvements
 
+# Response cache settings - identical (model, temperature, action, cell source) requests are answered from disk
+USE_RESPONSE_CACHE = os.getenv("TROUBLESHOOTER_NO_CACHE") is None  # Set TROUBLESHOOTER_NO_CACHE=1 to opt out
+response_cache_dir = os.path.join(output_dir, "response_cache")
+RESPONSE_CACHE_MAX_BYTES = 50 * 1024 * 1024  # Oldest entries are evicted beyond this size
+
 # Ensure output directory exists
 os.makedirs(output_dir, exist_ok=True)
 
@@ -47,26 +70,107 @@ def ask_chatgpt(prompt):
         'Content-Type': 'application/json'
     }
     data = {
-        "model": "gpt-3.5-turbo",
+        "model": CHATGPT_MODEL,
         "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.2,
+        "temperature": CHATGPT_TEMPERATURE,
     }
-    response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=data)
+    response = requests.post(CHATGPT_API_URL, headers=headers, json=data)
     if response.status_code == 200:
         return response.json().get('choices', [{}])[0].get('message', {}).get('content', '')
     else:
         raise Exception(f"Error {response.status_code}: {response.text}")
 
 
+def build_prompt(action, cell_content):
+    """Builds the full prompt for an action, with the cell content appended for context."""
+    if action == "Create New Cell":
+        prompt = "Generate a new cell that fulfills the project's objectives."
+    elif action == "Modify Cell(s)":
+        prompt = "Make improvements to this cell's content and optimize its code."
+    elif action == "Create Documentation":
+        prompt = "Add comprehensive documentation and comments for clarity."
+    else:
+        prompt = action  # Use the custom prompt directly
+    return f"{prompt}\n\nCurrent Cell Content:\n{cell_content}"
+
+async def ask_chatgpt_async(session, prompt):
+    """Async version of ask_chatgpt over a shared aiohttp session, retrying with exponential backoff
+    on rate limits (429), server errors (5xx) and connection failures."""
+    headers = {
+        'Authorization': f'Bearer {CHATGPT_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+    data = {
+        "model": CHATGPT_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": CHATGPT_TEMPERATURE,
+    }
+    for attempt in range(MAX_RETRIES):
+        try:
+            async with session.post(CHATGPT_API_URL, headers=headers, json=data) as response:
+                if response.status == 200:
+                    body = await response.json()
+                    return body.get('choices', [{}])[0].get('message', {}).get('content', '')
+                error = Exception(f"Error {response.status}: {await response.text()}")
+                if response.status != 429 and response.status < 500:
+                    raise error  # Client errors will not succeed on retry
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+        if attempt < MAX_RETRIES - 1:
+            # Exponential backoff with jitter so concurrent retries do not arrive together
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random()))
+    raise error
+
+
+# ========== Response Cache ==========
+
+def response_cache_key(action, cell_content):
+    """Content address for a request: hash of model, temperature, action and cell source."""
+    payload = json.dumps([CHATGPT_MODEL, CHATGPT_TEMPERATURE, action, cell_content], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def cache_get(key):
+    """Returns the cached response for a key, or None. A hit refreshes the entry's age for eviction."""
+    path = os.path.join(response_cache_dir, f"{key}.json")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = json.load(f)["content"]
+        os.utime(path)
+        return content
+    except (OSError, ValueError, KeyError):
+        return None
+
+def cache_put(key, content):
+    """Stores a response atomically, then evicts the oldest entries if the cache is over its size limit."""
+    os.makedirs(response_cache_dir, exist_ok=True)
+    path = os.path.join(response_cache_dir, f"{key}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"model": CHATGPT_MODEL, "content": content}, f)
+    os.replace(tmp_path, path)
+    evict_response_cache()
+
+def evict_response_cache(max_bytes=RESPONSE_CACHE_MAX_BYTES):
+    """Deletes least recently used cache entries until the cache fits in max_bytes."""
+    entries = [e for e in os.scandir(response_cache_dir) if e.name.endswith('.json')]
+    total = sum(e.stat().st_size for e in entries)
+    for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+        if total <= max_bytes:
+            break
+        total -= entry.stat().st_size
+        os.remove(entry.path)
+
+
 # ========== Main Troubleshooting Function ==========
 
-def troubleshoot_cell(cell_index, action):
+def troubleshoot_cell(cell_index, action, use_cache=USE_RESPONSE_CACHE):
     """
     Troubleshoot or improve the content of a specified cell.
     
     Parameters:
     - cell_index (int): Index of the cell to troubleshoot or improve.
     - action (str): Description of the action to take (e.g., 'Custom prompt', 'Create New Cell').
+    - use_cache (bool): Reuse a stored response when the same request was made before.
     """
     # Load the notebook
     notebook = load_notebook(notebook_path)
@@ -76,26 +180,23 @@ def troubleshoot_cell(cell_index, action):
         print(f"[ERROR] Cell index {cell_index} is out of range.")
         return
     
-    # Generate the improvement prompt based on the specified action
-    if action == "Create New Cell":
-        prompt = "Generate a new cell that fulfills the project's objectives."
-    elif action == "Modify Cell(s)":
-        prompt = "Make improvements to this cell's content and optimize its code."
-    elif action == "Create Documentation":
-        prompt = "Add comprehensive documentation and comments for clarity."
-    else:
-        prompt = action  # Use the custom prompt directly
-    
-    # Append the cell content to the prompt for context
+    # Generate the improvement prompt, with the cell content appended for context
     cell_content = notebook.cells[cell_index].source
-    full_prompt = f"{prompt}\n\nCurrent Cell Content:\n{cell_content}"
+    full_prompt = build_prompt(action, cell_content)
     
-    # Request improvements from ChatGPT
-    try:
-        suggested_code = ask_chatgpt(full_prompt)
-    except Exception as e:
-        print(f"[ERROR] Failed to request improvement: {e}")
-        return
+    # Request improvements from ChatGPT, unless an identical request is already cached
+    cache_key = response_cache_key(action, cell_content)
+    suggested_code = cache_get(cache_key) if use_cache else None
+    if suggested_code is None:
+        try:
+            suggested_code = ask_chatgpt(full_prompt)
+        except Exception as e:
+            print(f"[ERROR] Failed to request improvement: {e}")
+            return
+        if use_cache:
+            cache_put(cache_key, suggested_code)
+    else:
+        print(f"[INFO] Cell {cell_index}: using cached response.")
     
     # Apply the improved content to the cell
     notebook.cells[cell_index].source = suggested_code
@@ -108,7 +209,7 @@ def troubleshoot_cell(cell_index, action):
 
 # ========== Batch Troubleshooting Interface ==========
 
-def start_batch_troubleshooting(selected_docs, cell_indices, action):
+def start_batch_troubleshooting(selected_docs, cell_indices, action, use_cache=USE_RESPONSE_CACHE):
     """
     Runs troubleshooting for a batch of cells based on user-selected documents, cells, and action.
     
@@ -116,6 +217,7 @@ def start_batch_troubleshooting(selected_docs, cell_indices, action):
     - selected_docs (list): List of selected documents to include in troubleshooting.
     - cell_indices (list): Indices of the cells to troubleshoot.
     - action (str): The action to apply to the cells.
+    - use_cache (bool): Reuse stored responses for unchanged cells.
     """
     # Load notebook and prepare to apply actions to selected cells
     notebook = load_notebook(notebook_path)
@@ -130,7 +232,100 @@ def start_batch_troubleshooting(selected_docs, cell_indices, action):
 
     # Apply the chosen action to each selected cell
     for cell_index in cell_indices:
-        troubleshoot_cell(cell_index, action)
+        troubleshoot_cell(cell_index, action, use_cache=use_cache)
 
     # Final confirmation message
     print(f"[INFO] Troubleshooting session completed. The updated notebook is saved at {updated_notebook_path}")
+
+
+# ========== Async Batch Troubleshooting ==========
+
+async def request_cell_improvements(notebook, cell_indices, action, max_concurrency=MAX_CONCURRENT_REQUESTS,
+                                    use_cache=USE_RESPONSE_CACHE):
+    """Sends the prompts for all selected cells concurrently (at most max_concurrency at a time)
+    over one pooled HTTP session. Cells with a cached response skip the request.
+    Returns {cell_index: suggested content or Exception}."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_SECONDS)
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        async def improve(cell_index):
+            cell_content = notebook.cells[cell_index].source
+            cache_key = response_cache_key(action, cell_content)
+            cached = cache_get(cache_key) if use_cache else None
+            if cached is not None:
+                return cached
+            async with semaphore:
+                suggested_code = await ask_chatgpt_async(session, build_prompt(action, cell_content))
+            if use_cache:
+                cache_put(cache_key, suggested_code)
+            return suggested_code
+
+        results = await asyncio.gather(*(improve(idx) for idx in cell_indices), return_exceptions=True)
+    return dict(zip(cell_indices, results))
+
+async def troubleshoot_batch(selected_docs, cell_indices, action, max_concurrency=MAX_CONCURRENT_REQUESTS,
+                             use_cache=USE_RESPONSE_CACHE):
+    """
+    Async batch mode: loads the notebook once, requests improvements for all cells concurrently,
+    applies the results in memory and saves the updated notebook once. Inside Jupyter (which already
+    runs an event loop) call it with `await troubleshoot_batch(...)`. Returns the number of cells updated.
+    
+    Parameters:
+    - selected_docs (list): List of selected documents to include in troubleshooting.
+    - cell_indices (list): Indices of the cells to troubleshoot.
+    - action (str): The action to apply to the cells.
+    - max_concurrency (int): Maximum number of API requests in flight at once.
+    - use_cache (bool): Reuse stored responses for unchanged cells.
+    """
+    if aiohttp is None:
+        raise ImportError("The async batch mode requires aiohttp (pip install aiohttp).")
+
+    notebook = load_notebook(notebook_path)
+    print(f"[INFO] Troubleshooting session for documents: {selected_docs}")
+
+    # Skip indices that are out of range instead of failing the whole batch
+    valid_indices = []
+    for cell_index in dict.fromkeys(cell_indices):
+        if cell_index >= len(notebook.cells):
+            print(f"[ERROR] Cell index {cell_index} is out of range.")
+        else:
+            valid_indices.append(cell_index)
+
+    previews = preview_cell_content(notebook, valid_indices)
+    for idx, content in previews.items():
+        print(f"[Cell {idx} Preview]: {content}...")
+
+    # Request all improvements concurrently, then apply them to the in-memory notebook
+    results = await request_cell_improvements(notebook, valid_indices, action, max_concurrency, use_cache)
+    updated = 0
+    for cell_index, result in results.items():
+        if isinstance(result, Exception):
+            print(f"[ERROR] Failed to request improvement for cell {cell_index}: {result}")
+            continue
+        notebook.cells[cell_index].source = result
+        updated += 1
+        print(f"[INFO] Cell {cell_index} updated successfully with '{action}' action.")
+
+    # Save once after all cells are applied
+    save_notebook(notebook, updated_notebook_path)
+    print(f"[INFO] Troubleshooting session completed ({updated}/{len(valid_indices)} cells updated). "
+          f"The updated notebook is saved at {updated_notebook_path}")
+    return updated
+
+def start_batch_troubleshooting_async(selected_docs, cell_indices, action, max_concurrency=MAX_CONCURRENT_REQUESTS,
+                                     use_cache=USE_RESPONSE_CACHE):
+    """
+    Blocking entry point for troubleshoot_batch. From a script (no running event loop) it runs the batch
+    to completion and returns the number of cells updated. Inside a running loop such as Jupyter's,
+    asyncio.run is not allowed, so the batch is scheduled on that loop and the Task is returned;
+    `await` it to wait for the result.
+    """
+    batch = troubleshoot_batch(selected_docs, cell_indices, action, max_concurrency, use_cache)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(batch)
+    print("[INFO] Event loop already running (Jupyter): batch scheduled; await the returned task for the result.")
+    return loop.create_task(batch)
@@ -0,0 +1,64 @@
+# ========== ACTION PARSER ==========
+# Turns the free-text Fidelity `Action` column (renamed to `notes` in the ledger) into typed
+# columns: a categorical `action_type`, a boolean `is_margin` and the `parsed_symbol` embedded
+# in the text, e.g. "YOU BOUGHT APPLE INC (AAPL) (Cash)" -> BUY, False, AAPL.
+# Patterns are compiled once and applied with vectorized str.extract / str.contains over the
+# whole column, so position and P&L aggregation can group on these columns directly.
+
+import re
+import pandas as pd
+
+# Leading phrase of the action text -> action_type (checked as one alternation, longest phrases first)
+ACTION_PREFIXES = {
+    'YOU BOUGHT': 'BUY',
+    'YOU SOLD': 'SELL',
+    'REINVESTMENT': 'REINVESTMENT',
+    'DIVIDEND RECEIVED': 'DIVIDEND',
+    'SHORT-TERM CAP GAIN': 'CAPITAL_GAIN',
+    'LONG-TERM CAP GAIN': 'CAPITAL_GAIN',
+    'INTEREST EARNED': 'INTEREST',
+    'EXPIRED': 'EXPIRED',
+    'ASSIGNED': 'ASSIGNED',
+    'EXERCISED': 'EXERCISED',
+    'FEE CHARGED': 'FEE',
+    'FOREIGN TAX PAID': 'FEE',
+    'ELECTRONIC FUNDS TRANSFER': 'TRANSFER',
+    'TRANSFERRED FROM': 'TRANSFER',
+    'TRANSFERRED TO': 'TRANSFER',
+    'TRANSFER OF ASSETS': 'TRANSFER',
+    'JOURNALED': 'JOURNAL',
+    'REDEMPTION PAYOUT': 'REDEMPTION',
+}
+OTHER = 'OTHER'
+ACTION_TYPES = sorted(set(ACTION_PREFIXES.values())) + [OTHER]
+
+ACTION_PATTERN = re.compile(
+    r'^\s*(' + '|'.join(re.escape(p) for p in sorted(ACTION_PREFIXES, key=len, reverse=True)) + r')\b'
+)
+# First parenthesised ticker or CUSIP; "(Cash)", "(Margin)" and "(100 SHS)" do not match.
+# For option actions this is the underlying, e.g. "EXPIRED PUT (SPY) SPDR S&P500 ETF ..." -> SPY
+SYMBOL_PATTERN = re.compile(r'\(([A-Z][A-Z0-9]{0,5}(?:[.-][A-Z]{1,2})?|\d{3}[0-9A-Z]{5}\d)\)')
+# Fidelity ends each action with the account type the trade was booked in
+MARGIN_PATTERN = re.compile(r'\(Margin\)\s*$')
+
+
+def parse_actions(notes):
+    """Returns a DataFrame with action_type, is_margin and parsed_symbol for a Series of action texts."""
+    notes = pd.Series(notes, dtype=object)
+    text = notes.fillna('')
+
+    prefixes = text.str.extract(ACTION_PATTERN, expand=False)
+    action_type = prefixes.map(ACTION_PREFIXES).fillna(OTHER)
+
+    return pd.DataFrame({
+        'action_type': pd.Categorical(action_type, categories=ACTION_TYPES),
+        'is_margin': text.str.contains(MARGIN_PATTERN),
+        'parsed_symbol': text.str.extract(SYMBOL_PATTERN, expand=False),
+    }, index=notes.index)
+
+
+def add_action_columns(data, notes_column='notes'):
+    """Adds the parsed action columns to a ledger DataFrame (replacing them if already present)."""
+    parsed = parse_actions(data[notes_column])
+    data = data.drop(columns=[c for c in parsed.columns if c in data.columns])
+    return pd.concat([data, parsed], axis=1)
@@ -0,0 +1,224 @@
+# ========== INCREMENTAL BACKFILL ==========
+# Keeps the local bar store current without refetching history. For every (symbol, timeframe)
+# the stored bars are compared with the trading calendar - 24/7 for crypto, NYSE sessions for the
+# equities in master_data - and only the missing ranges are requested, in parallel and through
+# the shared rate limiter. Results are appended to the store (or merged into it for interior
+# gaps), so a daily top-up touches a few bars per symbol instead of rewriting a ledger.
+#
+#   python Backfill.py                                 # BTC-USD plus the master_data equities
+#   python Backfill.py --symbols BTC-USD --timeframes 1m,1d --full
+
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from pandas.tseries.holiday import (AbstractHolidayCalendar, GoodFriday, Holiday, USLaborDay,
+                                    USMartinLutherKingJr, USMemorialDay, USPresidentsDay, USThanksgivingDay,
+                                    nearest_workday, sunday_to_monday)
+from BarStore import BarStore, TIMEFRAME_NS, bucket_keys, frame_to_bars, to_utc_ns
+from EnrichmentPipeline import EnrichmentPipeline
+from Instrumentation import metrics
+from RateLimiter import RateLimiter
+from Storage import read_table, table_exists
+from SymbolClassifier import needs_lookup, to_yahoo_symbols
+
+master_data_file = r'C:\Users\Lane\Documents\Projects\trading_bot\programs\master_data14.csv'
+
+BACKFILL_SYMBOLS = ['BTC-USD']       # Always kept current, in addition to the master_data equities
+BACKFILL_TIMEFRAMES = ['1m', '1d']   # Stored timeframes; 15m/1h/1mo are resampled from 1m by the store
+BACKFILL_WORKERS = 4
+MAX_REQUESTS_PER_SECOND = 5
+CRYPTO_SUFFIXES = ('-USD', '-USDT', '-EUR')
+
+# Yahoo's limits per interval: how far back it serves bars and the widest range per request
+LOOKBACK = {'1m': pd.Timedelta(days=29), '15m': pd.Timedelta(days=59), '1h': pd.Timedelta(days=729), '1d': None}
+MAX_SPAN = {'1m': pd.Timedelta(days=7), '15m': pd.Timedelta(days=59), '1h': pd.Timedelta(days=729), '1d': None}
+DAILY_HISTORY_START = pd.Timestamp('2000-01-01')  # First daily bar requested for an empty partition
+# Bars before the newest stored one that are re-checked for gaps on a normal run (--full checks all)
+AUDIT_WINDOW = {'1m': pd.Timedelta(days=2), '15m': pd.Timedelta(days=7), '1h': pd.Timedelta(days=30),
+                '1d': pd.Timedelta(days=30)}
+
+CRYPTO, EQUITY = 'crypto', 'equity'
+SESSION_OPEN = pd.Timedelta(hours=9, minutes=30)
+SESSION_MINUTES = 390
+EXCHANGE_TZ = 'America/New_York'
+
+
+# ========== TRADING CALENDAR ==========
+class NYSEHolidayCalendar(AbstractHolidayCalendar):
+    """Full-day NYSE closures (early closes are treated as full sessions)."""
+    rules = [
+        Holiday('NewYearsDay', month=1, day=1, observance=sunday_to_monday),
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday('Juneteenth', month=6, day=19, start_date='2022-01-01', observance=nearest_workday),
+        Holiday('IndependenceDay', month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday('Christmas', month=12, day=25, observance=nearest_workday),
+    ]
+
+
+NYSE_SESSIONS = pd.offsets.CustomBusinessDay(calendar=NYSEHolidayCalendar())
+
+
+def calendar_for(symbol):
+    return CRYPTO if symbol.upper().endswith(CRYPTO_SUFFIXES) else EQUITY
+
+
+def expected_keys(calendar, timeframe, start, end):
+    """Bucket keys (int64 UTC ns) of every bar the calendar expects in [start, end]."""
+    start_ns, end_ns = to_utc_ns(start)[0], to_utc_ns(end)[0]
+    if timeframe not in TIMEFRAME_NS:
+        raise ValueError(f"Backfill works on stored timeframes {list(TIMEFRAME_NS)}, not {timeframe!r}")
+    width = TIMEFRAME_NS[timeframe]
+    if calendar == CRYPTO:
+        first = bucket_keys(np.array([start_ns]), timeframe)[0]
+        return np.arange(first, end_ns + 1, width, dtype=np.int64)
+
+    sessions = pd.date_range(pd.Timestamp(start).normalize() - pd.Timedelta(days=1),
+                             pd.Timestamp(end).normalize() + pd.Timedelta(days=1), freq=NYSE_SESSIONS)
+    if timeframe == '1d':
+        stamps = sessions.tz_localize(EXCHANGE_TZ)
+    else:
+        # Yahoo stamps intraday equity bars from the 09:30 open: 390 one-minute, 26 quarter-hour, 7 hourly
+        offsets = pd.to_timedelta(np.arange(0, SESSION_MINUTES, width // TIMEFRAME_NS['1m']), unit='min')
+        opens = (sessions + SESSION_OPEN).tz_localize(EXCHANGE_TZ)
+        stamps = pd.DatetimeIndex((opens.values[:, None] + offsets.values[None, :]).ravel()).tz_localize('UTC')
+    keys = bucket_keys(to_utc_ns(stamps), timeframe)
+    in_range = (keys >= bucket_keys(np.array([start_ns]), timeframe)[0]) & (keys <= end_ns)
+    return np.unique(keys[in_range])
+
+
+# ========== GAP DETECTION ==========
+def missing_ranges(expected, stored):
+    """Runs of consecutive expected keys that are not stored, as (first_key, last_key) pairs."""
+    missing = np.flatnonzero(~np.isin(expected, stored))
+    if len(missing) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(missing) != 1)
+    starts = np.r_[missing[0], missing[breaks + 1]]
+    ends = np.r_[missing[breaks], missing[-1]]
+    return [(int(expected[s]), int(expected[e])) for s, e in zip(starts, ends)]
+
+
+def request_windows(ranges, timeframe):
+    """Groups gap ranges into fetch windows [start, end) no wider than Yahoo's per-request span,
+    so many small gaps (e.g. untraded minutes) cost one request instead of one each."""
+    width = TIMEFRAME_NS[timeframe]
+    span = MAX_SPAN[timeframe].value if MAX_SPAN[timeframe] is not None else None
+    windows = []
+    for first, last in ranges:
+        end = last + width
+        if windows and (span is None or end - windows[-1][0] <= span):
+            windows[-1][1] = end
+            continue
+        while span is not None and end - first > span:
+            windows.append([first, first + span])
+            first += span
+        windows.append([first, end])
+    return [tuple(w) for w in windows]
+
+
+def plan_backfill(store, symbol, timeframe, now=None, full=False):
+    """Fetch windows (start_ns, end_ns) that would fill the partition up to the last completed bar."""
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now(tz='UTC').tz_localize(None)
+    # Only completed bars: the bucket that is still forming is left for the next run
+    end = int(bucket_keys(to_utc_ns(now), timeframe)[0]) - 1
+    oldest = now - LOOKBACK[timeframe] if LOOKBACK[timeframe] is not None else DAILY_HISTORY_START
+
+    if not store.has(symbol, timeframe):
+        start, stored = oldest, np.empty(0, dtype=np.int64)
+    else:
+        first, last = store.first_timestamp(symbol, timeframe), store.last_timestamp(symbol, timeframe)
+        start = first if full else max(first, last - AUDIT_WINDOW[timeframe])
+        start = max(start, oldest)
+        stored = bucket_keys(store.read_columns(symbol, timeframe, start=start)['ts'], timeframe)
+    if pd.Timestamp(start) > pd.Timestamp(end):
+        return []
+    expected = expected_keys(calendar_for(symbol), timeframe, start, pd.Timestamp(end))
+    return request_windows(missing_ranges(expected, stored), timeframe)
+
+
+# ========== FETCH ==========
+def task_key(symbol, timeframe, window):
+    return f"{symbol}|{timeframe}|{window[0]}|{window[1]}"
+
+
+def fetch_window(store, key, limiter=None, cutoff_ns=None):
+    """Fetches one window from Yahoo and merges it into the store. Returns the number of bars added."""
+    symbol, timeframe, start_ns, end_ns = key.split('|')
+    start, end = pd.Timestamp(int(start_ns), tz='UTC'), pd.Timestamp(int(end_ns), tz='UTC')
+    if limiter:
+        limiter.acquire()
+    with metrics.timer('yahoo.history'):
+        data = yf.Ticker(symbol).history(start=start, end=end, interval=timeframe, auto_adjust=False)
+    columns = frame_to_bars(data, timeframe)
+    if cutoff_ns is not None:
+        # Drop a bar that is still forming so the append-only store never keeps a partial one
+        complete = columns['ts'] < cutoff_ns
+        columns = {name: values[complete] for name, values in columns.items()}
+    if len(columns['ts']) == 0:
+        metrics.incr('backfill.empty_windows')
+        return 0
+    added = store.merge(symbol, timeframe, columns)
+    metrics.incr('backfill.bars', added)
+    return added
+
+
+def backfill(symbols, timeframes=BACKFILL_TIMEFRAMES, store=None, workers=BACKFILL_WORKERS, limiter=None,
+             full=False, now=None):
+    """Plans and fetches the missing windows for every symbol and timeframe in parallel.
+    Returns ({(symbol, timeframe): bars added}, failures)."""
+    store = store or BarStore()
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now(tz='UTC').tz_localize(None)
+    keys = []
+    with metrics.stage('gap_scan', rows=len(symbols) * len(timeframes)):
+        for symbol in dict.fromkeys(symbols):
+            for timeframe in timeframes:
+                keys.extend(task_key(symbol, timeframe, w) for w in plan_backfill(store, symbol, timeframe, now, full))
+    print(f"{len(keys)} missing ranges across {len(symbols)} symbols and {len(timeframes)} timeframes")
+
+    cutoffs = {tf: int(bucket_keys(to_utc_ns(now), tf)[0]) for tf in timeframes}
+    pipeline = EnrichmentPipeline(lambda key: fetch_window(store, key, limiter, cutoffs[key.split('|')[1]]),
+                                  workers=workers)
+    with metrics.stage('backfill_fetch', rows=len(keys)) as stage:
+        records, failures = pipeline.run(keys, desc="Backfilling")
+        stage.rows = len(records)
+
+    added = {}
+    for key, count in records.items():
+        symbol, timeframe = key.split('|')[:2]
+        added[(symbol, timeframe)] = added.get((symbol, timeframe), 0) + count
+    return added, failures
+
+
+def backfill_symbols(master_data_path=master_data_file):
+    """BACKFILL_SYMBOLS plus the Yahoo form of every listed equity in master_data."""
+    symbols = list(BACKFILL_SYMBOLS)
+    if master_data_path and table_exists(master_data_path):
+        master = read_table(master_data_path, columns=['symbol'], schema='master_data')['symbol'].dropna()
+        symbols += to_yahoo_symbols(master[needs_lookup(master)]).tolist()
+    else:
+        logging.error(f"Master data file not found: {master_data_path}; backfilling {BACKFILL_SYMBOLS} only")
+    return list(dict.fromkeys(symbols))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill missing bars in the local price store")
+    parser.add_argument('--symbols', help="Comma-separated symbols (default: BTC-USD plus master_data equities)")
+    parser.add_argument('--timeframes', default=','.join(BACKFILL_TIMEFRAMES))
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS)
+    parser.add_argument('--full', action='store_true', help="Check the whole stored history for gaps")
+    args = parser.parse_args()
+
+    metrics.run_name = 'backfill'
+    symbols = args.symbols.split(',') if args.symbols else backfill_symbols()
+    added, failures = backfill(symbols, args.timeframes.split(','), workers=args.workers,
+                               limiter=RateLimiter(MAX_REQUESTS_PER_SECOND), full=args.full)
+    print(f"Added {sum(added.values())} bars to {len(added)} partitions; {len(failures)} ranges failed")
+    metrics.print_summary()
+    print(f"Run summary saved to {metrics.write_summary()}")
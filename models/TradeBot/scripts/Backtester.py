@@ -0,0 +1,278 @@
+# ========== BACKTESTER ==========
+# Replays strategy signals against OHLCV bars from the bar store with vectorized accounting:
+# positions, turnover, fees and slippage are whole-array operations, so one variant over years
+# of 1-minute bars takes milliseconds. Trading costs are calibrated from the commission and
+# fees columns that clean_data keeps in the cleaned Accounts_History ledgers. Parameter sweeps
+# fan out over a process pool; each worker memory-maps the bars once and caches the indicator
+# arrays its variants share.
+#
+#   python Backtester.py --symbol BTC-USD --timeframe 1m --strategy sma_cross \
+#       --grid fast=5:60:5 slow=50:400:25 --ledger ../data/cleaned/Accounts_History_2024_cleaned.csv
+#
+# A signal is the target position per bar as a fraction of equity (1 = fully long, 0 = flat,
+# -1 = fully short), decided on that bar's close.
+
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from BarStore import BarStore
+from Instrumentation import metrics
+from PositionEngine import prepare_fills
+
+DEFAULT_SLIPPAGE_BPS = 5.0       # Per side, on top of the calibrated fees
+GOAL_MULTIPLE = 10.0             # 0.1 BTC -> 1 BTC
+YEAR_NS = 365.25 * 24 * 3600 * 10**9
+SWEEP_CHUNK = 16                 # Variants per task sent to a worker
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'metrics')
+
+
+# ========== COSTS ==========
+def calibrate_costs(ledger, slippage_bps=DEFAULT_SLIPPAGE_BPS):
+    """Per-side cost rates from real fills: (commission + fees) / traded notional, split by side.
+    `ledger` is a cleaned ledger (or several concatenated)."""
+    fills = prepare_fills(ledger)
+    fills = fills[fills['price'] > 0]
+    notional = (fills['quantity'] * fills['price'] * fills['multiplier']).abs()
+    buys = fills['quantity'] > 0
+    costs = {'slippage': slippage_bps / 10000, 'fills': int(len(fills))}
+    for side, mask in (('buy', buys), ('sell', ~buys)):
+        traded = notional[mask].sum()
+        costs[f'{side}_fee'] = float(fills.loc[mask, 'fees'].abs().sum() / traded) if traded else 0.0
+    return costs
+
+
+def default_costs(slippage_bps=DEFAULT_SLIPPAGE_BPS):
+    return {'buy_fee': 0.0, 'sell_fee': 0.0, 'slippage': slippage_bps / 10000, 'fills': 0}
+
+
+# ========== ACCOUNTING ==========
+def bar_returns(bars, execution='close'):
+    """Per-bar price returns the accounting needs; computed once and shared by a sweep's variants.
+    'close': close-to-close. 'next_open': (overnight gap into the open, open-to-close)."""
+    close = np.asarray(bars['close'], dtype=np.float64)
+    if execution == 'close':
+        return np.r_[0.0, close[1:] / close[:-1] - 1.0]
+    if execution == 'next_open':
+        open_ = np.asarray(bars['open'], dtype=np.float64)
+        return np.r_[0.0, open_[1:] / close[:-1] - 1.0], close / open_ - 1.0
+    raise ValueError(f"Unknown execution {execution!r}")
+
+
+def run_backtest(bars, signal, costs=None, execution='close', keep_equity=False, returns=None):
+    """Evaluates one signal array against bar columns (ts/open/close as from BarStore.read_columns).
+    execution='close' trades at the signal bar's close; 'next_open' at the following open.
+    Returns summary statistics (and the equity curve with keep_equity=True)."""
+    costs = costs or default_costs()
+    target = np.nan_to_num(np.asarray(signal, dtype=np.float64))
+    n = len(target)
+    if n < 2:
+        return {'bars': n}
+    returns = returns if returns is not None else bar_returns(bars, execution)
+
+    held = np.empty(n)                  # Position carried through bar t
+    held[0] = 0.0
+    held[1:] = target[:-1]
+    if execution == 'close':
+        net = held * returns
+        traded = target  # Traded at the close of the signal bar
+    else:
+        gap, intrabar = returns
+        before_open = np.empty(n)
+        before_open[0] = 0.0
+        before_open[1:] = held[:-1]
+        net = (1.0 + before_open * gap) * (1.0 + held * intrabar) - 1.0
+        traded = held    # Traded at the open after the signal bar
+
+    # Costs only touch the (few) bars where the position changes
+    trade_bars = np.flatnonzero(np.diff(traded, prepend=0.0))
+    change = np.diff(traded, prepend=0.0)[trade_bars]
+    cost = (np.maximum(change, 0.0) * (costs['buy_fee'] + costs['slippage'])
+            + np.maximum(-change, 0.0) * (costs['sell_fee'] + costs['slippage']))
+    net[trade_bars] -= cost
+
+    equity = net + 1.0
+    np.cumprod(equity, out=equity)
+    peak = np.maximum.accumulate(equity)
+
+    span_ns = float(bars['ts'][-1] - bars['ts'][0]) if 'ts' in bars else 0.0
+    periods_per_year = (n - 1) / (span_ns / YEAR_NS) if span_ns > 0 else np.nan
+    std = net.std()
+    multiple = float(equity[-1])
+    stats = {
+        'bars': n,
+        'multiple': multiple,
+        'total_return': multiple - 1.0,
+        'cagr': multiple ** (periods_per_year / (n - 1)) - 1.0 if multiple > 0 and periods_per_year > 0 else np.nan,
+        'sharpe': float(net.mean() / std * np.sqrt(periods_per_year)) if std > 0 else np.nan,
+        'max_drawdown': float((equity / peak).min() - 1.0),
+        'trades': len(trade_bars),
+        'turnover': float(np.abs(change).sum()),
+        'costs_paid': float(cost.sum()),
+        'exposure': float(np.count_nonzero(held) / n),
+        'hit_goal': multiple >= GOAL_MULTIPLE,
+    }
+    if keep_equity:
+        stats['equity'] = equity
+    return stats
+
+
+# ========== STRATEGIES ==========
+class IndicatorCache:
+    """Indicator arrays shared by the variants of a sweep (e.g. every SMA length is computed once)."""
+
+    def __init__(self, bars):
+        self.bars = bars
+        self.close = pd.Series(np.asarray(bars['close'], dtype=np.float64))
+        self._cache = {}
+
+    def get(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    def sma(self, window):
+        return self.get(('sma', window), lambda: self.close.rolling(window).mean().to_numpy())
+
+    def ema(self, span):
+        return self.get(('ema', span), lambda: self.close.ewm(span=span, adjust=False).mean().to_numpy())
+
+    def rsi(self, period):
+        def build():
+            change = self.close.diff()
+            gain = change.clip(lower=0).ewm(alpha=1.0 / period, adjust=False).mean()
+            loss = (-change).clip(lower=0).ewm(alpha=1.0 / period, adjust=False).mean()
+            return (100.0 - 100.0 / (1.0 + gain / loss)).fillna(50.0).to_numpy()
+        return self.get(('rsi', period), build)
+
+
+def sma_cross(cache, fast, slow, allow_short=False):
+    """Long while the fast SMA is above the slow one (short below, if allowed)."""
+    if fast >= slow:
+        return None
+    above = cache.sma(fast) > cache.sma(slow)
+    return np.where(above, 1.0, -1.0 if allow_short else 0.0)
+
+
+def rsi_reversion(cache, period, lower, upper):
+    """Enters long when RSI drops below `lower` and exits once it rises above `upper`."""
+    if lower >= upper:
+        return None
+    rsi = cache.rsi(period)
+    state = np.where(rsi < lower, 1.0, np.where(rsi > upper, 0.0, np.nan))
+    return pd.Series(state).ffill().fillna(0.0).to_numpy()
+
+
+def macd_trend(cache, fast, slow, signal):
+    """Long while the MACD line is above its signal line."""
+    if fast >= slow:
+        return None
+    macd = cache.ema(fast) - cache.ema(slow)
+    signal_line = cache.get(('macd_signal', fast, slow, signal),
+                            lambda: pd.Series(macd).ewm(span=signal, adjust=False).mean().to_numpy())
+    return (macd > signal_line).astype(np.float64)
+
+
+STRATEGIES = {'sma_cross': sma_cross, 'rsi_reversion': rsi_reversion, 'macd_trend': macd_trend}
+
+
+# ========== PARAMETER SWEEPS ==========
+_worker = {}  # Per-process bars, indicator cache and run settings
+
+
+def _init_worker(store_root, symbol, timeframe, start, end, costs, execution):
+    bars = BarStore(store_root).read_columns(symbol, timeframe, start, end)
+    _worker.update(bars=bars, cache=IndicatorCache(bars), costs=costs, execution=execution,
+                   returns=bar_returns(bars, execution))
+
+
+def _run_chunk(strategy, variants):
+    results = []
+    for params in variants:
+        signal = STRATEGIES[strategy](_worker['cache'], **params)
+        if signal is None:
+            continue  # Invalid combination (e.g. fast >= slow)
+        results.append({**params, **run_backtest(_worker['bars'], signal, _worker['costs'], _worker['execution'],
+                                                 returns=_worker['returns'])})
+    return results
+
+
+def expand_grid(grid):
+    """{'fast': [5, 10], 'slow': [50, 100]} -> list of parameter dicts."""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def sweep(strategy, grid, symbol, timeframe, start=None, end=None, costs=None, execution='close',
+          workers=None, store_root=None):
+    """Backtests every parameter combination in `grid` across a process pool.
+    Returns a DataFrame of parameters and statistics, best Sharpe first."""
+    variants = expand_grid(grid)
+    chunks = [variants[i:i + SWEEP_CHUNK] for i in range(0, len(variants), SWEEP_CHUNK)]
+    init_args = (store_root, symbol, timeframe, start, end, costs or default_costs(), execution)
+    results = []
+    with metrics.stage('backtest_sweep', rows=len(variants)):
+        if workers == 1:
+            _init_worker(*init_args)
+            for chunk in chunks:
+                results.extend(_run_chunk(strategy, chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as executor:
+                for chunk_results in executor.map(_run_chunk, itertools.repeat(strategy), chunks):
+                    results.extend(chunk_results)
+    if not results:
+        return pd.DataFrame(columns=list(grid))
+    return pd.DataFrame(results).sort_values('sharpe', ascending=False, na_position='last').reset_index(drop=True)
+
+
+def parse_grid(specs):
+    """['fast=5:60:5', 'slow=50,100,200'] -> {'fast': [5, 10, ...], 'slow': [50, 100, 200]}."""
+    grid = {}
+    for spec in specs:
+        name, values = spec.split('=', 1)
+        if ':' in values:
+            low, high, step = (float(v) for v in values.split(':'))
+            numbers = np.arange(low, high + step / 2, step)
+        else:
+            numbers = [float(v) for v in values.split(',')]
+        grid[name] = [int(v) if float(v).is_integer() else float(v) for v in numbers]
+    return grid
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vectorized backtests and parameter sweeps over the bar store")
+    parser.add_argument('--symbol', default='BTC-USD')
+    parser.add_argument('--timeframe', default='1d')
+    parser.add_argument('--strategy', default='sma_cross', choices=sorted(STRATEGIES))
+    parser.add_argument('--grid', nargs='+', required=True, help="name=start:stop:step or name=v1,v2,...")
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--ledger', nargs='*', default=[], help="Cleaned ledgers used to calibrate fees")
+    parser.add_argument('--slippage-bps', type=float, default=DEFAULT_SLIPPAGE_BPS)
+    parser.add_argument('--execution', default='close', choices=['close', 'next_open'])
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    metrics.run_name = 'backtest'
+    if args.ledger:
+        costs = calibrate_costs(pd.concat([pd.read_csv(path) for path in args.ledger], ignore_index=True),
+                                args.slippage_bps)
+    else:
+        costs = default_costs(args.slippage_bps)
+    print(f"Costs per side: buy fee {costs['buy_fee']:.6f}, sell fee {costs['sell_fee']:.6f}, "
+          f"slippage {costs['slippage']:.6f} (from {costs['fills']} fills)")
+
+    started = time.perf_counter()
+    results = sweep(args.strategy, parse_grid(args.grid), args.symbol, args.timeframe, args.start, args.end,
+                    costs, args.execution, args.workers)
+    print(f"{len(results)} variants in {time.perf_counter() - started:.1f}s")
+    print(results.head(20).to_string(index=False))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_path = os.path.join(RESULTS_DIR, f"backtest_{args.symbol}_{args.timeframe}_{args.strategy}_"
+                                             f"{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    results.to_csv(results_path, index=False)
+    print(f"Results saved to {results_path}")
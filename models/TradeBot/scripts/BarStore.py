@@ -0,0 +1,333 @@
+# ========== OHLCV BAR STORE ==========
+# Local price store partitioned by timeframe and symbol. Each partition is a directory of raw
+# column files (one fixed-width numpy array per field) plus a meta.json holding the committed
+# row count:
+#
+#   data/bars/<timeframe>/<SYMBOL>/ts.i8 open.f8 high.f8 low.f8 close.f8 volume.f8 meta.json
+#
+# Ingestion is append-only: new bars are written to the end of the column files, fsynced, and
+# only then is the row count in meta.json replaced atomically (os.replace). Readers memory-map
+# exactly the committed rows, so a crash mid-append never exposes a partial bar and the next
+# append truncates the uncommitted tail. Bars older than the newest stored one (back-filled
+# gaps) go through merge(), which writes the combined partition as a new file generation and
+# switches meta.json to it in the same atomic step. Range queries binary-search the timestamp column.
+# Bars whose bucket has not closed yet are never written, since a stored bar is never revised; daily
+# and monthly bars are keyed by their session date (midnight, naive) whatever timezone Yahoo stamped.
+# Timeframes other than the stored ones (15m, 1h, 1d, 1mo) are resampled from 1-minute bars.
+#
+#   store = BarStore()
+#   store.append('BTC-USD', '1m', yf.Ticker('BTC-USD').history(period='1d', interval='1m'))
+#   hourly = store.read('BTC-USD', '1h', start='2024-10-01')
+
+import json
+import logging
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+
+BARS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'bars')
+BASE_TIMEFRAME = '1m'
+FIELDS = ['open', 'high', 'low', 'close', 'volume']
+COLUMN_DTYPES = {'ts': np.dtype('<i8'), **{field: np.dtype('<f8') for field in FIELDS}}
+COLUMN_FILES = {'ts': 'ts.i8', **{field: f'{field}.f8' for field in FIELDS}}
+YAHOO_FIELDS = {'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume'}
+
+# Bucket width in nanoseconds for the fixed-width timeframes; '1mo' uses calendar months
+NS_PER_MINUTE = 60 * 10**9
+TIMEFRAME_NS = {'1m': NS_PER_MINUTE, '15m': 15 * NS_PER_MINUTE, '1h': 60 * NS_PER_MINUTE,
+                '1d': 1440 * NS_PER_MINUTE}
+MONTHLY = '1mo'
+TIMEFRAMES = [*TIMEFRAME_NS, MONTHLY]
+# Keyed by session date: yf.download stamps these bars at naive midnight, history() at exchange midnight
+SESSION_TIMEFRAMES = ('1d', MONTHLY)
+PERIOD_PATTERN = re.compile(r'^(\d+)(d|mo|y)$')
+
+
+def to_utc_ns(timestamps):
+    """int64 UTC nanoseconds for a DatetimeIndex, Series or scalar (naive values are taken as UTC)."""
+    if isinstance(timestamps, pd.DatetimeIndex):
+        index = timestamps
+    else:
+        index = pd.DatetimeIndex(pd.to_datetime(timestamps if pd.api.types.is_list_like(timestamps) else [timestamps]))
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return index.as_unit('ns').asi8
+
+
+def period_start(period, now=None):
+    """Start time for a yfinance-style period ('5d', '1mo', '1y', 'ytd', 'max'); None for 'max'."""
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now(tz='UTC').tz_localize(None)
+    if period == 'max':
+        return None
+    if period == 'ytd':
+        return now.normalize().replace(month=1, day=1)
+    match = PERIOD_PATTERN.match(period)
+    if not match:
+        raise ValueError(f"Unsupported period {period!r}")
+    amount, unit = int(match.group(1)), match.group(2)
+    if unit == 'd':
+        return now.normalize() - pd.offsets.BDay(amount)
+    return now.normalize() - pd.DateOffset(months=amount if unit == 'mo' else 12 * amount)
+
+
+def bucket_keys(ts, timeframe):
+    """Bucket start (int64 ns) for each timestamp at the given timeframe."""
+    if timeframe == MONTHLY:
+        return ts.astype('datetime64[ns]').astype('datetime64[M]').astype('datetime64[ns]').astype(np.int64)
+    width = TIMEFRAME_NS[timeframe]
+    return ts - ts % width
+
+
+def bucket_end(ts, timeframe):
+    """Last nanosecond of the bucket containing each timestamp."""
+    if timeframe == MONTHLY:
+        next_month = ts.astype('datetime64[ns]').astype('datetime64[M]') + np.timedelta64(1, 'M')
+        return next_month.astype('datetime64[ns]').astype(np.int64) - 1
+    return bucket_keys(ts, timeframe) + TIMEFRAME_NS[timeframe] - 1
+
+
+def resample_bars(columns, timeframe):
+    """Aggregates sorted bar columns into `timeframe` buckets (first open, max high, min low,
+    last close, summed volume) with segment reductions instead of a groupby."""
+    ts = columns['ts']
+    if len(ts) == 0:
+        return {name: values[:0] for name, values in columns.items()}
+    keys = bucket_keys(ts, timeframe)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(ts)] - 1
+    return {
+        'ts': keys[starts],
+        'open': columns['open'][starts],
+        'high': np.maximum.reduceat(columns['high'], starts),
+        'low': np.minimum.reduceat(columns['low'], starts),
+        'close': columns['close'][ends],
+        'volume': np.add.reduceat(columns['volume'], starts),
+    }
+
+
+def bars_to_frame(columns):
+    """yfinance-style frame (Open/High/Low/Close/Volume, UTC DatetimeIndex named Date)."""
+    index = pd.DatetimeIndex(columns['ts'].astype('datetime64[ns]'), name='Date')
+    return pd.DataFrame({yahoo: columns[field] for yahoo, field in YAHOO_FIELDS.items()}, index=index)
+
+
+def session_dates(index):
+    """Midnight of each bar's session date in the exchange's own timezone, as a naive DatetimeIndex."""
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)  # Wall time in the exchange timezone, not UTC
+    return index.normalize()
+
+
+def frame_to_bars(frame, timeframe=None):
+    """Column arrays from a yfinance history() frame, sorted by time with duplicate timestamps dropped.
+    Daily and monthly bars are keyed by session date so both Yahoo endpoints land on the same key."""
+    frame = frame.rename(columns=YAHOO_FIELDS)
+    frame = frame[frame['close'].notna()] if 'close' in frame else frame.iloc[:0]
+    ts = to_utc_ns(session_dates(frame.index) if timeframe in SESSION_TIMEFRAMES else frame.index)
+    order = np.argsort(ts, kind='stable')
+    ts = ts[order]
+    keep = np.r_[True, ts[1:] != ts[:-1]] if len(ts) else np.zeros(0, dtype=bool)
+    columns = {'ts': ts[keep]}
+    for field in FIELDS:
+        values = frame[field].to_numpy(dtype='f8', na_value=np.nan) if field in frame else np.full(len(frame), np.nan)
+        columns[field] = values[order][keep]
+    return columns
+
+
+def completed_bars(columns, timeframe, now=None):
+    """Drops bars whose bucket is still forming at `now` (default: the current UTC time)."""
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now(tz='UTC').tz_localize(None)
+    complete = columns['ts'] < bucket_keys(to_utc_ns(now), timeframe)[0]
+    return columns if complete.all() else {name: values[complete] for name, values in columns.items()}
+
+
+class BarStore:
+    """Append-only, memory-mapped OHLCV store keyed by (symbol, timeframe)."""
+
+    def __init__(self, root=None):
+        self.root = root or BARS_DIR
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    # ---------- Partitions ----------
+    def _dir(self, symbol, timeframe):
+        return os.path.join(self.root, timeframe, symbol.replace('/', '_'))
+
+    def _lock(self, symbol, timeframe):
+        with self._locks_guard:
+            return self._locks.setdefault((symbol, timeframe), threading.RLock())
+
+    def _meta(self, symbol, timeframe):
+        path = os.path.join(self._dir(symbol, timeframe), 'meta.json')
+        if not os.path.exists(path):
+            return {'rows': 0, 'first_ts': None, 'last_ts': None, 'generation': 0}
+        with open(path) as f:
+            return {'generation': 0, **json.load(f)}
+
+    @staticmethod
+    def _column_path(directory, name, generation=0):
+        """Column file for a generation; generation 0 uses the plain names (ts.i8, close.f8, ...)."""
+        filename = COLUMN_FILES[name]
+        if generation:
+            stem, ext = filename.split('.')
+            filename = f"{stem}.{generation}.{ext}"
+        return os.path.join(directory, filename)
+
+    def _commit_meta(self, symbol, timeframe, meta):
+        path = os.path.join(self._dir(symbol, timeframe), 'meta.json')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def rows(self, symbol, timeframe):
+        return self._meta(symbol, timeframe)['rows']
+
+    def first_timestamp(self, symbol, timeframe):
+        """Oldest stored bar time (naive UTC Timestamp), or None if the partition is empty."""
+        first_ts = self._meta(symbol, timeframe)['first_ts']
+        return pd.Timestamp(first_ts) if first_ts is not None else None
+
+    def last_timestamp(self, symbol, timeframe):
+        """Newest stored bar time (naive UTC Timestamp), or None if the partition is empty."""
+        last_ts = self._meta(symbol, timeframe)['last_ts']
+        return pd.Timestamp(last_ts) if last_ts is not None else None
+
+    def symbols(self, timeframe):
+        directory = os.path.join(self.root, timeframe)
+        return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+    def has(self, symbol, timeframe):
+        return self.rows(symbol, timeframe) > 0
+
+    # ---------- Ingestion ----------
+    def append(self, symbol, timeframe, bars, now=None):
+        """Appends completed bars newer than the last stored one. `bars` is a yfinance-style frame or a
+        dict of column arrays. Returns the number of rows added."""
+        columns = frame_to_bars(bars, timeframe) if isinstance(bars, pd.DataFrame) else bars
+        columns = completed_bars(columns, timeframe, now)
+        with self._lock(symbol, timeframe):
+            meta = self._meta(symbol, timeframe)
+            if meta['last_ts'] is not None:
+                newer = columns['ts'] > to_utc_ns(meta['last_ts'])[0]
+                columns = {name: values[newer] for name, values in columns.items()}
+            added = len(columns['ts'])
+            if added == 0:
+                return 0
+
+            directory = self._dir(symbol, timeframe)
+            os.makedirs(directory, exist_ok=True)
+            for name, dtype in COLUMN_DTYPES.items():
+                with open(self._column_path(directory, name, meta['generation']), 'ab') as f:
+                    # Drop any tail left by an append that never committed its meta.json
+                    f.truncate(meta['rows'] * dtype.itemsize)
+                    f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            first_ts = meta['first_ts'] or str(pd.Timestamp(int(columns['ts'][0])))
+            self._commit_meta(symbol, timeframe, {'rows': meta['rows'] + added, 'first_ts': first_ts,
+                                                  'last_ts': str(pd.Timestamp(int(columns['ts'][-1]))),
+                                                  'generation': meta['generation']})
+            return added
+
+    def merge(self, symbol, timeframe, bars, now=None):
+        """Adds completed bars anywhere in the partition, e.g. a back-filled gap. Bars at timestamps
+        already stored are ignored. Pure tail additions take the append path; anything else rewrites
+        the partition as a new generation. Returns the number of rows added."""
+        columns = frame_to_bars(bars, timeframe) if isinstance(bars, pd.DataFrame) else bars
+        columns = completed_bars(columns, timeframe, now)
+        with self._lock(symbol, timeframe):
+            meta = self._meta(symbol, timeframe)
+            if meta['last_ts'] is None or len(columns['ts']) == 0 or columns['ts'][0] > to_utc_ns(meta['last_ts'])[0]:
+                return self.append(symbol, timeframe, columns, now)
+
+            stored = self._columns(symbol, timeframe)
+            new = ~np.isin(columns['ts'], stored['ts'])
+            added = int(new.sum())
+            if added == 0:
+                return 0
+            order = np.argsort(np.concatenate([stored['ts'], columns['ts'][new]]), kind='stable')
+            merged = {name: np.concatenate([stored[name], columns[name][new]])[order] for name in COLUMN_DTYPES}
+
+            directory = self._dir(symbol, timeframe)
+            generation = meta['generation'] + 1
+            for name, dtype in COLUMN_DTYPES.items():
+                with open(self._column_path(directory, name, generation), 'wb') as f:
+                    f.write(np.ascontiguousarray(merged[name], dtype=dtype).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._commit_meta(symbol, timeframe, {'rows': len(merged['ts']),
+                                                  'first_ts': str(pd.Timestamp(int(merged['ts'][0]))),
+                                                  'last_ts': str(pd.Timestamp(int(merged['ts'][-1]))),
+                                                  'generation': generation})
+            for name in COLUMN_DTYPES:
+                os.remove(self._column_path(directory, name, meta['generation']))
+            return added
+
+    def append_download(self, data, timeframe):
+        """Appends every symbol of a yf.download(..., group_by='ticker') frame. Returns rows added per symbol."""
+        added = {}
+        if data is None or data.empty:
+            return added
+        for symbol in data.columns.get_level_values(0).unique():
+            try:
+                added[symbol] = self.append(symbol, timeframe, data[symbol])
+            except OSError as e:
+                logging.error(f"Error storing {timeframe} bars for {symbol}: {e}")
+        return added
+
+    # ---------- Queries ----------
+    def _columns(self, symbol, timeframe, start=None, end=None):
+        """Committed columns for the stored partition within [start, end], read through memmaps."""
+        meta = self._meta(symbol, timeframe)
+        rows, generation = meta['rows'], meta['generation']
+        directory = self._dir(symbol, timeframe)
+        if rows == 0:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMN_DTYPES.items()}
+        ts = np.memmap(self._column_path(directory, 'ts', generation), dtype=COLUMN_DTYPES['ts'], mode='r',
+                       shape=(rows,))
+        lo = int(np.searchsorted(ts, to_utc_ns(start)[0], side='left')) if start is not None else 0
+        hi = int(np.searchsorted(ts, to_utc_ns(end)[0], side='right')) if end is not None else rows
+        columns = {'ts': np.array(ts[lo:hi])}
+        for field in FIELDS:
+            values = np.memmap(self._column_path(directory, field, generation), dtype=COLUMN_DTYPES[field],
+                               mode='r', shape=(rows,))
+            columns[field] = np.array(values[lo:hi])
+        return columns
+
+    def read_columns(self, symbol, timeframe, start=None, end=None):
+        """Bars as a dict of numpy arrays. Timeframes without their own partition are resampled from 1m."""
+        if timeframe not in TIMEFRAMES:
+            raise ValueError(f"Unknown timeframe {timeframe!r}; expected one of {TIMEFRAMES}")
+        if self.has(symbol, timeframe) or timeframe == BASE_TIMEFRAME:
+            return self._columns(symbol, timeframe, start, end)
+        # Widen the 1m window to whole buckets so the first and last bars are complete
+        base_start = int(bucket_keys(to_utc_ns(start), timeframe)[0]) if start is not None else None
+        base_end = int(bucket_end(to_utc_ns(end), timeframe)[0]) if end is not None else None
+        return resample_bars(self._columns(symbol, BASE_TIMEFRAME, base_start, base_end), timeframe)
+
+    def read(self, symbol, timeframe, start=None, end=None):
+        """Bars for [start, end] (inclusive, UTC) as a yfinance-style DataFrame."""
+        return bars_to_frame(self.read_columns(symbol, timeframe, start, end))
+
+    def history(self, symbol, period='5d', timeframe='1d'):
+        """Stand-in for yf.Ticker(symbol).history(period=...) that reads the store."""
+        return self.read(symbol, timeframe, start=period_start(period))
+
+    def history_summary(self, symbols, period='5d', timeframe='1d'):
+        """Same shape as PriceBatch.fetch_history_summary (first_date, last_date, volume_sum, bars, failed),
+        computed from stored bars with no network I/O."""
+        rows = []
+        for symbol in dict.fromkeys(symbols):
+            bars = self.history(symbol, period, timeframe)
+            rows.append({'symbol': symbol, 'first_date': bars.index[0] if len(bars) else pd.NaT,
+                         'last_date': bars.index[-1] if len(bars) else pd.NaT,
+                         'volume_sum': float(bars['Volume'].sum()), 'bars': len(bars), 'failed': False})
+        summary = pd.DataFrame(rows, columns=['symbol', 'first_date', 'last_date', 'volume_sum', 'bars', 'failed'])
+        return summary.set_index('symbol')
@@ -0,0 +1,242 @@
+# ========== OFFLINE BENCHMARK ==========
+# Measures throughput and memory of the data pipeline without touching Yahoo. Yahoo is replaced
+# by ReplayYahoo fixtures built from master_data13.csv and report-weekly_symbol_status.csv, with
+# configurable latency and error injection; the Accounts_History_* exports are scaled up to the
+# requested transaction count and master_data to the requested symbol count.
+#
+# Each stage runs in its own spawned process so its peak RSS is not mixed with other stages:
+#   clean   - DataCleaning.clean_file on the scaled Fidelity export
+#   master  - DataCleaning.update_master_data for the symbols missing from master_data
+#   enrich  - DataProcessingBackUp.enrich_master_data over the scaled master_data
+#   scan    - checkDelistings.perform_symbol_activity_check over the scaled master_data
+#
+# Usage:
+#   python Benchmark.py --symbols 50000 --transactions 1000000 --latency 0.02 --error-rate 0.01
+
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import string
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_DIR = os.path.join(SCRIPTS_DIR, '..', 'data', 'raw')
+BASE_MASTER = os.path.join(RAW_DIR, 'master_data13.csv')
+BASE_STATUS = os.path.join(RAW_DIR, 'report-weekly_symbol_status.csv')
+BASE_EXPORTS = [os.path.join(RAW_DIR, f'Accounts_History_{year}.csv') for year in (2021, 2022, 2023, 2024)]
+RESULTS_DIR = os.path.join(SCRIPTS_DIR, '..', 'data', 'metrics')
+
+STAGES = ['clean', 'master', 'enrich', 'scan']
+NEW_SYMBOL_FRACTION = 0.1  # Share of symbols held out of master_data for the master update stage
+
+
+# ========== SYNTHETIC SCALE-UP ==========
+def synthetic_symbols(count, taken):
+    """Yields `count` new 4-5 letter tickers not in `taken` (deterministic order)."""
+    letters = string.ascii_uppercase
+    names = itertools.chain((''.join(p) for p in itertools.product(letters, repeat=4)),
+                            (''.join(p) for p in itertools.product(letters, repeat=5)))
+    return list(itertools.islice((n for n in names if n not in taken), count))
+
+
+def scale_master(master, symbols, seed=0):
+    """Master data with `symbols` rows: the base rows plus copies of random base rows under new tickers."""
+    master = master.dropna(subset=['symbol']).drop_duplicates('symbol').reset_index(drop=True)
+    if symbols <= len(master):
+        return master.head(symbols).copy()
+    rng = np.random.default_rng(seed)
+    extra = master.iloc[rng.integers(0, len(master), symbols - len(master))].copy()
+    extra['symbol'] = synthetic_symbols(len(extra), set(master['symbol']))
+    return pd.concat([master, extra], ignore_index=True)
+
+
+def read_raw_exports(paths):
+    """Reads the raw Fidelity exports as text, keeping the original column layout."""
+    from FidelityReader import read_fidelity_export
+    return pd.concat([read_fidelity_export(p) for p in paths], ignore_index=True)
+
+
+def write_fidelity_export(rows, path):
+    """Writes rows in the raw export layout: BOM + blank preamble, padded fields, disclaimer footer."""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        f.write('\n\n')
+        body = rows.copy()
+        for column in body.columns:
+            body[column] = ' ' + body[column].astype(str).replace({'nan': ''})
+        body.to_csv(f, index=False, lineterminator='\n')
+        f.write('\n\n"The data and information in this spreadsheet is provided to you solely for your use."\n')
+
+
+def scale_transactions(raw, rows, symbols, seed=0):
+    """Samples `rows` transactions from the base exports, remapped onto `symbols` and spread over 2021-2024."""
+    rng = np.random.default_rng(seed)
+    sample = raw.iloc[rng.integers(0, len(raw), rows)].reset_index(drop=True)
+    equity = sample['Symbol'].str.fullmatch(r'[A-Z]{1,5}', na=False).to_numpy()
+    new_symbols = np.asarray(symbols, dtype=object)[rng.integers(0, len(symbols), rows)]
+    sample['Symbol'] = np.where(equity, new_symbols, sample['Symbol'])
+    days = pd.to_datetime('2021-01-04') + pd.to_timedelta(rng.integers(0, 4 * 365, rows), unit='D')
+    sample['Run Date'] = days.strftime('%m/%d/%Y')
+    return sample.sort_values('Run Date', ascending=False, kind='stable')
+
+
+def prepare_inputs(workdir, symbols, transactions, seed=0):
+    """Builds the scaled master, held-out master, fixtures and export under workdir. Returns their paths."""
+    from ReplayYahoo import build_fixtures, save_fixtures
+
+    master = scale_master(pd.read_csv(BASE_MASTER, dtype=str), symbols, seed)
+    status = pd.read_csv(BASE_STATUS, dtype=str)
+    paths = {
+        'master': os.path.join(workdir, 'master_data_scaled.csv'),
+        'held_out_master': os.path.join(workdir, 'master_data_held_out.csv'),
+        'new_symbols': os.path.join(workdir, 'new_symbols.csv'),
+        'fixtures': os.path.join(workdir, 'fixtures.json'),
+        'export': os.path.join(workdir, 'Accounts_History_scaled.csv'),
+    }
+    master.to_csv(paths['master'], index=False)
+
+    # Hold out a slice of symbols so the master update stage has new symbols to fetch
+    held_out = master.sample(frac=NEW_SYMBOL_FRACTION, random_state=seed)
+    master.drop(held_out.index).to_csv(paths['held_out_master'], index=False)
+    held_out[['symbol']].to_csv(paths['new_symbols'], index=False)
+
+    save_fixtures(build_fixtures(master, status), paths['fixtures'])
+    raw = read_raw_exports(BASE_EXPORTS)
+    write_fidelity_export(scale_transactions(raw, transactions, master['symbol'].tolist(), seed), paths['export'])
+    return paths
+
+
+# ========== STAGE RUNNER (child process) ==========
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is in KB on Linux
+
+
+def _run_stage(stage, paths, config):
+    """Runs one stage inside a fresh process with yfinance replaced by the replay backend."""
+    workdir = os.path.dirname(paths['master'])
+    os.chdir(workdir)  # Scripts create relative data/ and log paths at import time
+    sys.path.insert(0, SCRIPTS_DIR)
+    os.environ['BITBOT_HEADLESS'] = '1'
+
+    import Instrumentation
+    Instrumentation.METRICS_DIR = os.path.join(workdir, 'metrics')
+    Instrumentation.METRICS_LOG = os.path.join(workdir, 'metrics', 'metrics.jsonl')
+    import ReviewGate
+    ReviewGate.REVIEW_DIR = os.path.join(workdir, 'reviews')
+    import BarStore
+    BarStore.BARS_DIR = os.path.join(workdir, 'bars')
+    shutil.rmtree(BarStore.BARS_DIR, ignore_errors=True)  # Each stage starts from an empty bar store
+    from MetadataCache import MetadataCache
+    from ReplayYahoo import ReplayBackend, load_fixtures, patch_yfinance
+    from SymbolStore import SymbolStore
+
+    backend = ReplayBackend(load_fixtures(paths['fixtures']), latency=config['latency'],
+                            error_rate=config['error_rate'], seed=config['seed'])
+    # Cold cache and no enrichment checkpoint, also when a workdir is reused
+    cache_path = os.path.join(workdir, f'cache_{stage}.sqlite')
+    checkpoint_path = os.path.join(workdir, 'enrich_checkpoint.json')
+    for stale in (cache_path, checkpoint_path):
+        if os.path.exists(stale):
+            os.remove(stale)
+    quiet = open(os.devnull, 'w')  # The scripts print a line per symbol
+
+    with patch_yfinance(backend), contextlib.redirect_stdout(quiet), contextlib.redirect_stderr(quiet):
+        # Import the scripts before timing so module set-up is not counted
+        import DataCleaning
+        import DataProcessingBackUp
+        import checkDelistings
+        from RateLimiter import RateLimiter
+        baseline_mb = _peak_rss_mb()
+
+        start = time.perf_counter()
+        if stage == 'clean':
+            DataCleaning.SETTINGS['DEBUG'] = False
+            items = len(DataCleaning.clean_file(paths['export']))
+
+        elif stage == 'master':
+            DataCleaning.SETTINGS.update({'DEBUG': False, 'REVIEW_MODE': False})
+            DataCleaning.info_cache = MetadataCache(cache_path)
+            DataCleaning.symbol_store = SymbolStore(os.path.join(workdir, 'symbol_store.sqlite'))
+            new_symbols = pd.read_csv(paths['new_symbols'], dtype=str)
+            DataCleaning.update_master_data(new_symbols, paths['held_out_master'], workdir)
+            items = len(new_symbols)
+
+        elif stage == 'enrich':
+            DataProcessingBackUp.DEBUG = False
+            DataProcessingBackUp.ENRICH_WORKERS = config['workers']
+            DataProcessingBackUp.info_cache = MetadataCache(cache_path)
+            master = pd.read_csv(paths['master'], dtype=str)
+            DataProcessingBackUp.enrich_master_data(master, checkpoint_path)
+            items = len(master)
+
+        elif stage == 'scan':
+            checkDelistings.yahoo_limiter = RateLimiter(config['rate_limit'])
+            checkDelistings.info_cache = MetadataCache(cache_path, limiter=checkDelistings.yahoo_limiter)
+            tickers = pd.read_csv(paths['master'], dtype=str)['symbol'].tolist()
+            checkDelistings.perform_symbol_activity_check(tickers, workers=config['workers'],
+                                                          output_path=os.path.join(workdir, 'scan_report.csv'))
+            items = len(tickers)
+        seconds = time.perf_counter() - start
+
+    return {
+        'stage': stage, 'items': items, 'seconds': round(seconds, 3),
+        'items_per_sec': round(items / seconds, 1) if seconds else None,
+        'peak_rss_mb': round(_peak_rss_mb(), 1), 'baseline_rss_mb': round(baseline_mb, 1),
+        'yahoo_calls': dict(backend.calls),
+        'latency': Instrumentation.metrics.latency_summary(),
+        'counters': dict(Instrumentation.metrics.counters),
+    }
+
+
+def run_benchmark(stages, symbols, transactions, latency, error_rate, workers, rate_limit, seed=0, workdir=None):
+    """Prepares the scaled inputs and runs each stage in its own process. Returns the list of results."""
+    # Absolute, since each stage process chdirs into the workdir before opening the input paths
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix='bitbot_bench_'))
+    os.makedirs(workdir, exist_ok=True)
+    print(f"Preparing {symbols} symbols and {transactions} transactions in {workdir} ...")
+    paths = prepare_inputs(workdir, symbols, transactions, seed)
+    config = {'latency': latency, 'error_rate': error_rate, 'workers': workers, 'rate_limit': rate_limit,
+              'seed': seed}
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for stage in stages:
+        with context.Pool(1) as pool:
+            result = pool.apply(_run_stage, (stage, paths, config))
+        results.append(result)
+        print(f"  {stage:<7} {result['items']:>9} items  {result['seconds']:>9.2f}s  "
+              f"{result['items_per_sec'] or 0:>10.1f} items/s  peak RSS {result['peak_rss_mb']:.0f} MB")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline throughput/memory benchmark of the data pipeline")
+    parser.add_argument('--stages', default=','.join(STAGES), help=f"Comma-separated subset of {STAGES}")
+    parser.add_argument('--symbols', type=int, default=2702, help="Master data size (scaled up from master_data13)")
+    parser.add_argument('--transactions', type=int, default=100000, help="Rows in the synthetic Fidelity export")
+    parser.add_argument('--latency', type=float, default=0.02, help="Simulated seconds per Yahoo call")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of Yahoo calls that time out")
+    parser.add_argument('--workers', type=int, default=8, help="Worker count for enrichment and the scan")
+    parser.add_argument('--rate-limit', type=float, default=0, help="Requests/second for the scan (0 = unlimited)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=None, help="Directory for generated inputs (default: a temp dir)")
+    args = parser.parse_args()
+
+    stage_results = run_benchmark([s.strip() for s in args.stages.split(',') if s.strip()], args.symbols,
+                                  args.transactions, args.latency, args.error_rate, args.workers,
+                                  args.rate_limit, args.seed, args.workdir)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_path = os.path.join(RESULTS_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(results_path, 'w') as f:
+        json.dump({'args': vars(args), 'results': stage_results}, f, indent=1)
+    print(f"Benchmark results saved to {results_path}")
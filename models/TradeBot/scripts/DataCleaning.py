@@ -3,16 +3,36 @@
 
 SETTINGS = {
     "REVIEW_MODE": True,            # If True, program prompts for review; if False, auto-updates without prompts
+                                    # (run with --headless or BITBOT_HEADLESS=1 to skip every prompt; see ReviewGate)
     "DEBUG": True,                  # If True, print debug statements; if False, suppress debug output
     "REVIEW_FREQUENCY": 10,         # Number of rows to process before pausing for review
     "FILL_ONLY_IF_BLANK": True,     # If True, only fills blank values in master_data69_updated
-    "REPORT_INCOMPLETE_ROWS": True  # If True, displays rows with missing data for review
+    "REPORT_INCOMPLETE_ROWS": True, # If True, displays rows with missing data for review
+    "INCREMENTAL": True,            # If True, only new rows are cleaned and appended to the persistent ledger
+    "LEDGER_FILE": "cleaned_assets_ledger.csv",  # Persistent cleaned ledger used in incremental mode
+    "MANIFEST_FILE": "ingest_manifest.json",     # Per-file content hash and transaction_date watermark
+    "CHUNK_SIZE": 50000,            # Rows per chunk when streaming raw Fidelity exports
+    "POSITIONS_FILE": "positions_snapshot.json"  # PositionEngine snapshot, updated with each run's new rows
 }
 import pandas as pd
 import os
 import logging
-import yfinance as yf
+import hashlib
+import json
+from collections import Counter
 from datetime import datetime
+from PriceBatch import fetch_history_summary
+from MetadataCache import MetadataCache
+from MasterDataMerge import build_updates, apply_symbol_updates
+from Storage import read_table, write_table
+from FidelityReader import iter_fidelity_chunks
+from ActionParser import add_action_columns
+from PositionEngine import PositionEngine
+from SymbolStore import SymbolStore, store_path, version_from_path
+from BarStore import BarStore
+from ReviewGate import gated, pause, promote_table_action, write_review
+from Instrumentation import metrics
+from SymbolClassifier import needs_lookup, to_yahoo_symbols
 
 # Setup logging to record errors to a file
 logging.basicConfig(filename='cleaning_errors.log', level=logging.ERROR, 
@@ -26,80 +46,253 @@ new_data_paths = [
     'data/raw/Accounts_History_2024.csv'
 ]
 output_dir = 'data/cleaned/'
+rename_columns = {
+    'Run Date': 'transaction_date', 'Account': 'portfolio_name', 'Action': 'notes', 
+    'Symbol': 'symbol', 'Description': 'asset_name', 'Quantity': 'quantity', 
+    'Price': 'price', 'Amount': 'transaction_amount', 'Commission': 'commission', 'Fees': 'fees'
+}
+ledger_columns = ['symbol', 'asset_name', 'quantity', 'price', 'transaction_amount', 
+                  'commission', 'fees', 'portfolio_name', 'transaction_date', 'notes']
+parsed_columns = ['action_type', 'is_margin', 'parsed_symbol']  # Added by ActionParser
+LEDGER_STATE_KEY = '_ledger'  # Manifest entry holding the ledger size covered by the saved watermarks
 master_data_path = 'master_data69.csv'  # Path to the master data file
 
 # Ensure output directory exists
 os.makedirs(output_dir, exist_ok=True)
 
+# Shared on-disk cache for yfinance .info lookups
+info_cache = MetadataCache()
+
+# Versioned (symbol, field, value, valid_from_version) history of master_data
+symbol_store = SymbolStore(store_path('cleaning'))  # Own lineage: master_data69 versions
+
+# Local OHLCV store; the full daily history downloaded for first-traded dates is kept here
+bar_store = BarStore()
+
 # ========== DATA CLEANING FUNCTION ==========
+def iter_clean_chunks(file_path):
+    """Streams a Fidelity export through FidelityReader and yields cleaned chunks in the standard ledger columns."""
+    # Only the columns that are kept are parsed; Type, Exchange*, Currency, Accrued Interest etc. are skipped
+    for data in iter_fidelity_chunks(file_path, usecols=rename_columns, chunksize=SETTINGS["CHUNK_SIZE"]):
+        # Standard cleaning process (fields are already trimmed by the reader): drop rows with no symbol, rename columns
+        data = data.dropna(subset=['Symbol'])
+        data = data.rename(columns=rename_columns)
+
+        # Fill missing values in financial columns
+        data['commission'] = data['commission'].fillna(0)
+        data['fees'] = data['fees'].fillna(0)
+
+        # Keep only the columns we want in the final version
+        data = data[ledger_columns]
+
+        # Ensure transaction dates are in a uniform format
+        data['transaction_date'] = pd.to_datetime(data['transaction_date'], format='%m/%d/%Y').dt.strftime('%Y/%m/%d')
+        data['symbol'] = data['symbol'].str.lstrip('-')  # Remove any leading dashes from symbols
+
+        # Parse trade side, margin flag and embedded ticker out of the free-text notes
+        yield add_action_columns(data)
+
+def clean_file(file_path):
+    """Cleans a single Fidelity Accounts_History export into the standard ledger columns."""
+    chunks = list(iter_clean_chunks(file_path))
+    data = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=ledger_columns + parsed_columns)
+    if SETTINGS["DEBUG"]:
+        print(f"[DEBUG] Loaded {file_path} with {data.shape[0]} rows")
+    return data
+
 def clean_data(file_paths, output_dir):
     """Cleans multiple Fidelity data files, consolidates them, 
-    and saves the cleaned data as cleaned_assets_ledger_data_<timestamp>.csv"""
-    combined_data = []  # List to store each cleaned DataFrame
+    and saves the cleaned data as cleaned_assets_ledger_data_<timestamp>.csv.
+    In INCREMENTAL mode only new rows are cleaned and appended to the persistent ledger instead."""
+    with metrics.stage('clean') as stage:
+        if SETTINGS["INCREMENTAL"]:
+            consolidated_data, output_file = ingest_incremental(file_paths, output_dir)
+        else:
+            combined_data = []  # List to store each cleaned DataFrame
+
+            for file_path in file_paths:
+                try:
+                    # Append the cleaned DataFrame to the combined list
+                    combined_data.append(clean_file(file_path))
+
+                except Exception as e:
+                    logging.error(f"Error during data cleaning for {file_path}: {e}")
+                    if SETTINGS["DEBUG"]:
+                        print(f"[DEBUG] Error during data cleaning for {file_path}: {e}")
+
+            # Concatenate all cleaned data files into a single DataFrame
+            consolidated_data = pd.concat(combined_data, ignore_index=True)
+
+            # Generate a timestamped output file name
+            timestamp = datetime.now().strftime('%Y%m%d')
+            output_file = os.path.join(output_dir, f"cleaned_assets_ledger_data_{timestamp}.csv")
+
+            # Save the cleaned consolidated data
+            write_table(consolidated_data, output_file, schema='ledger')
+        stage.rows = len(consolidated_data)
+
+    if SETTINGS["DEBUG"]:
+        print(f"[DEBUG] {os.path.basename(output_file)} saved in dir {output_dir}. Please review.")
+        pause("Press Enter to get basic information about these symbols...")
+    
+    return consolidated_data
+
+# ========== INCREMENTAL INGESTION ==========
+def file_sha256(file_path, block_size=1 << 20):
+    """Returns the SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(manifest_path):
+    """Loads the ingestion manifest, or an empty one on the first run."""
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def save_manifest(manifest, manifest_path):
+    """Writes the manifest atomically so an interrupted run never leaves it half written."""
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def truncate_uncommitted_rows(ledger_path, manifest):
+    """Cuts ledger bytes appended after the last saved manifest. A crash between the append and the
+    manifest save leaves rows whose watermark never advanced; they are re-ingested, so the copy is dropped."""
+    committed = manifest.get(LEDGER_STATE_KEY, {}).get('bytes')
+    if committed is None or not os.path.exists(ledger_path):
+        return
+    if os.path.getsize(ledger_path) > committed:
+        logging.error(f"Dropping {os.path.getsize(ledger_path) - committed} uncommitted bytes from {ledger_path}")
+        with open(ledger_path, 'r+b') as f:
+            f.truncate(committed)
+
+def migrate_ledger_columns(ledger_path, manifest, manifest_path):
+    """Rewrites a ledger created before the parsed action columns existed (10-column header) once,
+    adding action_type/is_margin/parsed_symbol parsed from its notes, so new rows line up with the header."""
+    if not os.path.exists(ledger_path) or os.path.getsize(ledger_path) == 0:
+        return
+    header = list(pd.read_csv(ledger_path, nrows=0).columns)
+    if header == ledger_columns + parsed_columns:
+        return
+    ledger = pd.read_csv(ledger_path, dtype=str)  # Text in, text out: existing values are kept as written
+    ledger = add_action_columns(ledger.reindex(columns=ledger_columns))
+    tmp_path = ledger_path + '.tmp'
+    ledger.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, ledger_path)
+    # The rewritten file holds the same rows, so record its size right away (see truncate_uncommitted_rows)
+    manifest[LEDGER_STATE_KEY] = {'bytes': os.path.getsize(ledger_path)}
+    save_manifest(manifest, manifest_path)
+    print(f"Migrated {ledger_path} to the {len(ledger_columns + parsed_columns)}-column ledger layout")
+
+def row_hashes(data):
+    """Hashes each ledger row so rows on the watermark date can be matched across runs."""
+    # Only the raw ledger columns are hashed, so derived columns do not invalidate existing watermarks
+    return [str(h) for h in pd.util.hash_pandas_object(data[ledger_columns].astype(str), index=False)]
+
+def rows_after_watermark(data, watermark, seen):
+    """Returns rows newer than the watermark, plus rows on the watermark date that were not ingested yet.
+    `seen` counts the hashes of rows already ingested on the watermark date and is consumed across chunks."""
+    if not watermark:
+        return data
+
+    # Dates are stored as YYYY/MM/DD, so string comparison orders them correctly
+    newer = data[data['transaction_date'] > watermark]
+    same_day = data[data['transaction_date'] == watermark]
+
+    # Rows already ingested on the watermark date are matched by hash (as a multiset, for identical fills)
+    keep = []
+    for row_hash in row_hashes(same_day):
+        if seen[row_hash] > 0:
+            seen[row_hash] -= 1
+            keep.append(False)
+        else:
+            keep.append(True)
+    return pd.concat([same_day[keep], newer])
+
+def ingest_incremental(file_paths, output_dir):
+    """Cleans only changed source files and appends rows past each file's watermark to the persistent ledger.
+    Returns the newly appended rows and the ledger path."""
+    manifest_path = os.path.join(output_dir, SETTINGS["MANIFEST_FILE"])
+    ledger_path = os.path.join(output_dir, SETTINGS["LEDGER_FILE"])
+    manifest = load_manifest(manifest_path)
+    truncate_uncommitted_rows(ledger_path, manifest)
+    migrate_ledger_columns(ledger_path, manifest, manifest_path)
+    new_rows = []
 
     for file_path in file_paths:
         try:
-            data = pd.read_csv(file_path)
-            if SETTINGS["DEBUG"]:
-                print(f"[DEBUG] Loaded {file_path} with {data.shape[0]} rows")
-
-            # Standard cleaning process: remove extra spaces, drop rows with no symbol, rename columns
-            data = data.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
-            data = data.dropna(subset=['Symbol'])
-            
-            rename_columns = {
-                'Run Date': 'transaction_date', 'Account': 'portfolio_name', 'Action': 'notes', 
-                'Symbol': 'symbol', 'Description': 'asset_name', 'Quantity': 'quantity', 
-                'Price': 'price', 'Amount': 'transaction_amount', 'Commission': 'commission', 'Fees': 'fees'
-            }
-            data = data.rename(columns=rename_columns)
-
-            # Fill missing values in financial columns
-            data['commission'] = data['commission'].fillna(0)
-            data['fees'] = data['fees'].fillna(0)
+            key = os.path.basename(file_path)
+            entry = manifest.get(key, {})
+            content_hash = file_sha256(file_path)
+            if entry.get('sha256') == content_hash:
+                if SETTINGS["DEBUG"]:
+                    print(f"[DEBUG] {file_path} unchanged since last run, skipping")
+                continue
 
-            # Drop unnecessary columns
-            data.drop(columns=['Type', 'Exchange Quantity', 'Exchange Currency', 'Currency', 
-                               'Exchange Rate', 'Accrued Interest', 'Settlement Date'], inplace=True, errors='ignore')
+            watermark = entry.get('last_transaction_date')
+            seen = Counter(entry.get('watermark_row_hashes', []))
+            latest, latest_hashes = None, []
+            row_count = appended_count = 0
+            file_rows = []  # Only added to new_rows once the whole file was read and its manifest entry written
 
-            # Keep only the columns we want in the final version
-            final_columns_order = ['symbol', 'asset_name', 'quantity', 'price', 'transaction_amount', 
-                                   'commission', 'fees', 'portfolio_name', 'transaction_date', 'notes']
-            data = data[final_columns_order]
+            # Stream the file chunk by chunk, keeping only rows past the watermark
+            for data in iter_clean_chunks(file_path):
+                appended = rows_after_watermark(data, watermark, seen)
+                file_rows.append(appended)
+                appended_count += appended.shape[0]
+                row_count += data.shape[0]
 
-            # Ensure transaction dates are in a uniform format
-            data['transaction_date'] = pd.to_datetime(data['transaction_date'], format='%m/%d/%Y').dt.strftime('%Y/%m/%d')
-            data['symbol'] = data['symbol'].str.lstrip('-')  # Remove any leading dashes from symbols
+                # Track the latest date in the file and the hashes of its rows for the next watermark
+                if not data.empty:
+                    chunk_latest = data['transaction_date'].max()
+                    if latest is None or chunk_latest > latest:
+                        latest, latest_hashes = chunk_latest, []
+                    if chunk_latest == latest:
+                        latest_hashes += row_hashes(data[data['transaction_date'] == latest])
 
-            # Append the cleaned DataFrame to the combined list
-            combined_data.append(data)
+            # Advance the watermark to the latest date seen in this file
+            manifest[key] = {
+                'sha256': content_hash,
+                'last_transaction_date': latest if latest is not None else watermark,
+                'watermark_row_hashes': latest_hashes if latest is not None else entry.get('watermark_row_hashes', []),
+                'rows': row_count,
+                'ingested_at': datetime.now().isoformat(timespec='seconds'),
+            }
+            new_rows.extend(file_rows)
+            if SETTINGS["DEBUG"]:
+                print(f"[DEBUG] {file_path}: {appended_count} new rows after watermark {watermark}")
 
         except Exception as e:
-            logging.error(f"Error during data cleaning for {file_path}: {e}")
+            # The file's rows are dropped with it; its watermark did not move, so the next run ingests them once
+            logging.error(f"Error during incremental ingestion for {file_path}: {e}")
             if SETTINGS["DEBUG"]:
-                print(f"[DEBUG] Error during data cleaning for {file_path}: {e}")
+                print(f"[DEBUG] Error during incremental ingestion for {file_path}: {e}")
 
-    # Concatenate all cleaned data files into a single DataFrame
-    consolidated_data = pd.concat(combined_data, ignore_index=True)
+    new_data = pd.concat(new_rows, ignore_index=True) if new_rows else pd.DataFrame(columns=ledger_columns + parsed_columns)
 
-    # Generate a timestamped output file name
-    timestamp = datetime.now().strftime('%Y%m%d')
-    output_file = os.path.join(output_dir, f"cleaned_assets_ledger_data_{timestamp}.csv")
-
-    # Save the cleaned consolidated data
-    consolidated_data.to_csv(output_file, index=False)
-    if SETTINGS["DEBUG"]:
-        print(f"[DEBUG] cleaned_assets_ledger_data_{timestamp}.csv saved in dir {output_dir}. Please review.")
-        input("Press Enter to get basic information about these symbols...")
-    
-    return consolidated_data
+    # Append before saving the manifest; the manifest records the ledger size it covers, so rows from a
+    # crash in between are truncated on the next run and re-ingested once
+    if not new_data.empty:
+        with open(ledger_path, 'a', newline='', encoding='utf-8') as f:
+            new_data[ledger_columns + parsed_columns].to_csv(f, header=f.tell() == 0, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+    if os.path.exists(ledger_path):
+        manifest[LEDGER_STATE_KEY] = {'bytes': os.path.getsize(ledger_path)}
+    save_manifest(manifest, manifest_path)
+    return new_data, ledger_path
 
 # ========== UPDATE MASTER DATA FUNCTION ==========
 def update_master_data(consolidated_data, master_data_path, output_dir):
     """Updates the master data file with new symbols from the consolidated data and fetches additional data from yfinance."""
     try:
         # Load the master data file
-        master_data = pd.read_csv(master_data_path)
+        master_data = read_table(master_data_path, schema='master_data')
         if SETTINGS["DEBUG"]:
             print(f"[DEBUG] Loaded master data with {master_data.shape[0]} rows")
         
@@ -110,69 +303,124 @@ def update_master_data(consolidated_data, master_data_path, output_dir):
         if SETTINGS["REVIEW_MODE"]:
             print("[REVIEW] New symbols identified:")
             print(new_symbols['symbol'].unique())
-            input("Press Enter to continue with data fetching...")
+            pause("Press Enter to continue with data fetching...")
 
         # Append new symbols to the master data
         updated_master_data = pd.concat([master_data, new_symbols], ignore_index=True)
         
+        # Only listed equities are looked up; options, CUSIPs and cash positions are skipped
+        lookup_symbols = pd.Series(new_symbols['symbol'].dropna().unique())
+        lookup_symbols = lookup_symbols[needs_lookup(lookup_symbols)]
+        yahoo_symbols = dict(zip(lookup_symbols, to_yahoo_symbols(lookup_symbols)))
+
+        # Fetch first traded dates for all new symbols in batched downloads
+        with metrics.stage('history_summary', rows=len(yahoo_symbols)):
+            history_summary = fetch_history_summary(list(yahoo_symbols.values()), period="max", chunk_size=50,
+                                                    store=bar_store)
+
         # Fetch sector, industry, and first traded date for new symbols using yfinance
-        for i, symbol in enumerate(new_symbols['symbol'].unique(), 1):
+        fetched_records = []  # Side table of fetched values, merged into the master data in one pass below
+        failed_symbols = {}   # Symbols whose fetch failed, listed in the review artifact
+        for i, (symbol, yahoo_symbol) in enumerate(yahoo_symbols.items(), 1):
             try:
-                ticker = yf.Ticker(symbol)
-                sector = ticker.info.get('sector')
-                industry = ticker.info.get('industry')
+                info = info_cache.get_info(yahoo_symbol, ['sector', 'industry'])
+                sector = info.get('sector')
+                industry = info.get('industry')
                 
-                # Get historical data to find the first traded date
-                hist_data = ticker.history(period="max")
-                first_traded = hist_data.index[0].strftime('%Y/%m/%d') if not hist_data.empty else None
-
-                # Fill only if blanks if the setting is enabled
-                if SETTINGS["FILL_ONLY_IF_BLANK"]:
-                    if pd.isna(updated_master_data.loc[updated_master_data['symbol'] == symbol, 'sector']).all():
-                        updated_master_data.loc[updated_master_data['symbol'] == symbol, 'sector'] = sector
-                    if pd.isna(updated_master_data.loc[updated_master_data['symbol'] == symbol, 'industry']).all():
-                        updated_master_data.loc[updated_master_data['symbol'] == symbol, 'industry'] = industry
-                    if pd.isna(updated_master_data.loc[updated_master_data['symbol'] == symbol, 'first_traded']).all():
-                        updated_master_data.loc[updated_master_data['symbol'] == symbol, 'first_traded'] = first_traded
-                else:
-                    updated_master_data.loc[updated_master_data['symbol'] == symbol, 'sector'] = sector
-                    updated_master_data.loc[updated_master_data['symbol'] == symbol, 'industry'] = industry
-                    updated_master_data.loc[updated_master_data['symbol'] == symbol, 'first_traded'] = first_traded
+                # Look up the first traded date from the batched history summary
+                first_date = history_summary['first_date'].get(yahoo_symbol, pd.NaT)
+                first_traded = first_date.strftime('%Y/%m/%d') if pd.notna(first_date) else None
+                if history_summary['failed'].get(yahoo_symbol, False):
+                    # Left blank (not 'Unknown') and listed for review, so the next run fetches it again
+                    failed_symbols[symbol] = 'price history download failed'
+
+                fetched_records.append({'symbol': symbol, 'sector': sector, 'industry': industry,
+                                        'first_traded': first_traded})
 
                 # Display the fetched data in CSV format
                 print(f"{symbol},{sector},{industry},{first_traded}")
 
                 # Review every 10 rows if in review mode
                 if SETTINGS["REVIEW_MODE"] and i % SETTINGS["REVIEW_FREQUENCY"] == 0:
-                    input(f"[REVIEW] Press Enter to continue after reviewing {i} rows...")
+                    pause(f"[REVIEW] Press Enter to continue after reviewing {i} rows...")
 
             except Exception as e:
                 logging.error(f"Error fetching data for {symbol}: {e}")
+                failed_symbols[symbol] = e
                 if SETTINGS["DEBUG"]:
                     print(f"[DEBUG] Error fetching data for {symbol}: {e}")
 
+        # Apply all fetched values with a single symbol-keyed merge, filling only blanks if the setting is enabled
+        with metrics.stage('merge_updates', rows=len(fetched_records)):
+            updates = build_updates(fetched_records, ['sector', 'industry', 'first_traded'])
+            updated_master_data = apply_symbol_updates(updated_master_data, updates,
+                                                       fill_only_if_blank=SETTINGS["FILL_ONLY_IF_BLANK"])
+
         # Prompt user to review the final updated master data if in review mode
         if SETTINGS["REVIEW_MODE"]:
             print("[REVIEW] Final version of updated master data:")
             print(updated_master_data.tail())
-            input("Press Enter to save the final updated master data...")
+            pause("Press Enter to save the final updated master data...")
 
         # Save the updated master data with a new name
         updated_master_data_path = os.path.join(output_dir, "master_data69_updated.csv")
-        updated_master_data.to_csv(updated_master_data_path, index=False)
-        
+        with metrics.stage('write_master', rows=len(updated_master_data)):
+            write_table(updated_master_data, updated_master_data_path, schema='master_data')
+
+        # The updated file is the next version after the master data it was built from (or after the last one
+        # recorded, when reruns on the same base changed it); an unchanged rerun records nothing
+        version = max(version_from_path(master_data_path), symbol_store.latest_version() or 0) + 1
+        changed = symbol_store.record_version(updated_master_data, version, source=updated_master_data_path,
+                                              skip_unchanged=True)
+
         if SETTINGS["DEBUG"]:
             print(f"[DEBUG] Updated master data saved to {updated_master_data_path}")
+            print(f"[DEBUG] Symbol store: {changed} changed fields recorded as version {version}" if changed
+                  else "[DEBUG] Symbol store: master data unchanged since the last recorded version")
+
+        # Review artifact (new symbols, changed fields, failed fetches); replacing the live master waits for approval
+        review_path = write_review('master_data', master_data, updated_master_data, failed_rows=failed_symbols)
+        print(f"Review artifact written to {review_path}")
+        gated(f"Replace {master_data_path} with {updated_master_data_path}?",
+              promote_table_action(updated_master_data_path, master_data_path, schema='master_data'), review_path)
 
     except Exception as e:
         logging.error(f"Error updating master data: {e}")
         if SETTINGS["DEBUG"]:
             print(f"[DEBUG] Error updating master data: {e}")
 
+# ========== POSITIONS ==========
+def update_positions(new_data, output_dir):
+    """Applies newly cleaned rows to the saved position snapshot (rebuilt from scratch outside INCREMENTAL mode)."""
+    snapshot_path = os.path.join(output_dir, SETTINGS["POSITIONS_FILE"])
+    with metrics.stage('positions', rows=len(new_data)):
+        engine = PositionEngine.load(snapshot_path) if SETTINGS["INCREMENTAL"] else PositionEngine()
+        applied = engine.apply_transactions(new_data)
+        engine.save(snapshot_path)
+    if SETTINGS["DEBUG"]:
+        print(f"[DEBUG] Applied {applied} fills to positions (as of {engine.as_of}); "
+              f"{len(engine.positions_frame())} open positions")
+    return engine
+
 # ========== MAIN EXECUTION ==========
 if __name__ == "__main__":
+    metrics.run_name = 'data_cleaning'
+
     # Clean the new data
     consolidated_data = clean_data(new_data_paths, output_dir)
+
+    # Fold the new fills into the running positions
+    if not consolidated_data.empty:
+        update_positions(consolidated_data, output_dir)
     
     # Update the master data with any new symbols found and fill in missing information
-    update_master_data(consolidated_data, master_data_path, output_dir)
+    if consolidated_data.empty:
+        print("No new transactions since the last run; master data is already up to date.")
+    else:
+        update_master_data(consolidated_data, master_data_path, output_dir)
+
+    # Per-stage timings, Yahoo latency percentiles and cache hit rates for this run
+    summary_path = metrics.write_summary()
+    if SETTINGS["DEBUG"]:
+        metrics.print_summary()
+        print(f"[DEBUG] Run summary saved to {summary_path}")
@@ -1,13 +1,16 @@
 # ========== SETUP AND IMPORTS ==========
 import pandas as pd
 import os
-import yfinance as yf
-from sqlalchemy import create_engine
 from dotenv import load_dotenv
 from tqdm import tqdm
 import logging
 import re
 from datetime import datetime
+from MetadataCache import MetadataCache
+from Storage import read_table, write_table, table_exists
+from FidelityReader import read_fidelity_export
+from ActionParser import add_action_columns
+from ReviewGate import confirm, db_upload_action, gated, write_review
 
 # Setup logging to record errors to a file
 logging.basicConfig(filename='data_processing_errors.log', level=logging.ERROR, 
@@ -19,14 +22,10 @@ DEBUG_LEVEL = 2  # Level 1: Basic; Level 2: Detailed
 
 # Load environment variables for server credentials
 load_dotenv('server_credentials.env')
-db_user = os.getenv('DB_USER')
-db_password = os.getenv('DB_PASSWORD')
-db_host = os.getenv('DB_HOST')
-db_port = os.getenv('DB_PORT')
-db_name = os.getenv('DB_NAME')
+# (DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME or DATABASE_URL are read by DatabaseLoader)
 
-# Database engine for PostgreSQL connection
-engine = create_engine(f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}')
+# Shared on-disk cache for yfinance .info lookups
+info_cache = MetadataCache()
 
 # Paths for input, output, and master files
 new_data_paths = [
@@ -59,27 +58,23 @@ def clean_data(file_paths, cleaned_dir):
 
     for file_path in file_paths:
         try:
-            data = pd.read_csv(file_path)
-            if DEBUG and DEBUG_LEVEL >= 1:
-                print(f"[DEBUG] Loaded {file_path} with {data.shape[0]} rows")
-
-            # Standard cleaning process: remove extra spaces, drop rows with no symbol, rename columns
-            data = data.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
-            data = data.dropna(subset=['Symbol'])
-            
             rename_columns = {
                 'Run Date': 'transaction_date', 'Account': 'portfolio_name', 'Action': 'notes', 
                 'Symbol': 'symbol', 'Description': 'asset_name', 'Quantity': 'quantity', 
                 'Price': 'price', 'Amount': 'transaction_amount', 'Commission': 'commission', 'Fees': 'fees'
             }
+            # Stream the export in chunks, parsing only the columns that are kept (fields come back trimmed)
+            data = read_fidelity_export(file_path, usecols=rename_columns)
+            if DEBUG and DEBUG_LEVEL >= 1:
+                print(f"[DEBUG] Loaded {file_path} with {data.shape[0]} rows")
+
+            # Standard cleaning process: drop rows with no symbol, rename columns
+            data = data.dropna(subset=['Symbol'])
+            
             data = data.rename(columns=rename_columns)
             data['commission'] = data['commission'].fillna(0)
             data['fees'] = data['fees'].fillna(0)
 
-            # Drop columns we don't need for the master data
-            data.drop(columns=['Type', 'Exchange Quantity', 'Exchange Currency', 'Currency', 'Exchange Rate', 
-                               'Accrued Interest', 'Settlement Date'], inplace=True, errors='ignore')
-            
             # Keep only the columns we want in the final version
             final_columns_order = ['symbol', 'asset_name', 'quantity', 'price', 'transaction_amount', 
                                    'commission', 'fees', 'portfolio_name', 'transaction_date', 'notes']
@@ -88,6 +83,7 @@ def clean_data(file_paths, cleaned_dir):
             # Ensure transaction dates are in a uniform format
             data['transaction_date'] = pd.to_datetime(data['transaction_date'], format='%m/%d/%Y').dt.strftime('%Y-%m-%d')
             data['symbol'] = data['symbol'].str.lstrip('-')  # Remove any leading dashes from symbols
+            data = add_action_columns(data)  # action_type, is_margin, parsed_symbol from the notes
 
             # Append the cleaned DataFrame to the combined list
             combined_data.append(data)
@@ -103,33 +99,44 @@ def clean_data(file_paths, cleaned_dir):
     # Generate a timestamped filename and save the consolidated data
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     consolidated_file_path = os.path.join(cleaned_dir, f"cleaned_account_history_{timestamp}.csv")
-    consolidated_data.to_csv(consolidated_file_path, index=False)
+    write_table(consolidated_data, consolidated_file_path, schema='ledger')
     
     print(f"Consolidated cleaned data saved as: {consolidated_file_path}")
-    review = input(f"Review the cleaned data at {consolidated_file_path}. Proceed? (y/n): ").strip().lower()
-    if review != 'y':
+    if not confirm(f"Review the cleaned data at {consolidated_file_path}. Proceed?"):
         print("Terminating program as per user request.")
         exit()
     return consolidated_data
 
 # ========== MASTER DATA UPDATE FUNCTION ==========
+LEGACY_MASTER_COLUMNS = {'Symbol': 'symbol', 'Sector': 'sector', 'Industry': 'industry'}
+
+def normalize_master_columns(data):
+    """Renames the capitalised Symbol/Sector/Industry columns to the lowercase master_data ones,
+    merging them into the lowercase column when a frame has both."""
+    data = data.copy()
+    for legacy, column in LEGACY_MASTER_COLUMNS.items():
+        if legacy in data.columns:
+            data[column] = data[column].fillna(data[legacy]) if column in data.columns else data[legacy]
+            data = data.drop(columns=legacy)
+    return data
+
 def update_master_data(cleaned_data, master_data_path, output_master_data_path):
     """Update the master_data69 file with new unique symbols."""
     try:
-        if os.path.exists(master_data_path):
-            master_data = pd.read_csv(master_data_path)
+        if table_exists(master_data_path):
+            master_data = normalize_master_columns(read_table(master_data_path, schema='master_data'))
         else:
-            master_data = pd.DataFrame(columns=['Symbol'])  # Create if not exists
-        
-        cleaned_data['Symbol'] = cleaned_data['Symbol'].str.upper()
-        new_symbols = cleaned_data[['Symbol']].drop_duplicates()
-        updated_master = pd.concat([master_data, new_symbols]).drop_duplicates(subset='Symbol')
+            master_data = pd.DataFrame(columns=['symbol'])  # Create if not exists
+
+        cleaned_data = normalize_master_columns(cleaned_data)
+        cleaned_data['symbol'] = cleaned_data['symbol'].str.upper()
+        new_symbols = cleaned_data[['symbol']].drop_duplicates()
+        updated_master = pd.concat([master_data, new_symbols]).drop_duplicates(subset='symbol')
 
-        updated_master.to_csv(output_master_data_path, index=False)
+        write_table(updated_master, output_master_data_path, schema='master_data')
         print(f"Updated master data saved to: {output_master_data_path}")
 
-        review = input(f"Review the updated master data at {output_master_data_path}. Proceed? (y/n): ").strip().lower()
-        if review != 'y':
+        if not confirm(f"Review the updated master data at {output_master_data_path}. Proceed?"):
             print("Terminating program as per user request.")
             exit()
         return updated_master
@@ -143,30 +150,30 @@ def enrich_master_data(master_data):
     enriched_data = master_data.copy()
     for idx, row in tqdm(enriched_data.iterrows(), total=enriched_data.shape[0]):
         try:
-            ticker = yf.Ticker(row['Symbol'])
-            info = ticker.info
-            enriched_data.at[idx, 'Sector'] = info.get('sector', 'Unknown')
-            enriched_data.at[idx, 'Industry'] = info.get('industry', 'Unknown')
+            info = info_cache.get_info(row['symbol'], ['sector', 'industry'])
+            enriched_data.at[idx, 'sector'] = info.get('sector') or 'Unknown'
+            enriched_data.at[idx, 'industry'] = info.get('industry') or 'Unknown'
         except Exception as e:
-            logging.error(f"Error enriching symbol {row['Symbol']}: {e}")
+            logging.error(f"Error enriching symbol {row['symbol']}: {e}")
 
     enriched_filepath = 'master_data69_enriched.csv'
-    enriched_data.to_csv(enriched_filepath, index=False)
+    write_table(enriched_data, enriched_filepath, schema='master_data')
     print(f"Enriched master data saved to: {enriched_filepath}")
 
-    review = input(f"Review the enriched data at {enriched_filepath}. Proceed? (y/n): ").strip().lower()
-    if review != 'y':
+    if not confirm(f"Review the enriched data at {enriched_filepath}. Proceed?"):
         print("Terminating program as per user request.")
         exit()
     return enriched_data
 
 
 # ========== DATABASE UPLOAD FUNCTION ==========
-def upload_to_database(data):
-    """Upload the enriched master_data69 to PostgreSQL database."""
+def upload_to_database(enriched_filepath, review_path=None):
+    """Upsert the enriched master_data69 into the PostgreSQL master_data table, keyed on symbol.
+    Headless runs queue the upload on the review artifact until it is approved."""
     try:
-        data.to_sql('master_data', con=engine, if_exists='replace', index=False)
-        print("Data successfully uploaded to PostgreSQL.")
+        if gated("Upload the enriched master data to PostgreSQL?",
+                 db_upload_action(enriched_filepath, 'master_data', key_columns=['symbol']), review_path):
+            print("Data successfully uploaded to PostgreSQL.")
     except Exception as e:
         logging.error(f"Database upload failed: {e}")
 
@@ -193,7 +200,10 @@ if __name__ == "__main__":
     # Step 3: Enrich master data
     enriched_master_data = enrich_master_data(updated_master_data)
 
-    # Step 4: Upload to database
-    upload_to_database(enriched_master_data)
+    # Step 4: Write the review artifact and upload to the database once approved
+    previous_master_data = (normalize_master_columns(read_table(master_data_path, schema='master_data'))
+                            if table_exists(master_data_path) else None)
+    review_path = write_review('master_data', previous_master_data, enriched_master_data, key='symbol')
+    upload_to_database('master_data69_enriched.csv', review_path)
 
     print("Process completed successfully.")
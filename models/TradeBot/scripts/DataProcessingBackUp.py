@@ -1,15 +1,23 @@
 # ========== SETUP AND IMPORTS ==========
 import pandas as pd
 import os
-import yfinance as yf
-from sqlalchemy import create_engine
 from dotenv import load_dotenv
-from tqdm import tqdm
 from pathlib import Path
 import logging
 import time
-import re
 from datetime import datetime
+from PriceBatch import fetch_history_summary, fetch_symbol_history
+from MetadataCache import MetadataCache
+from Storage import read_table, write_table, table_exists
+from FidelityReader import read_fidelity_export
+from ActionParser import add_action_columns
+from MasterDataMerge import build_updates, apply_symbol_updates
+from SymbolStore import SymbolStore, store_path, version_from_path
+from BarStore import BarStore
+from SymbolClassifier import needs_lookup, normalize_symbols
+from EnrichmentPipeline import EmptyResponseError, EnrichmentPipeline
+from ReviewGate import confirm, db_upload_action, gated, is_headless, write_review
+from Instrumentation import metrics
 
 # Setup logging to record errors to a file
 logging.basicConfig(filename='data_processing_errors.log', level=logging.ERROR, 
@@ -19,16 +27,23 @@ logging.basicConfig(filename='data_processing_errors.log', level=logging.ERROR,
 DEBUG = True
 DEBUG_LEVEL = 2  # Level 1: Basic; Level 2: Detailed
 
+# Enrichment behavior - if True, existing enrichment values are kept and only blanks are filled
+FILL_ONLY_IF_BLANK = False
+ENRICH_WORKERS = 8             # Parallel yfinance lookups during enrichment
+ENRICH_CHECKPOINT_EVERY = 100  # Symbols between enrichment checkpoints
+
 # Load environment variables for server credentials
 load_dotenv(r'C:\Users\Lane\Documents\Projects\trading_bot\programs\server_credentials.env')
-db_user = os.getenv('DB_USER')
-db_password = os.getenv('DB_PASSWORD')
-db_host = os.getenv('DB_HOST')
-db_port = os.getenv('DB_PORT')
-db_name = os.getenv('DB_NAME')
+# (DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME or DATABASE_URL are read by DatabaseLoader)
+
+# Shared on-disk cache for yfinance .info lookups
+info_cache = MetadataCache()
+
+# Versioned (symbol, field, value, valid_from_version) history of the master_dataNN files
+symbol_store = SymbolStore(store_path('backup'))  # Own lineage: master_data14 versions
 
-# Database engine for PostgreSQL connection
-engine = create_engine(f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}')
+# Local OHLCV store; the full daily history downloaded for first-traded dates is kept here
+bar_store = BarStore()
 
 # Paths for input, output, and master files
 new_data_paths = [
@@ -58,82 +73,77 @@ def increment_filename_version(file_path):
 def clean_data(file_paths, cleaned_dir):
     """Cleans multiple Fidelity data files, combines them into one consolidated file, 
     and saves it as cleaned_account_history_<timestamp>.csv."""
-    combined_data = []  # List to store each cleaned DataFrame
-
-    for file_path in file_paths:
-        try:
-            data = pd.read_csv(file_path)
-            if DEBUG and DEBUG_LEVEL >= 1:
-                print(f"[DEBUG] Loaded {file_path} with {data.shape[0]} rows")
-
-            # Standard cleaning process: remove extra spaces, drop rows with no symbol, rename columns
-            data = data.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
-            data = data.dropna(subset=['Symbol'])
-            
-            rename_columns = {
-                'Run Date': 'transaction_date', 'Account': 'portfolio_name', 'Action': 'notes', 
-                'Symbol': 'symbol', 'Description': 'asset_name', 'Quantity': 'quantity', 
-                'Price': 'price', 'Amount': 'transaction_amount', 'Commission': 'commission', 'Fees': 'fees'
-            }
-            data = data.rename(columns=rename_columns)
-            data['commission'] = data['commission'].fillna(0)
-            data['fees'] = data['fees'].fillna(0)
-
-            # Drop columns we don't need for the master data
-            data.drop(columns=['Type', 'Exchange Quantity', 'Exchange Currency', 'Currency', 'Exchange Rate', 
-                               'Accrued Interest', 'Settlement Date'], inplace=True, errors='ignore')
-            
-            # Keep only the columns we want in the final version
-            final_columns_order = ['symbol', 'asset_name', 'quantity', 'price', 'transaction_amount', 
-                                   'commission', 'fees', 'portfolio_name', 'transaction_date', 'notes']
-            data = data[final_columns_order]
-
-            # Ensure transaction dates are in a uniform format
-            data['transaction_date'] = pd.to_datetime(data['transaction_date'], format='%m/%d/%Y').dt.strftime('%Y-%m-%d')
-            data['symbol'] = data['symbol'].str.lstrip('-')  # Remove any leading dashes from symbols
-
-            # Append the cleaned DataFrame to the combined list
-            combined_data.append(data)
-
-        except Exception as e:
-            logging.error(f"Error during data cleaning for {file_path}: {e}")
-            if DEBUG and DEBUG_LEVEL >= 2:
-                print(f"[DEBUG] Error during data cleaning for {file_path}: {e}")
-
-    # Concatenate all cleaned data files into a single DataFrame
-    consolidated_data = pd.concat(combined_data, ignore_index=True)
-    
-    # Generate a timestamped filename and save the consolidated data
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    consolidated_file_path = os.path.join(cleaned_dir, f"cleaned_account_history_{timestamp}.csv")
-    consolidated_data.to_csv(consolidated_file_path, index=False)
-    
-    print(f"Consolidated cleaned data saved as: {consolidated_file_path}")
-    return consolidated_file_path  # Return path for reference
+    with metrics.stage('clean') as stage:
+        combined_data = []  # List to store each cleaned DataFrame
+
+        for file_path in file_paths:
+            try:
+                rename_columns = {
+                    'Run Date': 'transaction_date', 'Account': 'portfolio_name', 'Action': 'notes', 
+                    'Symbol': 'symbol', 'Description': 'asset_name', 'Quantity': 'quantity', 
+                    'Price': 'price', 'Amount': 'transaction_amount', 'Commission': 'commission', 'Fees': 'fees'
+                }
+                # Stream the export in chunks, parsing only the columns that are kept (fields come back trimmed)
+                data = read_fidelity_export(file_path, usecols=rename_columns)
+                if DEBUG and DEBUG_LEVEL >= 1:
+                    print(f"[DEBUG] Loaded {file_path} with {data.shape[0]} rows")
+
+                # Standard cleaning process: drop rows with no symbol, rename columns
+                data = data.dropna(subset=['Symbol'])
+
+                data = data.rename(columns=rename_columns)
+                data['commission'] = data['commission'].fillna(0)
+                data['fees'] = data['fees'].fillna(0)
+
+                # Keep only the columns we want in the final version
+                final_columns_order = ['symbol', 'asset_name', 'quantity', 'price', 'transaction_amount', 
+                                       'commission', 'fees', 'portfolio_name', 'transaction_date', 'notes']
+                data = data[final_columns_order]
+
+                # Ensure transaction dates are in a uniform format
+                data['transaction_date'] = pd.to_datetime(data['transaction_date'], format='%m/%d/%Y').dt.strftime('%Y-%m-%d')
+                data['symbol'] = data['symbol'].str.lstrip('-')  # Remove any leading dashes from symbols
+                data = add_action_columns(data)  # action_type, is_margin, parsed_symbol from the notes
+
+                # Append the cleaned DataFrame to the combined list
+                combined_data.append(data)
+
+            except Exception as e:
+                logging.error(f"Error during data cleaning for {file_path}: {e}")
+                if DEBUG and DEBUG_LEVEL >= 2:
+                    print(f"[DEBUG] Error during data cleaning for {file_path}: {e}")
+
+        # Concatenate all cleaned data files into a single DataFrame
+        consolidated_data = pd.concat(combined_data, ignore_index=True)
+        stage.rows = len(consolidated_data)
+
+        # Generate a timestamped filename and save the consolidated data
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        consolidated_file_path = os.path.join(cleaned_dir, f"cleaned_account_history_{timestamp}.csv")
+        write_table(consolidated_data, consolidated_file_path, schema='ledger')
+
+        print(f"Consolidated cleaned data saved as: {consolidated_file_path}")
+        return consolidated_file_path  # Return path for reference
 
 # ========== MASTER DATA UPDATE FUNCTION ==========
 def update_master_data(cleaned_data_files, master_data_path):
     """Adds symbols from cleaned files to master data, ensuring only valid symbols are added."""
     try:
         # Load existing master data if it exists, or create an empty DataFrame
-        if os.path.exists(master_data_path):
-            master_data = pd.read_csv(master_data_path)
+        if table_exists(master_data_path):
+            master_data = read_table(master_data_path, schema='master_data')
         else:
             master_data = pd.DataFrame(columns=['symbol'])
 
         # Set of existing symbols in the master data for quick comparison
         master_symbols_set = set(master_data['symbol'].str.upper())  # Standardized to uppercase for comparison
 
-        # Regular expression to filter out non-standard symbols
-        # This pattern will match symbols with 1-5 uppercase letters, as typical stock symbols
-        stock_symbol_pattern = re.compile(r'^[A-Z]{1,5}$')
-
         # Collect valid symbols from cleaned data files
         new_symbols_set = set()
         for data in cleaned_data_files:
-            cleaned_symbols = data['symbol'].str.upper()  # Convert to uppercase for case-insensitive comparison
-            # Filter symbols based on regex pattern
-            valid_symbols = cleaned_symbols[cleaned_symbols.str.match(stock_symbol_pattern)]
+            cleaned_symbols = normalize_symbols(data['symbol'])  # Uppercase for case-insensitive comparison
+            # Keep listed equities; options, CUSIPs, money market and cash sweep symbols are filtered out
+            valid_symbols = cleaned_symbols[needs_lookup(cleaned_symbols)]
             new_symbols_set.update(valid_symbols)
 
         # Identify unique new symbols that are not already in master data
@@ -147,8 +157,14 @@ def update_master_data(cleaned_data_files, master_data_path):
 
         # Save the updated master data with a new version
         new_master_data_path = increment_filename_version(master_data_path)
-        updated_data.to_csv(new_master_data_path, index=False)
+        write_table(updated_data, new_master_data_path, schema='master_data')
         print(f"New master data created and saved as: {new_master_data_path}")
+
+        # Record only the fields that changed since the previous version
+        changed = symbol_store.record_version(updated_data, version_from_path(new_master_data_path),
+                                              source=str(new_master_data_path))
+        if DEBUG and DEBUG_LEVEL >= 1:
+            print(f"[DEBUG] Symbol store: {changed} changed fields in version {version_from_path(new_master_data_path)}")
         
         return new_master_data_path  # Return path for the enrichment step
 
@@ -160,60 +176,85 @@ def update_master_data(cleaned_data_files, master_data_path):
 
 
 # ========== ENRICH MASTER DATA WITH YFINANCE ==========
-def enrich_master_data(master_data):
+def enrichment_checkpoint_path(master_data_path):
+    """Checkpoint file kept next to the master data file while it is being enriched."""
+    return str(Path(master_data_path).with_suffix('.enrich_checkpoint.json'))
+
+def fetch_symbol_metadata(symbol, history_summary, empty_info=None):
+    """Fetches longname, sector, industry and first traded date for one symbol.
+       'Unknown' is only used once a per-symbol attempt confirmed Yahoo has no value; fetch errors propagate
+       to the pipeline. yf.download logs a ticker's error and returns no bars for it, so a symbol with no
+       bars in the batched summary (or whose chunk failed) is fetched again on its own, where timeouts raise
+       and go through the retry queue. An empty .info is retried once (tracked in `empty_info`) before it
+       counts as an answer."""
+    info = info_cache.get_info(symbol, ['longName', 'sector', 'industry'])
+    if not any(info.values()) and empty_info is not None and symbol not in empty_info:
+        empty_info.add(symbol)
+        raise EmptyResponseError(f"Empty .info response for {symbol}")
+    if history_summary['failed'].get(symbol, False) or history_summary['bars'].get(symbol, 0) == 0:
+        history_summary = fetch_symbol_history(symbol, period="max", store=bar_store)
+    first_date = history_summary['first_date'].get(symbol, pd.NaT)
+    return {'symbol': symbol,
+            'longname': info.get('longName') or 'Unknown',
+            'sector': info.get('sector') or 'Unknown',
+            'industry': info.get('industry') or 'Unknown',
+            'first_traded': first_date.strftime('%Y-%m-%d') if pd.notna(first_date) else 'Unknown'}
+
+def enrich_master_data(master_data, checkpoint_path=None):
     """Enriches the master data with additional information from YFinance, handling cases with missing data.
-       Filters out non-standard symbols to avoid enriching symbols that YFinance doesn't recognize.
+       Symbols are fetched in parallel with retries; symbols that still fail are left unchanged and reported,
+       and progress is checkpointed to checkpoint_path so an interrupted run resumes where it stopped.
+       Returns (enriched master data, failures by symbol).
     """
-    master_data['longname'] = None
-    master_data['sector'] = None
-    master_data['industry'] = None
-    master_data['first_traded'] = None
-
-    for idx, symbol in enumerate(tqdm(master_data['symbol'].unique(), desc="Enriching data", unit="symbol")):
-        try:
-            stock = yf.Ticker(symbol)
-            info = stock.info
-
-            longname = info.get('longName', 'Unknown')
-            sector = info.get('sector', 'Unknown')
-            industry = info.get('industry', 'Unknown')
-            history = stock.history(period="max")
-            first_traded = history.index.min().strftime('%Y-%m-%d') if not history.empty else 'Unknown'
-
-            master_data.loc[master_data['symbol'] == symbol, ['longname', 'sector', 'industry', 'first_traded']] = [
-                longname, sector, industry, first_traded
-            ]
-
-            if DEBUG and DEBUG_LEVEL >= 2 and idx % 50 == 0:
-                print(f"[DEBUG] Enriched symbol {symbol}: longname={longname}, sector={sector}, industry={industry}")
-
-        except Exception as e:
-            logging.error(f"Error enriching symbol {symbol}: {e}")
-            if DEBUG and DEBUG_LEVEL >= 2:
-                print(f"[DEBUG] Error enriching symbol {symbol}: {e}")
-            master_data.loc[master_data['symbol'] == symbol, ['longname', 'sector', 'industry', 'first_traded']] = [
-                'Unknown', 'Unknown', 'Unknown', 'Unknown'
-            ]
-    return master_data
+    enrich_columns = ['longname', 'sector', 'industry', 'first_traded']
+    for column in enrich_columns:
+        if column not in master_data.columns:
+            master_data[column] = None
+
+    # First traded dates for every symbol come from a few batched max-period downloads
+    history_summary = fetch_history_summary(master_data['symbol'].dropna().unique(), period="max", chunk_size=50,
+                                             store=bar_store)
+
+    empty_info = set()  # Symbols whose .info came back empty once; a second empty answer is accepted
+    pipeline = EnrichmentPipeline(lambda symbol: fetch_symbol_metadata(symbol, history_summary, empty_info),
+                                  checkpoint_path=checkpoint_path, workers=ENRICH_WORKERS,
+                                  checkpoint_every=ENRICH_CHECKPOINT_EVERY)
+    records, failures = pipeline.run(master_data['symbol'].dropna().unique())
+
+    if failures:
+        print(f"{len(failures)} symbols could not be enriched and were left unchanged: {sorted(failures)[:20]}")
+    if DEBUG and DEBUG_LEVEL >= 1:
+        print(f"[DEBUG] Enriched {len(records)} symbols with {pipeline.retries} retries")
+
+    # Apply all fetched values with a single symbol-keyed merge
+    updates = build_updates(list(records.values()), enrich_columns)
+    return apply_symbol_updates(master_data, updates, fill_only_if_blank=FILL_ONLY_IF_BLANK), failures
 
 # ========== DATABASE UPLOAD WITH USER PROMPT ==========
-def upload_to_database(data):
-    """Prompts the user to confirm if they want to upload the enriched master data to PostgreSQL."""
-    user_input = input("Do you want to upload the data to PostgreSQL? (y/n): ").strip().lower()
-    if user_input == 'y':
-        try:
-            data.to_sql('asset_ledger', con=engine, if_exists='append', index=False)
-            print("Data successfully inserted into the database.")
-            print("Program run successfully, symbol verification report generated, new master_data file created, uploaded to PostgreSQL.")
-        except Exception as e:
-            logging.error(f"Error during database upload: {e}")
-            if DEBUG and DEBUG_LEVEL >= 2:
-                print(f"[DEBUG] Error during database upload: {e}")
+def upload_to_database(master_data_path, review_path=None):
+    """Prompts the user to confirm if they want to upload the enriched master data to PostgreSQL.
+       In headless mode the upload is queued on the review artifact and runs once the review is approved."""
+    try:
+        # COPY into a staging table, then upsert on symbol so re-runs do not duplicate rows
+        uploaded = gated("Do you want to upload the data to PostgreSQL?",
+                         db_upload_action(master_data_path, 'asset_ledger', key_columns=['symbol']), review_path)
+    except Exception as e:
+        logging.error(f"Error during database upload: {e}")
+        if DEBUG and DEBUG_LEVEL >= 2:
+            print(f"[DEBUG] Error during database upload: {e}")
+        return
+
+    if uploaded:
+        print("Program run successfully, symbol verification report generated, new master_data file created, uploaded to PostgreSQL.")
+    elif is_headless():
+        print(f"Program run successfully, new master_data file created, upload waiting for approval of {review_path}.")
     else:
         print("Program run successfully, symbol verification report generated, new master_data file created, not uploaded to PostgreSQL.")
 
 # ========== MAIN SCRIPT EXECUTION ==========
 if __name__ == "__main__":
+    metrics.run_name = 'data_processing'
+
     # Step 1: Clean the new data files
     cleaned_data_files = clean_data(new_data_paths, cleaned_data_dir)
     if cleaned_data_files:
@@ -221,21 +262,44 @@ if __name__ == "__main__":
             print(f"[DEBUG] Total cleaned files processed: {len(cleaned_data_files)}")
 
         # Step 2: Update master data with new symbols, creating the next version before enrichment
-        new_master_data_path = update_master_data(cleaned_data_files, master_data_path)
+        with metrics.stage('update_master_data'):
+            new_master_data_path = update_master_data(cleaned_data_files, master_data_path)
         if new_master_data_path:
             print(f"New master data file created: {new_master_data_path}")
 
             # Prompt user to confirm before proceeding with enrichment and database upload
-            proceed = input("Do you want to proceed with enrichment and database upload? (y/n): ").strip().lower()
-            if proceed != 'y':
+            if not confirm("Do you want to proceed with enrichment and database upload?"):
                 print("Process terminated by user after master data generation. No enrichment or upload performed.")
                 exit()  # Exit the program if user does not wish to proceed
 
             # Step 3: Load and enrich the new master data file, then save enriched data to the same file
-            master_data = pd.read_csv(new_master_data_path)
-            enriched_master_data = enrich_master_data(master_data)
-            enriched_master_data.to_csv(new_master_data_path, index=False)
+            master_data = read_table(new_master_data_path, schema='master_data')
+            checkpoint_path = enrichment_checkpoint_path(new_master_data_path)
+            with metrics.stage('enrich', rows=len(master_data)):
+                enriched_master_data, failures = enrich_master_data(master_data, checkpoint_path)
+            with metrics.stage('write_master', rows=len(enriched_master_data)):
+                write_table(enriched_master_data, new_master_data_path, schema='master_data')
             print(f"Enriched master data saved to: {new_master_data_path}")
+
+            # The results are in the master file now, so the next run starts fresh
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+
+            # Update the same version in the symbol store with the enriched fields
+            symbol_store.record_version(enriched_master_data, version_from_path(new_master_data_path),
+                                        source=str(new_master_data_path))
             
+            # Review artifact against the previous version; the database upload is gated on its approval
+            previous_master_data = read_table(master_data_path, schema='master_data') if table_exists(master_data_path) else None
+            review_path = write_review('master_data', previous_master_data, enriched_master_data,
+                                       failed_rows={s: f['error'] for s, f in failures.items()})
+            print(f"Review artifact written to {review_path}")
+
             # Step 4: Prompt for database upload
-            upload_to_database(enriched_master_data)
\ No newline at end of file
+            upload_to_database(new_master_data_path, review_path)
+
+    # Per-stage timings, Yahoo latency percentiles, cache hit rates and retry counts for this run
+    summary_path = metrics.write_summary()
+    if DEBUG and DEBUG_LEVEL >= 1:
+        metrics.print_summary()
+        print(f"[DEBUG] Run summary saved to {summary_path}")
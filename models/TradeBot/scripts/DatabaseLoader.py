@@ -0,0 +1,142 @@
+# ========== DATABASE LOADER ==========
+# Bulk loader for PostgreSQL: rows are streamed into a staging table with COPY FROM STDIN
+# and merged into the target with INSERT ... ON CONFLICT (key) DO UPDATE, so re-runs
+# update rows in place instead of dropping the table or piling up duplicates.
+# The engine is created lazily and pooled. Without PostgreSQL credentials the loader
+# falls back to a local SQLite file, which uses the same staging + upsert statements.
+
+import io
+import logging
+import os
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from Instrumentation import metrics
+
+SQLITE_FALLBACK_URL = 'sqlite:///bitbot.db'
+POOL_SETTINGS = {'pool_size': 5, 'max_overflow': 5, 'pool_pre_ping': True, 'pool_recycle': 1800}
+
+_engine = None  # Created on first use by get_engine()
+
+
+def database_url():
+    """Builds the database URL from DATABASE_URL or the DB_* variables, else the SQLite fallback."""
+    if os.getenv('DATABASE_URL'):
+        return os.getenv('DATABASE_URL')
+    db_user, db_password = os.getenv('DB_USER'), os.getenv('DB_PASSWORD')
+    db_host, db_port, db_name = os.getenv('DB_HOST'), os.getenv('DB_PORT'), os.getenv('DB_NAME')
+    if db_user and db_host and db_name:
+        return f'postgresql://{db_user}:{db_password}@{db_host}:{db_port or 5432}/{db_name}'
+    return SQLITE_FALLBACK_URL
+
+
+def get_engine(url=None):
+    """Returns the shared pooled engine, creating it on first call."""
+    global _engine
+    if url is not None:
+        return create_engine(url, **(POOL_SETTINGS if url.startswith('postgresql') else {}))
+    if _engine is None:
+        url = database_url()
+        _engine = create_engine(url, **(POOL_SETTINGS if url.startswith('postgresql') else {}))
+    return _engine
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def ensure_target_table(data, table, key_columns, engine):
+    """Creates the target table if needed and makes sure the key columns carry a unique index.
+    Existing duplicate keys (from earlier append-only loads) are removed first, keeping the newest row."""
+    if not inspect(engine).has_table(table):
+        data.head(0).to_sql(table, engine, index=False)
+
+    keys = ', '.join(_quote(k) for k in key_columns)
+    index_name = _quote(f"ux_{table}_{'_'.join(key_columns)}")
+    create_index = text(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {_quote(table)} ({keys})")
+    try:
+        with engine.begin() as conn:
+            conn.execute(create_index)
+    except (IntegrityError, OperationalError, ProgrammingError):
+        # The table already holds duplicate keys; collapse them before adding the index
+        key_match = ' AND '.join(f"a.{_quote(k)} = b.{_quote(k)}" for k in key_columns)
+        with engine.begin() as conn:
+            if engine.dialect.name == 'postgresql':
+                conn.execute(text(f"DELETE FROM {_quote(table)} a USING {_quote(table)} b "
+                                  f"WHERE a.ctid < b.ctid AND {key_match}"))
+            else:
+                conn.execute(text(f"DELETE FROM {_quote(table)} WHERE rowid NOT IN "
+                                  f"(SELECT MAX(rowid) FROM {_quote(table)} GROUP BY {keys})"))
+            conn.execute(create_index)
+
+
+def _upsert_sql(table, staging, columns, key_columns):
+    """INSERT ... SELECT from staging with ON CONFLICT (keys) DO UPDATE for the non-key columns."""
+    cols = ', '.join(_quote(c) for c in columns)
+    keys = ', '.join(_quote(k) for k in key_columns)
+    updates = [f"{_quote(c)} = EXCLUDED.{_quote(c)}" for c in columns if c not in key_columns]
+    action = f"DO UPDATE SET {', '.join(updates)}" if updates else "DO NOTHING"
+    # `WHERE true` keeps SQLite from parsing ON CONFLICT as part of the SELECT
+    return (f"INSERT INTO {_quote(table)} ({cols}) SELECT {cols} FROM {staging} WHERE true "
+            f"ON CONFLICT ({keys}) {action}")
+
+
+def _copy_upsert_postgres(data, table, columns, key_columns, engine):
+    """Streams rows into a temporary staging table with COPY and merges them into the target."""
+    buffer = io.StringIO()
+    data.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    staging = _quote(f"stg_{table}")
+    cols = ', '.join(_quote(c) for c in columns)
+    raw_conn = engine.raw_connection()
+    try:
+        with raw_conn.cursor() as cursor:
+            cursor.execute(f"CREATE TEMP TABLE {staging} (LIKE {_quote(table)} INCLUDING DEFAULTS) ON COMMIT DROP")
+            cursor.copy_expert(f"COPY {staging} ({cols}) FROM STDIN WITH (FORMAT csv)", buffer)
+            cursor.execute(_upsert_sql(table, staging, columns, key_columns))
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+
+
+def _staged_upsert_generic(data, table, columns, key_columns, engine):
+    """SQLite path: bulk-insert into a staging table, then merge with the same upsert statement."""
+    staging = f"stg_{table}"
+    with engine.begin() as conn:
+        data.to_sql(staging, conn, if_exists='replace', index=False, chunksize=1000)
+        conn.execute(text(_upsert_sql(table, _quote(staging), columns, key_columns)))
+        conn.execute(text(f"DROP TABLE {_quote(staging)}"))
+
+
+def bulk_upsert(data, table, key_columns=('symbol',), engine=None):
+    """Loads `data` into `table`, inserting new keys and updating existing ones. Returns the row count."""
+    engine = engine or get_engine()
+    key_columns = list(key_columns)
+
+    # Rows without a key cannot be upserted; report them instead of dropping them silently
+    missing_key = data[key_columns].isna().any(axis=1)
+    if missing_key.any():
+        metrics.incr(f'db_upsert.{table}.missing_key_rows', int(missing_key.sum()))
+        logging.error(f"{int(missing_key.sum())} rows without {key_columns} skipped during upload to {table}")
+
+    # ON CONFLICT cannot touch the same key twice in one statement, so keep the last row per key
+    data = data[~missing_key].drop_duplicates(subset=key_columns, keep='last')
+    ensure_target_table(data, table, key_columns, engine)
+
+    # Only load columns the target table knows about
+    target_columns = {c['name'] for c in inspect(engine).get_columns(table)}
+    columns = [c for c in data.columns if c in target_columns]
+    skipped = [c for c in data.columns if c not in target_columns]
+    if skipped:
+        logging.error(f"Columns not in table {table}, skipped during upload: {skipped}")
+    data = data[columns]
+
+    with metrics.stage(f'db_upsert.{table}', rows=len(data)):
+        if engine.dialect.name == 'postgresql':
+            _copy_upsert_postgres(data, table, columns, key_columns, engine)
+        else:
+            _staged_upsert_generic(data, table, columns, key_columns, engine)
+    return len(data)
@@ -0,0 +1,172 @@
+# ========== ENRICHMENT PIPELINE ==========
+# Parallel per-symbol enrichment with a bounded worker pool, a separate retry queue and
+# on-disk checkpoints. Transient failures (rate limits, timeouts, dropped connections, 5xx)
+# go back on the retry queue with exponential backoff and are never turned into permanent
+# values; symbols that still fail after MAX_RETRIES are reported and left untouched so the
+# next run picks them up. Completed symbols are checkpointed every CHECKPOINT_EVERY results,
+# so an interrupted run resumes where it stopped instead of starting over.
+
+import heapq
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from tqdm import tqdm
+from Instrumentation import metrics
+
+try:
+    from yfinance.exceptions import YFRateLimitError
+except ImportError:  # Older yfinance releases have no dedicated rate-limit error
+    YFRateLimitError = None
+
+try:
+    import requests
+    REQUESTS_TRANSIENT = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+except ImportError:
+    REQUESTS_TRANSIENT = ()
+
+WORKERS = 8               # Concurrent fetches
+MAX_RETRIES = 4           # Retries per symbol for transient errors
+BACKOFF_SECONDS = 2.0     # Base delay; attempt n waits BACKOFF_SECONDS * 2**(n-1) plus jitter
+MAX_BACKOFF_SECONDS = 60.0
+CHECKPOINT_EVERY = 100    # Completed symbols between checkpoint writes
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+TRANSIENT_MESSAGES = ('too many requests', 'rate limit', 'timed out', 'timeout', 'connection', 'temporarily')
+
+
+class EmptyResponseError(Exception):
+    """Raised by a fetch when Yahoo answered with nothing at all, which is retried like a timeout."""
+
+
+def is_transient(error):
+    """True for errors worth retrying: rate limits, timeouts, connection drops, 5xx and empty responses."""
+    if isinstance(error, EmptyResponseError):
+        return True
+    if YFRateLimitError is not None and isinstance(error, YFRateLimitError):
+        return True
+    if isinstance(error, (TimeoutError, ConnectionError) + REQUESTS_TRANSIENT):
+        return True
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is not None:
+        return status in TRANSIENT_STATUS_CODES
+    message = str(error).lower()
+    return any(text in message for text in TRANSIENT_MESSAGES)
+
+
+def backoff_delay(attempt, base=BACKOFF_SECONDS, cap=MAX_BACKOFF_SECONDS):
+    """Exponential backoff with full jitter for the given retry attempt (1-based)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class EnrichmentPipeline:
+    """Runs `fetch(symbol) -> record dict` over many symbols with retries and checkpoint/resume."""
+
+    def __init__(self, fetch, checkpoint_path=None, workers=WORKERS, max_retries=MAX_RETRIES,
+                 backoff_seconds=BACKOFF_SECONDS, checkpoint_every=CHECKPOINT_EVERY):
+        self.fetch = fetch
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.checkpoint_every = checkpoint_every
+        self.records = {}    # symbol -> fetched record
+        self.failures = {}   # symbol -> {'error', 'transient', 'attempts'}
+        self.retries = 0
+
+    # ---------- Checkpoints ----------
+    def load_checkpoint(self):
+        """Restores completed records and permanent failures from the checkpoint file, if any."""
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return 0
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Ignoring unreadable checkpoint {self.checkpoint_path}: {e}")
+            return 0
+        self.records.update(checkpoint.get('records', {}))
+        self.failures.update(checkpoint.get('permanent_failures', {}))
+        return len(self.records) + len(self.failures)
+
+    def save_checkpoint(self):
+        """Writes completed records atomically; transient failures are left out so a resume retries them."""
+        if not self.checkpoint_path:
+            return
+        permanent = {s: f for s, f in self.failures.items() if not f['transient']}
+        os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_path)), exist_ok=True)
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'saved_at': time.time(), 'records': self.records, 'permanent_failures': permanent}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    # ---------- Run ----------
+    def _attempt(self, symbol):
+        try:
+            with metrics.timer('enrichment.fetch'):
+                return symbol, self.fetch(symbol), None
+        except Exception as e:
+            return symbol, None, e
+
+    def run(self, symbols, desc="Enriching data"):
+        """Fetches every symbol not already in the checkpoint. Returns (records, failures)."""
+        resumed = self.load_checkpoint()
+        pending = [s for s in dict.fromkeys(symbols) if s not in self.records and s not in self.failures]
+        if resumed:
+            print(f"Resuming from checkpoint: {resumed} symbols already done, {len(pending)} to go")
+
+        queue = list(reversed(pending))  # First attempts, popped from the end
+        retry_queue = []                 # Heap of (ready_at, attempt, symbol)
+        attempts = {}
+        in_flight = {}
+        since_checkpoint = 0
+        max_in_flight = self.workers * 2
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor, \
+                tqdm(total=len(pending), desc=desc, unit="symbol") as progress:
+            while queue or retry_queue or in_flight:
+                # Keep the pool busy: due retries first, then new symbols
+                now = time.monotonic()
+                while len(in_flight) < max_in_flight and (queue or (retry_queue and retry_queue[0][0] <= now)):
+                    if retry_queue and retry_queue[0][0] <= now:
+                        _, _, symbol = heapq.heappop(retry_queue)
+                    else:
+                        symbol = queue.pop()
+                    attempts[symbol] = attempts.get(symbol, 0) + 1
+                    in_flight[executor.submit(self._attempt, symbol)] = symbol
+
+                if not in_flight:
+                    # Only backed-off retries are left; sleep until the next one is due
+                    time.sleep(max(0.0, retry_queue[0][0] - time.monotonic()))
+                    continue
+
+                timeout = max(0.0, retry_queue[0][0] - time.monotonic()) if retry_queue else None
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del in_flight[future]
+                    symbol, record, error = future.result()
+                    if error is None:
+                        self.records[symbol] = record
+                        self.failures.pop(symbol, None)
+                    elif is_transient(error) and attempts[symbol] <= self.max_retries:
+                        # Back onto the retry queue; nothing is recorded for the symbol yet
+                        self.retries += 1
+                        metrics.incr('enrichment.retries')
+                        ready_at = time.monotonic() + backoff_delay(attempts[symbol], self.backoff_seconds)
+                        heapq.heappush(retry_queue, (ready_at, attempts[symbol], symbol))
+                        continue
+                    else:
+                        logging.error(f"Error enriching symbol {symbol} after {attempts[symbol]} attempts: {error}")
+                        metrics.incr('enrichment.failures')
+                        self.failures[symbol] = {'error': str(error), 'transient': is_transient(error),
+                                                 'attempts': attempts[symbol]}
+                    progress.update(1)
+                    since_checkpoint += 1
+                    if since_checkpoint >= self.checkpoint_every:
+                        self.save_checkpoint()
+                        since_checkpoint = 0
+
+        self.save_checkpoint()
+        return self.records, self.failures
@@ -0,0 +1,317 @@
+# ========== FEATURE ENGINE ==========
+# Price/volume features for the micro (1m, 15m), mid (1h), swing (1d) and trend (1mo) models.
+# Training computes whole histories at once with pandas rolling/ewm kernels over contiguous
+# arrays (no Python loop per bar); live inference keeps the same indicators as running state and
+# updates it in O(1) per new bar, so both paths produce the same numbers:
+#
+#   history = compute_features(store.read_columns('BTC-USD', '1h'))   # training
+#   live = IncrementalFeatures.from_bars(store.read_columns('BTC-USD', '1h'))
+#   row = live.update(open_, high, low, close, volume)                  # one new bar
+#
+# Features (float32, NaN until an indicator's window is filled):
+#   log_return, volatility_20, sma_gap_10, sma_gap_50, rsi_14, macd, macd_signal, macd_hist, volume_z_20
+# Price-level indicators (SMA gaps, MACD) are expressed relative to the close so they compare
+# across symbols and price regimes.
+
+import numpy as np
+import pandas as pd
+from BarStore import BarStore, NS_PER_MINUTE, TIMEFRAMES, bucket_end, bucket_keys
+
+VOL_WINDOW = 20
+MA_WINDOWS = (10, 50)
+RSI_PERIOD = 14
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+VOLUME_WINDOW = 20
+RESYNC_EVERY = 10000  # Live updates between exact re-sums of the rolling windows (limits float drift)
+
+FEATURE_NAMES = ['log_return', f'volatility_{VOL_WINDOW}', *[f'sma_gap_{n}' for n in MA_WINDOWS],
+                 f'rsi_{RSI_PERIOD}', 'macd', 'macd_signal', 'macd_hist', f'volume_z_{VOLUME_WINDOW}']
+FEATURE_DTYPE = np.float32
+
+
+def _ema_alpha(span):
+    return 2.0 / (span + 1)
+
+
+def _ema(values, alpha):
+    """Recursive EMA seeded with the first observation (pandas ewm(adjust=False))."""
+    return pd.Series(values).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+
+
+def _rsi(avg_gain, avg_loss):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(avg_loss == 0, np.where(avg_gain == 0, 50.0, 100.0), 100.0 - 100.0 / (1.0 + avg_gain / avg_loss))
+
+
+# ========== BATCH (TRAINING) ==========
+def _indicator_state(close, volume):
+    """Full indicator series in float64, including the EMA states the live engine is seeded from."""
+    close = np.asarray(close, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    returns = np.r_[np.nan, np.diff(np.log(close))]
+    change = np.r_[np.nan, np.diff(close)]
+
+    state = {'returns': returns}
+    state['volatility'] = pd.Series(returns).rolling(VOL_WINDOW).std().to_numpy()
+    for n in MA_WINDOWS:
+        state[f'sma_{n}'] = pd.Series(close).rolling(n).mean().to_numpy()
+
+    # Wilder smoothing of gains/losses, starting from the first price change
+    state['avg_gain'] = _ema(np.where(change > 0, change, np.where(np.isnan(change), np.nan, 0.0)), 1.0 / RSI_PERIOD)
+    state['avg_loss'] = _ema(np.where(change < 0, -change, np.where(np.isnan(change), np.nan, 0.0)), 1.0 / RSI_PERIOD)
+
+    state['ema_fast'] = _ema(close, _ema_alpha(MACD_FAST))
+    state['ema_slow'] = _ema(close, _ema_alpha(MACD_SLOW))
+    state['macd'] = state['ema_fast'] - state['ema_slow']
+    state['macd_signal'] = _ema(state['macd'], _ema_alpha(MACD_SIGNAL))
+
+    volume_series = pd.Series(volume).rolling(VOLUME_WINDOW)
+    state['volume_mean'] = volume_series.mean().to_numpy()
+    state['volume_std'] = volume_series.std().to_numpy()
+    return state
+
+
+def compute_features(columns):
+    """Feature matrix (n_bars x len(FEATURE_NAMES), C-contiguous float32) for bar columns as returned
+    by BarStore.read_columns. Returns (timestamps, features)."""
+    close, volume = columns['close'], columns['volume']
+    n = len(close)
+    features = np.full((n, len(FEATURE_NAMES)), np.nan, dtype=FEATURE_DTYPE)
+    if n == 0:
+        return columns['ts'], features
+    state = _indicator_state(close, volume)
+    close = np.asarray(close, dtype=np.float64)
+    bars = np.arange(n)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        features[:, 0] = state['returns']
+        features[:, 1] = state['volatility']
+        for i, window in enumerate(MA_WINDOWS):
+            features[:, 2 + i] = close / state[f'sma_{window}'] - 1.0
+        rsi_col = 2 + len(MA_WINDOWS)
+        features[:, rsi_col] = np.where(bars >= RSI_PERIOD, _rsi(state['avg_gain'], state['avg_loss']), np.nan)
+        # MACD needs the slow EMA to have settled before it means anything
+        macd_ready = bars >= MACD_SLOW - 1
+        signal_ready = bars >= MACD_SLOW + MACD_SIGNAL - 2
+        features[:, rsi_col + 1] = np.where(macd_ready, state['macd'] / close, np.nan)
+        features[:, rsi_col + 2] = np.where(signal_ready, state['macd_signal'] / close, np.nan)
+        features[:, rsi_col + 3] = np.where(signal_ready, (state['macd'] - state['macd_signal']) / close, np.nan)
+        features[:, rsi_col + 4] = np.where(state['volume_std'] > 0,
+                                            (volume - state['volume_mean']) / state['volume_std'], 0.0)
+        features[:, rsi_col + 4][np.isnan(state['volume_std'])] = np.nan
+    return columns['ts'], features
+
+
+def features_frame(columns):
+    """compute_features as a DataFrame indexed by bar time."""
+    ts, features = compute_features(columns)
+    return pd.DataFrame(features, columns=FEATURE_NAMES, index=pd.DatetimeIndex(ts.astype('datetime64[ns]'), name='Date'))
+
+
+def load_features(symbol, timeframe, start=None, end=None, store=None):
+    """Features for one symbol and timeframe straight from the bar store (higher timeframes are
+    resampled from 1m bars by the store)."""
+    return features_frame((store or BarStore()).read_columns(symbol, timeframe, start, end))
+
+
+def load_all_timeframes(symbol, start=None, end=None, store=None, timeframes=TIMEFRAMES):
+    """{timeframe: features frame} for the five model timeframes."""
+    store = store or BarStore()
+    return {timeframe: load_features(symbol, timeframe, start, end, store) for timeframe in timeframes}
+
+
+# ========== INCREMENTAL (LIVE) ==========
+class _RollingWindow:
+    """Fixed-size ring buffer with running sum and sum of squares for O(1) mean/std."""
+
+    def __init__(self, size):
+        self.values = np.full(size, np.nan)
+        self.size = size
+        self.count = 0
+        self.pos = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def push(self, value):
+        if self.count == self.size:
+            old = self.values[self.pos]
+            self.total -= old
+            self.total_sq -= old * old
+        else:
+            self.count += 1
+        self.values[self.pos] = value
+        self.total += value
+        self.total_sq += value * value
+        self.pos = (self.pos + 1) % self.size
+
+    def resync(self):
+        filled = self.values[~np.isnan(self.values)]
+        self.total, self.total_sq = float(filled.sum()), float((filled * filled).sum())
+
+    def full(self):
+        return self.count == self.size
+
+    def mean(self):
+        return self.total / self.count
+
+    def std(self):
+        """Sample standard deviation (ddof=1), matching pandas rolling().std()."""
+        variance = (self.total_sq - self.total * self.total / self.count) / (self.count - 1)
+        return np.sqrt(max(variance, 0.0))
+
+
+class IncrementalFeatures:
+    """Running indicator state for one symbol/timeframe; update() costs O(1) per bar."""
+
+    def __init__(self):
+        self.bars = 0
+        self.prev_close = np.nan
+        self.returns = _RollingWindow(VOL_WINDOW)
+        self.closes = {n: _RollingWindow(n) for n in MA_WINDOWS}
+        self.volumes = _RollingWindow(VOLUME_WINDOW)
+        self.avg_gain = np.nan
+        self.avg_loss = np.nan
+        self.ema_fast = np.nan
+        self.ema_slow = np.nan
+        self.macd_signal = np.nan
+        self.row = np.full(len(FEATURE_NAMES), np.nan, dtype=FEATURE_DTYPE)  # Reused output buffer
+
+    @classmethod
+    def from_bars(cls, columns):
+        """Seeds the live state from stored history with the batch kernels (no per-bar replay)."""
+        engine = cls()
+        close = np.asarray(columns['close'], dtype=np.float64)
+        volume = np.asarray(columns['volume'], dtype=np.float64)
+        n = len(close)
+        if n == 0:
+            return engine
+        state = _indicator_state(close, volume)
+        engine.bars = n
+        engine.prev_close = close[-1]
+        for window, values in [(engine.returns, state['returns'][1:]), (engine.volumes, volume),
+                               *[(engine.closes[m], close) for m in MA_WINDOWS]]:
+            tail = values[-window.size:]
+            window.values[:len(tail)] = tail
+            window.count = len(tail)
+            window.pos = len(tail) % window.size
+            window.resync()
+        engine.avg_gain, engine.avg_loss = state['avg_gain'][-1], state['avg_loss'][-1]
+        engine.ema_fast, engine.ema_slow = state['ema_fast'][-1], state['ema_slow'][-1]
+        engine.macd_signal = state['macd_signal'][-1]
+        engine._write_row(close[-1], volume[-1])
+        return engine
+
+    def update(self, open_, high, low, close, volume):
+        """Folds one completed bar into the state and returns the feature row (a reused float32 buffer)."""
+        prev_close = self.prev_close
+        self.bars += 1
+        for window in self.closes.values():
+            window.push(close)
+        self.volumes.push(volume)
+
+        if self.bars == 1:
+            self.ema_fast = self.ema_slow = close
+        else:
+            self.returns.push(np.log(close / prev_close))
+            change = close - prev_close
+            gain, loss = max(change, 0.0), max(-change, 0.0)
+            if self.bars == 2:
+                self.avg_gain, self.avg_loss = gain, loss
+            else:
+                alpha = 1.0 / RSI_PERIOD
+                self.avg_gain += alpha * (gain - self.avg_gain)
+                self.avg_loss += alpha * (loss - self.avg_loss)
+            self.ema_fast += _ema_alpha(MACD_FAST) * (close - self.ema_fast)
+            self.ema_slow += _ema_alpha(MACD_SLOW) * (close - self.ema_slow)
+        macd = self.ema_fast - self.ema_slow
+        if self.bars == 1:
+            self.macd_signal = macd
+        else:
+            self.macd_signal += _ema_alpha(MACD_SIGNAL) * (macd - self.macd_signal)
+        self.prev_close = close
+
+        if self.bars % RESYNC_EVERY == 0:
+            for window in (self.returns, self.volumes, *self.closes.values()):
+                window.resync()
+        return self._write_row(close, volume)
+
+    def _write_row(self, close, volume):
+        row = self.row
+        row[:] = np.nan
+        if self.returns.count:
+            row[0] = self.returns.values[(self.returns.pos - 1) % self.returns.size]
+        if self.returns.full():
+            row[1] = self.returns.std()
+        for i, n in enumerate(MA_WINDOWS):
+            if self.closes[n].full():
+                row[2 + i] = close / self.closes[n].mean() - 1.0
+        rsi_col = 2 + len(MA_WINDOWS)
+        if self.bars > RSI_PERIOD:
+            row[rsi_col] = _rsi(np.float64(self.avg_gain), np.float64(self.avg_loss))
+        macd = self.ema_fast - self.ema_slow
+        if self.bars >= MACD_SLOW:
+            row[rsi_col + 1] = macd / close
+        if self.bars >= MACD_SLOW + MACD_SIGNAL - 1:
+            row[rsi_col + 2] = self.macd_signal / close
+            row[rsi_col + 3] = (macd - self.macd_signal) / close
+        if self.volumes.full():
+            std = self.volumes.std()
+            row[rsi_col + 4] = (volume - self.volumes.mean()) / std if std > 0 else 0.0
+        return row
+
+
+class MultiTimeframeFeatures:
+    """Live features for every model timeframe from a single stream of 1-minute bars. Each 1m bar
+    updates the 1m state; a higher-timeframe state is updated once its bucket closes."""
+
+    def __init__(self, engines):
+        self.engines = engines  # timeframe -> IncrementalFeatures
+        self.partial = {}       # timeframe -> [bucket_key, open, high, low, close, volume] still forming
+
+    @classmethod
+    def from_store(cls, symbol, store=None, timeframes=TIMEFRAMES, start=None):
+        """Seeds every timeframe from the store. A resampled bucket that the stored 1m bars have
+        not finished yet becomes the partial bar instead of a completed one."""
+        store = store or BarStore()
+        last_minute = store.last_timestamp(symbol, '1m')
+        engines, partial = {}, {}
+        for timeframe in timeframes:
+            columns = store.read_columns(symbol, timeframe, start=start)
+            resampled = timeframe != '1m' and not store.has(symbol, timeframe)
+            if resampled and len(columns['ts']) and last_minute is not None:
+                if bucket_end(columns['ts'][-1:], timeframe)[0] >= pd.Timestamp(last_minute).value + NS_PER_MINUTE:
+                    partial[timeframe] = [int(columns['ts'][-1]), *(float(columns[f][-1]) for f in
+                                                                    ('open', 'high', 'low', 'close', 'volume'))]
+                    columns = {name: values[:-1] for name, values in columns.items()}
+            engines[timeframe] = IncrementalFeatures.from_bars(columns)
+        features = cls(engines)
+        features.partial = partial
+        return features
+
+    def update(self, ts, open_, high, low, close, volume):
+        """Feeds one completed 1m bar (ts in UTC). Returns {timeframe: feature row} for every
+        timeframe whose bar completed with it."""
+        ts_ns = np.array([pd.Timestamp(ts).value], dtype=np.int64)
+        completed = {}
+        for timeframe, engine in self.engines.items():
+            if timeframe == '1m':
+                completed[timeframe] = engine.update(open_, high, low, close, volume)
+                continue
+            key = int(bucket_keys(ts_ns, timeframe)[0])
+            bar = self.partial.get(timeframe)
+            if bar is not None and bar[0] != key:
+                # The previous bucket ended without a bar in its last minute (e.g. after the equity close)
+                completed[timeframe] = engine.update(*bar[1:])
+                bar = None
+            if bar is None:
+                bar = self.partial[timeframe] = [key, open_, high, low, close, volume]
+            else:
+                bar[2] = max(bar[2], high)
+                bar[3] = min(bar[3], low)
+                bar[4] = close
+                bar[5] += volume
+            if ts_ns[0] + NS_PER_MINUTE > bucket_end(ts_ns, timeframe)[0]:
+                # This minute closes the bucket
+                completed[timeframe] = engine.update(*bar[1:])
+                del self.partial[timeframe]
+        return completed
@@ -0,0 +1,75 @@
+# ========== FIDELITY EXPORT READER ==========
+# Streaming reader for raw Fidelity Accounts_History_*.csv exports. The exports start with a
+# BOM and blank preamble lines, pad every field with spaces and end with a quoted disclaimer
+# footer. The reader locates the header and the end of the data with a single line scan, then
+# parses only the data block in fixed-size chunks with explicit dtypes, trimming as it goes,
+# so multi-year exports clean in bounded memory.
+
+import pandas as pd
+
+CHUNK_SIZE = 50000  # Rows per parsed chunk
+HEADER_PREFIX = 'Run Date,'
+ENCODING = 'utf-8-sig'  # Drops the leading BOM
+
+# Explicit dtypes for the export's columns; anything not listed is read as text
+RAW_DTYPES = {
+    'Run Date': str, 'Account': str, 'Action': str, 'Symbol': str, 'Description': str, 'Type': str,
+    'Exchange Quantity': 'float64', 'Exchange Currency': str, 'Quantity': 'float64', 'Currency': str,
+    'Price': 'float64', 'Exchange Rate': 'float64', 'Commission': 'float64', 'Fees': 'float64',
+    'Accrued Interest': 'float64', 'Amount': 'float64', 'Settlement Date': str,
+}
+
+
+def locate_data_block(file_path):
+    """Scans the file once and returns (header_line_index, data_row_count).
+    The data block ends at the first blank line after the header, where the disclaimer footer starts."""
+    header_index = None
+    row_count = 0
+    with open(file_path, 'r', encoding=ENCODING, newline='') as f:
+        for line_index, line in enumerate(f):
+            stripped = line.strip()
+            if header_index is None:
+                if stripped.startswith(HEADER_PREFIX):
+                    header_index = line_index
+                continue
+            if not stripped:
+                break
+            row_count += 1
+    if header_index is None:
+        raise ValueError(f"No '{HEADER_PREFIX.rstrip(',')}' header found in {file_path}")
+    return header_index, row_count
+
+
+def iter_fidelity_chunks(file_path, usecols=None, chunksize=CHUNK_SIZE):
+    """Yields trimmed DataFrame chunks of the export's data rows, skipping the preamble and footer.
+    `usecols` limits parsing to the given raw column names."""
+    header_index, row_count = locate_data_block(file_path)
+    if row_count == 0:
+        return
+
+    wanted = set(usecols) if usecols is not None else None
+    reader = pd.read_csv(
+        file_path,
+        encoding=ENCODING,
+        skiprows=header_index,
+        nrows=row_count,
+        chunksize=chunksize,
+        usecols=(lambda c: c.strip() in wanted) if wanted is not None else None,
+        dtype=RAW_DTYPES,
+        skipinitialspace=True,  # Trims the padding in front of unquoted fields while parsing
+    )
+    for chunk in reader:
+        chunk.columns = chunk.columns.str.strip()
+        # Quoted fields keep their inner padding (e.g. " YOU SOLD ..."), so trim the text columns
+        for column in chunk.columns:
+            if RAW_DTYPES.get(column, str) is str:
+                chunk[column] = chunk[column].str.strip()
+        yield chunk
+
+
+def read_fidelity_export(file_path, usecols=None, chunksize=CHUNK_SIZE):
+    """Reads a whole export through the streaming reader."""
+    chunks = list(iter_fidelity_chunks(file_path, usecols=usecols, chunksize=chunksize))
+    if not chunks:
+        return pd.DataFrame(columns=list(usecols) if usecols is not None else list(RAW_DTYPES))
+    return pd.concat(chunks, ignore_index=True)
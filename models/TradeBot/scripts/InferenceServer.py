@@ -0,0 +1,161 @@
+# ========== INFERENCE SERVER ==========
+# In-process serving for the timeframe models and the meta ("super") model. All models are loaded
+# once at start-up. Each timeframe keeps its latest feature rows for every symbol in one
+# preallocated float32 matrix, and its latest outputs in a shared (symbols x timeframes) matrix.
+# A 1m bar updates the live features (FeatureEngine.MultiTimeframeFeatures) and marks only the
+# timeframes whose bar closed as stale. decide() then runs each stale sub-model once on the batch
+# of stale symbols and reuses the cached outputs for everything else, so a typical tick costs one
+# 1m batch plus the meta model instead of five models per symbol.
+#
+#   server = InferenceServer.from_store(['BTC-USD'])
+#   server.on_bar('BTC-USD', ts, open_, high, low, close, volume)
+#   decisions = server.decide()        # {'BTC-USD': score in [-1, 1]}
+#
+# Models are any objects with predict(X) -> 1-D array (scikit-learn style), pickled under
+# models/<micro|mid|swing|trend|meta>_model/. Missing files fall back to BaselineModel and a
+# weighted average so the live loop can run before training is finished.
+
+import logging
+import os
+import pickle
+import threading
+import numpy as np
+import pandas as pd
+from BarStore import BarStore, TIMEFRAMES
+from FeatureEngine import FEATURE_NAMES, FEATURE_DTYPE, MultiTimeframeFeatures
+from Instrumentation import metrics
+
+try:
+    import joblib
+except ImportError:  # Plain pickle files work without joblib
+    joblib = None
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models')
+MODEL_PATHS = {
+    '1m': os.path.join('micro_model', 'model_1m.pkl'),
+    '15m': os.path.join('micro_model', 'model_15m.pkl'),
+    '1h': os.path.join('mid_model', 'model_1h.pkl'),
+    '1d': os.path.join('swing_model', 'model_1d.pkl'),
+    '1mo': os.path.join('trend_model', 'model_1mo.pkl'),
+}
+META_MODEL_PATH = os.path.join('meta_model', 'meta_model.pkl')
+META_WEIGHTS = {'1m': 0.1, '15m': 0.15, '1h': 0.25, '1d': 0.3, '1mo': 0.2}  # Fallback meta model
+
+
+class BaselineModel:
+    """Placeholder timeframe model: trend score from the SMA gap and MACD histogram, in [-1, 1]."""
+
+    def __init__(self, scale=50.0):
+        self.scale = scale
+        self._columns = [FEATURE_NAMES.index('sma_gap_10'), FEATURE_NAMES.index('macd_hist')]
+
+    def predict(self, X):
+        return np.tanh(self.scale * X[:, self._columns].sum(axis=1))
+
+
+class WeightedMetaModel:
+    """Fallback meta model: weighted average of the timeframe outputs."""
+
+    def __init__(self, weights, timeframes=TIMEFRAMES):
+        self.weights = np.array([weights[tf] for tf in timeframes], dtype=FEATURE_DTYPE)
+        self.weights /= self.weights.sum()
+
+    def predict(self, X):
+        return X @ self.weights
+
+
+def load_model(path, fallback=None):
+    """Loads a pickled model (joblib if available); returns `fallback` if the file is missing."""
+    if not os.path.exists(path):
+        if fallback is None:
+            raise FileNotFoundError(path)
+        logging.error(f"Model file not found: {path}; using {type(fallback).__name__}")
+        return fallback
+    if joblib is not None:
+        return joblib.load(path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def load_models(models_dir=MODELS_DIR, timeframes=TIMEFRAMES):
+    """({timeframe: model}, meta_model) loaded once at start-up."""
+    models = {tf: load_model(os.path.join(models_dir, MODEL_PATHS[tf]), BaselineModel()) for tf in timeframes}
+    meta_model = load_model(os.path.join(models_dir, META_MODEL_PATH), WeightedMetaModel(META_WEIGHTS, timeframes))
+    return models, meta_model
+
+
+class InferenceServer:
+    """Batched, cached inference over many symbols for the timeframe models and the meta model."""
+
+    def __init__(self, symbols, models, meta_model, features, timeframes=TIMEFRAMES):
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.timeframes = list(timeframes)
+        self.models = models
+        self.meta_model = meta_model
+        self.features = features  # symbol -> MultiTimeframeFeatures
+
+        n = len(self.symbols)
+        # Preallocated model inputs/outputs; rows are symbols
+        self.inputs = {tf: np.zeros((n, len(FEATURE_NAMES)), dtype=FEATURE_DTYPE) for tf in self.timeframes}
+        self.stale = {tf: np.zeros(n, dtype=bool) for tf in self.timeframes}
+        self.outputs = np.zeros((n, len(self.timeframes)), dtype=FEATURE_DTYPE)
+        self.decisions = np.zeros(n, dtype=FEATURE_DTYPE)
+        self.ready = np.zeros(n, dtype=bool)  # Symbols with new bars since the last decide()
+        self._lock = threading.Lock()
+
+        # Start from the features of the stored history so the first decision is not cold
+        for symbol, live in features.items():
+            i = self.index[symbol]
+            for tf, engine in live.engines.items():
+                self.inputs[tf][i] = engine.row
+                self.stale[tf][i] = True
+
+    @classmethod
+    def from_store(cls, symbols, store=None, models_dir=MODELS_DIR, timeframes=TIMEFRAMES):
+        """Loads the models once and seeds live features for every symbol from the bar store."""
+        store = store or BarStore()
+        models, meta_model = load_models(models_dir, timeframes)
+        features = {symbol: MultiTimeframeFeatures.from_store(symbol, store, timeframes) for symbol in symbols}
+        return cls(symbols, models, meta_model, features, timeframes)
+
+    def on_bar(self, symbol, ts, open_, high, low, close, volume):
+        """Feeds one completed 1m bar; timeframes whose bar closed with it are marked for re-evaluation."""
+        completed = self.features[symbol].update(ts, open_, high, low, close, volume)
+        i = self.index[symbol]
+        with self._lock:
+            for tf, row in completed.items():
+                self.inputs[tf][i] = row
+                self.stale[tf][i] = True
+            self.ready[i] = True
+
+    def decide(self, symbols=None):
+        """Re-evaluates stale (timeframe, symbol) pairs in one batch per timeframe, then runs the meta
+        model for the requested symbols (default: every symbol with a new bar). Returns {symbol: score}."""
+        with metrics.timer('inference.decision'), self._lock:
+            for col, tf in enumerate(self.timeframes):
+                rows = np.flatnonzero(self.stale[tf])
+                reused = len(self.symbols) - len(rows)
+                if reused:
+                    metrics.incr('inference.cached_outputs', reused)
+                if len(rows) == 0:
+                    continue
+                batch = np.nan_to_num(self.inputs[tf][rows])  # Indicators still warming up read as 0
+                with metrics.timer(f'inference.model.{tf}'):
+                    self.outputs[rows, col] = self.models[tf].predict(batch)
+                self.stale[tf][rows] = False
+                metrics.incr('inference.model_rows', len(rows))
+
+            rows = (np.flatnonzero(self.ready) if symbols is None
+                    else np.array([self.index[s] for s in symbols], dtype=int))
+            if len(rows):
+                with metrics.timer('inference.meta'):
+                    self.decisions[rows] = self.meta_model.predict(self.outputs[rows])
+                self.ready[rows] = False
+            return {self.symbols[i]: float(self.decisions[i]) for i in rows}
+
+    def outputs_frame(self):
+        """Cached sub-model outputs and the last decision per symbol (for logging and reports)."""
+        frame = pd.DataFrame(self.outputs, index=self.symbols, columns=self.timeframes)
+        frame['decision'] = self.decisions
+        return frame
@@ -0,0 +1,177 @@
+# ========== INSTRUMENTATION ==========
+# Lightweight, thread-safe run metrics shared by the data scripts: per-stage wall time and
+# rows/second, per-call latency histograms (p50/p95/p99) for Yahoo fetches and DB writes,
+# counters for cache hits/misses and retries. Every stage and notable event is written as a
+# structured JSON line to data/metrics/metrics.jsonl, and write_summary() saves one JSON run
+# summary per run so regressions and worker-count changes can be compared across runs.
+#
+#   with metrics.stage("clean", rows=len(data)): ...
+#   with metrics.timer("yahoo.info"): ...
+#   metrics.incr("metadata_cache.hits")
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+
+METRICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'metrics')
+METRICS_LOG = os.path.join(METRICS_DIR, 'metrics.jsonl')
+PERCENTILES = (50, 95, 99)
+MAX_SAMPLES = 100000  # Latency samples kept per metric (reservoir beyond this)
+
+
+class _JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, default=str)
+
+
+def _json_logger():
+    """Logger writing one JSON object per line to METRICS_LOG (separate from the error logs)."""
+    logger = logging.getLogger('bitbot.metrics')
+    if not logger.handlers:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        handler = logging.FileHandler(METRICS_LOG)
+        handler.setFormatter(_JsonLineFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+class StageTimer:
+    """Handle returned by RunMetrics.stage(); set .rows inside the block if the count is only known there."""
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.seconds = None
+
+
+class RunMetrics:
+    """Collects stage timings, latency samples and counters for one run."""
+
+    def __init__(self, run_name=None):
+        self.run_name = run_name or 'run'
+        self.started_at = time.time()
+        self.stages = []
+        self.latencies = {}
+        self.counters = {}
+        self._seen = {}  # Samples observed per latency metric, for reservoir sampling
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng()
+
+    # ---------- Recording ----------
+    @contextmanager
+    def stage(self, name, rows=None):
+        """Times a pipeline stage and logs it with its row count and rows/second."""
+        timer = StageTimer(name, rows)
+        start = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            timer.seconds = time.perf_counter() - start
+            entry = {'stage': name, 'seconds': round(timer.seconds, 4), 'rows': timer.rows,
+                     'rows_per_sec': round(timer.rows / timer.seconds, 1) if timer.rows and timer.seconds else None}
+            with self._lock:
+                self.stages.append(entry)
+            self.event('stage', **entry)
+
+    def observe(self, name, seconds):
+        """Adds one latency sample (seconds) to the named histogram."""
+        with self._lock:
+            samples = self.latencies.setdefault(name, [])
+            seen = self._seen[name] = self._seen.get(name, 0) + 1
+            if len(samples) < MAX_SAMPLES:
+                samples.append(seconds)
+            else:
+                slot = self._rng.integers(seen)
+                if slot < MAX_SAMPLES:
+                    samples[slot] = seconds
+
+    @contextmanager
+    def timer(self, name):
+        """Times the enclosed call into the named latency histogram (also on error)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def event(self, event, **fields):
+        """Writes a structured JSON log line."""
+        _json_logger().info({'ts': datetime.now().isoformat(timespec='milliseconds'), 'run': self.run_name,
+                             'event': event, **fields})
+
+    # ---------- Reporting ----------
+    def latency_summary(self):
+        """count, mean and p50/p95/p99/max in milliseconds for each latency metric."""
+        with self._lock:
+            latencies = {name: np.array(samples) for name, samples in self.latencies.items() if samples}
+            seen = dict(self._seen)
+        summary = {}
+        for name, samples in latencies.items():
+            ms = samples * 1000
+            summary[name] = {'count': seen[name], 'mean_ms': round(float(ms.mean()), 2),
+                             **{f'p{p}_ms': round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES))},
+                             'max_ms': round(float(ms.max()), 2)}
+        return summary
+
+    def cache_hit_rates(self):
+        """Hit rate for every counter pair named <cache>.hits / <cache>.misses."""
+        rates = {}
+        for name, hits in self.counters.items():
+            if name.endswith('.hits'):
+                cache = name[:-len('.hits')]
+                total = hits + self.counters.get(f'{cache}.misses', 0)
+                rates[cache] = round(hits / total, 4) if total else None
+        return rates
+
+    def summary(self):
+        return {
+            'run': self.run_name,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'wall_seconds': round(time.time() - self.started_at, 3),
+            'stages': list(self.stages),
+            'latency': self.latency_summary(),
+            'counters': dict(self.counters),
+            'cache_hit_rates': self.cache_hit_rates(),
+        }
+
+    def write_summary(self, path=None):
+        """Saves the run summary as JSON (data/metrics/<run>_<timestamp>.json by default) and logs it."""
+        summary = self.summary()
+        if path is None:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = os.path.join(METRICS_DIR, f"{self.run_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=1)
+        self.event('summary', path=path, wall_seconds=summary['wall_seconds'])
+        return path
+
+    def print_summary(self):
+        """Prints a compact table of stages, latencies and hit rates."""
+        summary = self.summary()
+        print(f"[METRICS] {summary['run']}: {summary['wall_seconds']}s")
+        for entry in summary['stages']:
+            rate = f", {entry['rows_per_sec']} rows/s" if entry['rows_per_sec'] else ''
+            print(f"  stage {entry['stage']:<24} {entry['seconds']:>9.3f}s{rate}")
+        for name, stats in summary['latency'].items():
+            print(f"  latency {name:<22} n={stats['count']} p50={stats['p50_ms']}ms "
+                  f"p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+        for cache, rate in summary['cache_hit_rates'].items():
+            print(f"  cache {cache:<24} hit rate {rate}")
+        for name, value in summary['counters'].items():
+            if not name.endswith(('.hits', '.misses')):
+                print(f"  counter {name:<22} {value}")
+
+
+# Shared instance for the current process; scripts set metrics.run_name at start-up
+metrics = RunMetrics()
@@ -0,0 +1,34 @@
+# ========== MASTER DATA MERGE ==========
+# Applies per-symbol values fetched during enrichment to the master data in one
+# vectorized pass, instead of masking the whole frame once per symbol and column.
+
+import pandas as pd
+
+
+def build_updates(records, columns):
+    """Turns a list of {'symbol': ..., <column>: ...} dicts into a side table indexed by symbol."""
+    updates = pd.DataFrame.from_records(records, columns=['symbol', *columns])
+    return updates.drop_duplicates(subset='symbol', keep='last').set_index('symbol')
+
+
+def apply_symbol_updates(master_data, updates, fill_only_if_blank=False):
+    """Writes each column of `updates` (indexed by symbol) onto every master_data row with that symbol.
+    With fill_only_if_blank, a symbol's value is only written when all of its rows are blank in that column."""
+    if updates.empty:
+        return master_data
+
+    symbols = master_data['symbol']
+    has_update = symbols.isin(updates.index)
+    for column in updates.columns:
+        if column not in master_data.columns:
+            master_data[column] = None
+        fetched = symbols.map(updates[column])
+
+        target = has_update
+        if fill_only_if_blank:
+            # Matches the per-symbol `.isna().all()` check: only symbols blank on every row are filled
+            blank_all = master_data[column].isna().groupby(symbols, dropna=False).transform('all')
+            target = target & blank_all.fillna(False).astype(bool)
+
+        master_data[column] = master_data[column].astype(object).where(~target, fetched)
+    return master_data
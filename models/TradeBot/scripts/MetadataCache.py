@@ -0,0 +1,153 @@
+# ========== YFINANCE METADATA CACHE ==========
+# Read-through SQLite cache for yf.Ticker(symbol).info shared by checkDelistings,
+# DataCleaning and DataProcessing. Each field has its own TTL (quoteType and sector
+# rarely change, prices change often) and the cache keeps at most MAX_SYMBOLS symbols,
+# evicting the least recently used ones first. Empty responses (Yahoo throttling or a failed
+# lookup) are never cached, so one bad call does not hide a symbol for a whole TTL.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import yfinance as yf
+from Instrumentation import metrics
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'cache',
+                                  'yfinance_info.sqlite')
+MAX_SYMBOLS = 10000  # LRU size limit
+
+DAY = 24 * 60 * 60
+# Time-to-live in seconds for each cached .info field
+FIELD_TTLS = {
+    "quoteType": 90 * DAY,
+    "longName": 30 * DAY,
+    "shortName": 30 * DAY,
+    "sector": 30 * DAY,
+    "industry": 30 * DAY,
+    "exchange": 30 * DAY,
+    "currency": 30 * DAY,
+    "marketCap": 1 * DAY,
+    "averageVolume": 1 * DAY,
+    "previousClose": 12 * 60 * 60,
+    "regularMarketPrice": 15 * 60,
+}
+
+
+class MetadataCache:
+    """Caches selected yfinance .info fields on disk, keyed by symbol."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_symbols=MAX_SYMBOLS, field_ttls=None, limiter=None):
+        self.path = path
+        self.max_symbols = max_symbols
+        self.field_ttls = dict(field_ttls or FIELD_TTLS)
+        self.limiter = limiter
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS info_fields (
+                symbol TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (symbol, field)
+            );
+            CREATE TABLE IF NOT EXISTS symbols (
+                symbol TEXT PRIMARY KEY,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_symbols_last_access ON symbols (last_access);
+        """)
+        self._conn.commit()
+
+    def _fetch_info(self, symbol):
+        """Fetches .info from Yahoo, honouring the shared rate limiter."""
+        if self.limiter:
+            self.limiter.acquire()
+        with metrics.timer('yahoo.info'):
+            return yf.Ticker(symbol).info or {}
+
+    def _read_fresh(self, symbol, fields, now):
+        """Returns cached values for fields that are still within their TTL."""
+        placeholders = ','.join('?' * len(fields))
+        rows = self._conn.execute(
+            f"SELECT field, value, fetched_at FROM info_fields WHERE symbol = ? AND field IN ({placeholders})",
+            [symbol, *fields]).fetchall()
+        fresh = {}
+        for field, value, fetched_at in rows:
+            if now - fetched_at <= self.field_ttls.get(field, DAY):
+                fresh[field] = json.loads(value)
+        return fresh
+
+    def _store(self, symbol, info, fields, now):
+        """Writes every tracked and requested field (missing ones as null) and evicts LRU symbols."""
+        tracked = dict.fromkeys([*self.field_ttls, *fields])
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO info_fields (symbol, field, value, fetched_at) VALUES (?, ?, ?, ?)",
+            [(symbol, field, json.dumps(info.get(field), default=str), now) for field in tracked])
+        self._touch(symbol, now)
+        self._evict()
+        self._conn.commit()
+
+    def _touch(self, symbol, now):
+        self._conn.execute("INSERT OR REPLACE INTO symbols (symbol, last_access) VALUES (?, ?)", (symbol, now))
+
+    def _evict(self):
+        """Drops the least recently used symbols once the cache exceeds max_symbols."""
+        count = self._conn.execute("SELECT COUNT(*) FROM symbols").fetchone()[0]
+        excess = count - self.max_symbols
+        if excess <= 0:
+            return
+        stale = [row[0] for row in self._conn.execute(
+            "SELECT symbol FROM symbols ORDER BY last_access LIMIT ?", (excess,))]
+        self._conn.executemany("DELETE FROM info_fields WHERE symbol = ?", [(s,) for s in stale])
+        self._conn.executemany("DELETE FROM symbols WHERE symbol = ?", [(s,) for s in stale])
+
+    def get_info(self, symbol, fields=None):
+        """Returns a dict of the requested .info fields, fetching from Yahoo only when one is missing or expired."""
+        fields = list(fields or self.field_ttls)
+        now = time.time()
+        with self._lock:
+            fresh = self._read_fresh(symbol, fields, now)
+            if len(fresh) == len(fields):
+                self.hits += 1
+                metrics.incr('metadata_cache.hits')
+                self._touch(symbol, now)
+                self._conn.commit()
+                return fresh
+
+        # Fetch outside the lock so concurrent workers are not serialised on network I/O
+        with self._lock:
+            self.misses += 1
+        metrics.incr('metadata_cache.misses')
+        info = self._fetch_info(symbol)
+        if not any(info.get(field) is not None for field in [*self.field_ttls, *fields]):
+            metrics.incr('metadata_cache.empty_responses')
+            return {field: None for field in fields}
+        with self._lock:
+            self._store(symbol, info, fields, time.time())
+        return {field: info.get(field) for field in fields}
+
+    def get(self, symbol, field, default=None):
+        """Returns a single cached .info field, or default when Yahoo has no value for it."""
+        value = self.get_info(symbol, [field]).get(field)
+        return default if value is None else value
+
+    def invalidate(self, symbol):
+        """Removes all cached fields for a symbol."""
+        with self._lock:
+            self._conn.execute("DELETE FROM info_fields WHERE symbol = ?", (symbol,))
+            self._conn.execute("DELETE FROM symbols WHERE symbol = ?", (symbol,))
+            self._conn.commit()
+
+    def close(self):
+        try:
+            self._conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error closing metadata cache {self.path}: {e}")
@@ -0,0 +1,210 @@
+# ========== POSITION ENGINE ==========
+# Folds cleaned ledger fills into running positions per (portfolio_name, symbol): signed
+# quantity, FIFO lots, average cost and realized P&L under both methods. State is kept as a
+# compact JSON snapshot, so a new day's rows are applied in O(new rows) on top of the last
+# snapshot instead of replaying the whole 2021-2024 history.
+#
+# Conventions:
+#   - quantity is signed (buys > 0, sells < 0); short positions are carried as negative lots
+#   - commission and fees are folded into the fill price (added to cost, taken from proceeds)
+#   - options use a 100x multiplier; expired contracts close at a price of 0
+#   - exports carry no intraday time, so within a day buys are applied before sells
+
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from SymbolClassifier import OPTION, classify_symbols
+
+OPTION_MULTIPLIER = 100
+EPSILON = 1e-9  # Quantities smaller than this are treated as flat (fractional share rounding)
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'positions_snapshot.json')
+
+
+def _new_position(multiplier):
+    return {'quantity': 0.0, 'avg_cost': 0.0, 'lots': [], 'realized_fifo': 0.0, 'realized_avg': 0.0,
+            'fees': 0.0, 'multiplier': multiplier, 'last_date': None}
+
+
+def _apply_fill(position, quantity, price):
+    """Applies one signed fill at an all-in price to a position, updating lots, cost and realized P&L."""
+    held = position['quantity']
+    multiplier = position['multiplier']
+    remaining = abs(quantity)
+
+    # Closing part: the fill goes against the current position
+    if held * quantity < 0:
+        direction = 1.0 if held > 0 else -1.0
+        closing = min(remaining, abs(held))
+        position['realized_avg'] += closing * direction * (price - position['avg_cost']) * multiplier
+
+        lots, to_close = position['lots'], closing
+        while to_close > EPSILON and lots:
+            lot = lots[0]
+            take = min(to_close, abs(lot[0]))
+            position['realized_fifo'] += take * direction * (price - lot[1]) * multiplier
+            lot[0] -= direction * take
+            to_close -= take
+            if abs(lot[0]) <= EPSILON:
+                lots.pop(0)
+
+        held -= direction * closing
+        remaining -= closing
+        if abs(held) <= EPSILON:
+            held, position['avg_cost'], position['lots'] = 0.0, 0.0, []
+
+    # Opening part: whatever is left adds to (or flips into) the fill's direction
+    if remaining > EPSILON:
+        signed = remaining if quantity > 0 else -remaining
+        position['avg_cost'] = (abs(held) * position['avg_cost'] + remaining * price) / (abs(held) + remaining)
+        position['lots'].append([signed, price])
+        held += signed
+
+    position['quantity'] = held
+
+
+class PositionEngine:
+    """Running positions keyed by (portfolio_name, symbol), with snapshot load/save and a query API."""
+
+    def __init__(self):
+        self.positions = {}
+        self.as_of = None       # Latest transaction_date applied
+        self.rows_applied = 0
+
+    # ---------- Updates ----------
+    def apply_transactions(self, data):
+        """Applies new ledger rows (cleaned ledger or fidelity_transactions layout). Returns rows applied.
+        Callers pass only rows not applied before, e.g. the new rows returned by incremental ingestion."""
+        fills = prepare_fills(data)
+        columns = (fills['portfolio_name'].to_numpy(), fills['symbol'].to_numpy(), fills['quantity'].to_numpy(),
+                   fills['fill_price'].to_numpy(), fills['fees'].to_numpy(), fills['multiplier'].to_numpy(),
+                   fills['transaction_date'].to_numpy())
+        for portfolio, symbol, quantity, price, fees, multiplier, date in zip(*columns):
+            key = (portfolio, symbol)
+            position = self.positions.get(key)
+            if position is None:
+                position = self.positions[key] = _new_position(float(multiplier))
+            _apply_fill(position, float(quantity), float(price))
+            position['fees'] += float(fees)
+            position['last_date'] = date
+
+        if not fills.empty:
+            latest = fills['transaction_date'].iloc[-1]
+            self.as_of = latest if self.as_of is None else max(self.as_of, latest)
+        self.rows_applied += len(fills)
+        return len(fills)
+
+    # ---------- Queries ----------
+    def quantity(self, portfolio, symbol):
+        """Current signed quantity held (0.0 if never traded)."""
+        position = self.positions.get((portfolio, symbol))
+        return position['quantity'] if position else 0.0
+
+    def position(self, portfolio, symbol):
+        """Returns a copy of one position's state, or None."""
+        position = self.positions.get((portfolio, symbol))
+        if position is None:
+            return None
+        return {**position, 'lots': [list(lot) for lot in position['lots']]}
+
+    def positions_frame(self, portfolio=None, include_closed=False):
+        """All positions as a DataFrame, optionally limited to one portfolio and/or open positions."""
+        rows = []
+        for (name, symbol), p in self.positions.items():
+            if portfolio is not None and name != portfolio:
+                continue
+            if not include_closed and p['quantity'] == 0:
+                continue
+            rows.append({
+                'portfolio_name': name, 'symbol': symbol, 'quantity': p['quantity'], 'avg_cost': p['avg_cost'],
+                'fifo_cost_basis': sum(q * price for q, price in p['lots']) * p['multiplier'],
+                'realized_pnl_fifo': p['realized_fifo'], 'realized_pnl_avg': p['realized_avg'],
+                'fees': p['fees'], 'multiplier': p['multiplier'], 'last_date': p['last_date'],
+            })
+        columns = ['portfolio_name', 'symbol', 'quantity', 'avg_cost', 'fifo_cost_basis', 'realized_pnl_fifo',
+                   'realized_pnl_avg', 'fees', 'multiplier', 'last_date']
+        return pd.DataFrame(rows, columns=columns)
+
+    def holdings(self):
+        """Open quantity and FIFO cost basis per symbol, summed across portfolios."""
+        frame = self.positions_frame()
+        return frame.groupby('symbol')[['quantity', 'fifo_cost_basis']].sum()
+
+    def realized_pnl(self, portfolio=None, symbol=None, method='fifo'):
+        """Total realized P&L under 'fifo' or 'avg', optionally for one portfolio and/or symbol."""
+        field = 'realized_fifo' if method == 'fifo' else 'realized_avg'
+        return sum(p[field] for (name, sym), p in self.positions.items()
+                   if (portfolio is None or name == portfolio) and (symbol is None or sym == symbol))
+
+    # ---------- Snapshot ----------
+    def save(self, path=DEFAULT_SNAPSHOT_PATH):
+        """Writes the snapshot atomically (tmp file + os.replace)."""
+        snapshot = {
+            'as_of': self.as_of,
+            'rows_applied': self.rows_applied,
+            'positions': [{'portfolio_name': name, 'symbol': symbol, **p} for (name, symbol), p in self.positions.items()],
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path=DEFAULT_SNAPSHOT_PATH):
+        """Restores an engine from a snapshot; returns an empty engine if the file does not exist."""
+        engine = cls()
+        if not os.path.exists(path):
+            return engine
+        with open(path) as f:
+            snapshot = json.load(f)
+        engine.as_of = snapshot.get('as_of')
+        engine.rows_applied = snapshot.get('rows_applied', 0)
+        for entry in snapshot.get('positions', []):
+            key = (entry.pop('portfolio_name'), entry.pop('symbol'))
+            engine.positions[key] = entry
+        return engine
+
+
+def prepare_fills(data):
+    """Normalizes ledger rows into fills: portfolio_name, symbol, quantity, fill_price, fees, multiplier, date.
+    Rows without a quantity (dividends, interest, cash movements) are dropped."""
+    data = data.rename(columns={'ticker': 'symbol'})
+    quantity = pd.to_numeric(data['quantity'], errors='coerce')
+    price = pd.to_numeric(data['price'], errors='coerce').fillna(0.0)  # Expired options carry no price
+    fees = pd.Series(0.0, index=data.index)
+    for column in ('commission', 'fees'):
+        if column in data.columns:
+            fees += pd.to_numeric(data[column], errors='coerce').fillna(0.0)
+
+    fills = pd.DataFrame({
+        'portfolio_name': data['portfolio_name'].astype(str),
+        'symbol': data['symbol'].astype(str).str.strip(),
+        'quantity': quantity,
+        'price': price,
+        'fees': fees,
+        'transaction_date': data['transaction_date'].astype(str).str.replace('-', '/', regex=False),
+    })
+    fills = fills[fills['quantity'].notna() & (fills['quantity'].abs() > EPSILON)]
+
+    # Options are quoted per share but traded per contract
+    is_option = classify_symbols(fills['symbol']).to_numpy() == OPTION
+    fills['multiplier'] = np.where(is_option, OPTION_MULTIPLIER, 1.0)
+    # Fees per unit raise the cost of buys and lower the proceeds of sells
+    fills['fill_price'] = fills['price'] + fills['fees'] / (fills['quantity'] * fills['multiplier'])
+
+    # Oldest first; within a day, buys before sells
+    fills['is_sell'] = fills['quantity'] < 0
+    return fills.sort_values(['transaction_date', 'is_sell'], kind='stable').reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    # Usage: python PositionEngine.py <ledger.csv> [<ledger.csv> ...]
+    # Rebuilds positions from the given ledgers, saves the snapshot and prints open positions.
+    engine = PositionEngine()
+    for ledger_path in sys.argv[1:]:
+        engine.apply_transactions(pd.read_csv(ledger_path))
+    print(f"Snapshot saved to {engine.save()} (as of {engine.as_of}, {engine.rows_applied} fills)")
+    print(engine.positions_frame().to_string(index=False))
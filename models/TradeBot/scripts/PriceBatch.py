@@ -0,0 +1,127 @@
+# ========== BATCHED PRICE FETCH ==========
+# Downloads price history for many symbols with one yf.download call per chunk and
+# reduces it to a per-symbol summary (first/last trade date, volume), so callers
+# no longer need a history() round trip for every symbol. Passing a BarStore keeps the
+# downloaded bars locally instead of discarding them after the summary. A chunk whose download
+# failed is marked `failed` rather than reported as symbols with no bars, so callers can retry
+# those symbols instead of recording them as never traded. yf.download also swallows per-ticker
+# errors (a timed-out symbol just comes back empty), so fetch_symbol_history() re-checks a single
+# symbol through Ticker.history, which raises them.
+
+import logging
+import pandas as pd
+import yfinance as yf
+from EnrichmentPipeline import is_transient
+from Instrumentation import metrics
+
+try:
+    from yfinance.exceptions import YFTickerMissingError
+except ImportError:  # Older yfinance releases have no dedicated missing-ticker error
+    YFTickerMissingError = None
+
+DEFAULT_CHUNK_SIZE = 100  # Symbols per multi-ticker download
+SUMMARY_COLUMNS = ['first_date', 'last_date', 'volume_sum', 'bars', 'failed']
+
+
+def chunk_symbols(symbols, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Splits symbols into unique, order-preserving chunks of at most chunk_size."""
+    unique_symbols = list(dict.fromkeys(s for s in symbols if isinstance(s, str) and s))
+    return [unique_symbols[i:i + chunk_size] for i in range(0, len(unique_symbols), chunk_size)]
+
+
+def download_chunk(symbols, period="5d", interval="1d", limiter=None):
+    """Downloads one chunk of symbols in a single request, returning a frame with (symbol, field) columns."""
+    if limiter:
+        limiter.acquire()
+    with metrics.timer('yahoo.download'):
+        data = yf.download(symbols, period=period, interval=interval, group_by='ticker',
+                           auto_adjust=False, threads=True, progress=False)
+    metrics.incr('yahoo.download.symbols', len(symbols))
+    if data is None or data.empty:
+        return pd.DataFrame()
+
+    # A single-symbol download may come back with flat columns; normalise to (symbol, field)
+    if not isinstance(data.columns, pd.MultiIndex):
+        data.columns = pd.MultiIndex.from_product([[symbols[0]], data.columns])
+    return data
+
+
+def summarize_chunk(data, symbols):
+    """Reduces a (symbol, field) price frame to one row per symbol using column-wise operations."""
+    summary = pd.DataFrame(index=pd.Index(symbols, name='symbol'), columns=SUMMARY_COLUMNS)
+    summary['bars'] = 0
+    summary['volume_sum'] = 0.0
+    summary['failed'] = False
+    if data.empty:
+        return summary
+
+    close = data.xs('Close', axis=1, level=1)
+    volume = data.xs('Volume', axis=1, level=1)
+    has_bar = close.notna()
+
+    bars = has_bar.sum()
+    traded = bars[bars > 0].index
+    summary.loc[traded, 'bars'] = bars[traded]
+    summary.loc[traded, 'first_date'] = has_bar[traded].idxmax()
+    summary.loc[traded, 'last_date'] = has_bar[traded].iloc[::-1].idxmax()
+    summary.loc[traded, 'volume_sum'] = volume[traded].where(has_bar[traded]).sum()
+    return summary
+
+
+def fetch_history_summary(symbols, period="5d", interval="1d", chunk_size=DEFAULT_CHUNK_SIZE, limiter=None,
+                          store=None, raise_errors=False):
+    """Fetches history for all symbols in chunks and returns a DataFrame indexed by symbol
+    with first_date, last_date, volume_sum, bars and failed. Symbols without data have bars == 0;
+    symbols whose chunk download raised have failed == True (or, with raise_errors, the error propagates).
+    With a BarStore, each chunk's bars are also appended to the store under `interval`."""
+    summaries = []
+    for chunk in chunk_symbols(symbols, chunk_size):
+        try:
+            data = download_chunk(chunk, period=period, interval=interval, limiter=limiter)
+        except Exception as e:
+            metrics.incr('yahoo.download.errors')
+            if raise_errors:
+                raise
+            logging.error(f"Error downloading price history for chunk starting {chunk[0]}: {e}")
+            summary = summarize_chunk(pd.DataFrame(), chunk)
+            summary['failed'] = True
+            summaries.append(summary)
+            continue
+        if store is not None:
+            store.append_download(data, interval)
+        summaries.append(summarize_chunk(data, chunk))
+
+    if not summaries:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS, index=pd.Index([], name='symbol'))
+    summary = pd.concat(summaries)
+    summary['first_date'] = pd.to_datetime(summary['first_date'])
+    summary['last_date'] = pd.to_datetime(summary['last_date'])
+    summary['bars'] = summary['bars'].astype(int)
+    summary['volume_sum'] = summary['volume_sum'].astype(float)
+    summary['failed'] = summary['failed'].astype(bool)
+    return summary
+
+
+def fetch_symbol_history(symbol, period="max", interval="1d", limiter=None, store=None):
+    """Confirms one symbol's history with Ticker.history, which raises network errors instead of
+    returning an empty frame. Returns a one-row summary like fetch_history_summary; bars == 0 only
+    when Yahoo answered that it has no prices for the symbol."""
+    if limiter:
+        limiter.acquire()
+    try:
+        with metrics.timer('yahoo.history'):
+            data = yf.Ticker(symbol).history(period=period, interval=interval, auto_adjust=False, raise_errors=True)
+    except Exception as e:
+        metrics.incr('yahoo.history.errors')
+        if is_transient(e) or YFTickerMissingError is None or not isinstance(e, YFTickerMissingError):
+            raise
+        data = pd.DataFrame()
+    if data.empty:
+        return summarize_chunk(pd.DataFrame(), [symbol])
+    if store is not None:
+        store.append(symbol, interval, data)
+    data.columns = pd.MultiIndex.from_product([[symbol], data.columns])
+    summary = summarize_chunk(data, [symbol])
+    summary['first_date'] = pd.to_datetime(summary['first_date'])
+    summary['last_date'] = pd.to_datetime(summary['last_date'])
+    return summary
@@ -0,0 +1,38 @@
+# ========== RATE LIMITER ==========
+# Thread-safe token bucket limiter shared by the scripts that call Yahoo Finance.
+# Each host gets its own bucket so a burst against one endpoint does not starve another.
+
+import threading
+import time
+from Instrumentation import metrics
+
+# Default host key used for every yfinance call (query1/query2.finance.yahoo.com)
+YAHOO_HOST = "finance.yahoo.com"
+
+
+class RateLimiter:
+    """Limits calls to `rate` per second per host, allowing bursts of up to `burst` calls."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self._buckets = {}  # host -> [tokens, last_refill_time]
+        self._lock = threading.Lock()
+
+    def acquire(self, host=YAHOO_HOST):
+        """Blocks until a call to `host` is allowed."""
+        if self.rate <= 0:
+            return  # A rate of zero disables limiting
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(host, [self.burst, now])
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self._buckets[host] = [tokens - 1, now]
+                    break
+                self._buckets[host] = [tokens, now]
+                wait_time = (1 - tokens) / self.rate
+            time.sleep(wait_time)
+        metrics.observe('rate_limiter.wait', time.monotonic() - started)
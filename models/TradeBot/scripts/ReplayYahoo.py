@@ -0,0 +1,205 @@
+# ========== YFINANCE REPLAY BACKEND ==========
+# Offline stand-in for the parts of yfinance the scripts use (Ticker(...).info,
+# Ticker(...).history() and yf.download(..., group_by='ticker')). Responses come from a
+# fixture file instead of Yahoo, with configurable latency and error injection, so the
+# pipeline can be benchmarked and exercised without network access.
+#
+# Fixture format (JSON):
+#   {"recorded_at": "YYYY-MM-DD",
+#    "symbols": {"AAPL": {"info": {...}, "first_date": "1980-12-12",
+#                         "bars": [["2024-10-21", open, high, low, close, volume], ...]}, ...}}
+# History is stored compactly as the first trade date plus the most recent bars; on replay the
+# dates are shifted so recorded_at lines up with the last business day.
+
+import json
+import random
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from unittest import mock
+import pandas as pd
+
+RECENT_BARS = 5
+FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+PERIOD_DAYS = {'1d': 1, '5d': 7, '1mo': 31, '3mo': 92, '6mo': 183, '1y': 366, '2y': 731, '5y': 1827,
+               '10y': 3653, 'ytd': 366, 'max': None}
+
+
+def last_business_day(day=None):
+    """Most recent weekday on or before `day` (today by default)."""
+    day = pd.Timestamp(day or pd.Timestamp.now().normalize())
+    return day if day.weekday() < 5 else day - pd.offsets.BDay(1)
+
+
+# ========== FIXTURES ==========
+def _seeded(symbol):
+    return random.Random(zlib.crc32(symbol.encode()))
+
+
+def synthetic_entry(symbol, info, first_date=None, active=True, end=None):
+    """Builds a fixture entry; active symbols get RECENT_BARS bars ending at `end`, others none."""
+    rng = _seeded(symbol)
+    bars = []
+    if active:
+        close = round(rng.uniform(5, 500), 2)
+        for day in pd.bdate_range(end=end or last_business_day(), periods=RECENT_BARS):
+            close = round(close * rng.uniform(0.97, 1.03), 2)
+            bars.append([day.strftime('%Y-%m-%d'), close, close * 1.01, close * 0.99, close, close,
+                         rng.randint(10_000, 5_000_000)])
+    return {'info': info, 'first_date': first_date if active else None, 'bars': bars}
+
+
+def build_fixtures(master_data, status_report=None):
+    """Synthesizes fixtures from a master_data table (symbol, asset_name/longname, sector, industry,
+    first_traded) and an optional weekly status report (Ticker, Status). Symbols the report marks
+    as anything but Active get an empty history, as Yahoo returns for delisted tickers."""
+    statuses = {}
+    if status_report is not None:
+        statuses = dict(zip(status_report['Ticker'].astype(str), status_report['Status'].astype(str)))
+
+    end = last_business_day()
+    symbols = {}
+    for row in master_data.dropna(subset=['symbol']).drop_duplicates('symbol').to_dict('records'):
+        symbol = str(row['symbol']).strip()
+        name = row.get('longname') or row.get('asset_name')
+        is_fund = len(symbol) == 5 and symbol.endswith('X')
+        info = {
+            'quoteType': 'MUTUALFUND' if is_fund else 'EQUITY',
+            'longName': name if isinstance(name, str) else None,
+            'shortName': name if isinstance(name, str) else None,
+            'sector': row.get('sector') if isinstance(row.get('sector'), str) else None,
+            'industry': row.get('industry') if isinstance(row.get('industry'), str) else None,
+            'currency': 'USD',
+        }
+        first = pd.to_datetime(row.get('first_traded'), errors='coerce')
+        first_date = first.strftime('%Y-%m-%d') if pd.notna(first) else '2000-01-03'
+        active = statuses.get(symbol, 'Active') == 'Active'
+        symbols[symbol.replace('.', '-')] = synthetic_entry(symbol, info, first_date, active, end)
+    return {'recorded_at': end.strftime('%Y-%m-%d'), 'symbols': symbols}
+
+
+def record_fixtures(symbols, info_fields=('quoteType', 'longName', 'shortName', 'sector', 'industry', 'currency')):
+    """Records live .info and history responses for `symbols` (needs network and yfinance)."""
+    import yfinance as yf
+    fixtures = {}
+    for symbol in symbols:
+        ticker = yf.Ticker(symbol)
+        info = ticker.info or {}
+        history = ticker.history(period='max', auto_adjust=False)
+        bars = [[d.strftime('%Y-%m-%d'), *[float(r[f]) for f in FIELDS[:-1]], int(r['Volume'])]
+                for d, r in history.tail(RECENT_BARS).iterrows()]
+        fixtures[symbol] = {'info': {f: info.get(f) for f in info_fields},
+                            'first_date': history.index[0].strftime('%Y-%m-%d') if not history.empty else None,
+                            'bars': bars}
+    return {'recorded_at': last_business_day().strftime('%Y-%m-%d'), 'symbols': fixtures}
+
+
+def save_fixtures(fixtures, path):
+    with open(path, 'w') as f:
+        json.dump(fixtures, f)
+
+
+def load_fixtures(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# ========== REPLAY ==========
+class ReplayBackend:
+    """Serves fixture responses with injected latency and transient errors."""
+
+    def __init__(self, fixtures, latency=0.0, jitter=0.5, error_rate=0.0, download_latency_per_symbol=0.0005,
+                 seed=None):
+        self.symbols = fixtures['symbols']
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.download_latency_per_symbol = download_latency_per_symbol
+        self.calls = {'info': 0, 'history': 0, 'download': 0, 'errors': 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # Recorded dates are moved forward so the newest recorded bar lands on the last business day
+        recorded_at = pd.Timestamp(fixtures.get('recorded_at') or last_business_day())
+        self._shift = pd.offsets.BDay(len(pd.bdate_range(recorded_at, last_business_day())) - 1)
+        self._frames = {}
+
+    def _call(self, kind, extra_latency=0.0):
+        """Counts the call, sleeps for the simulated latency and raises an injected error if drawn."""
+        with self._lock:
+            self.calls[kind] += 1
+            delay = self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter)) + extra_latency
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.calls['errors'] += 1
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise TimeoutError(f"replay: injected timeout on {kind}")
+
+    def _frame(self, symbol):
+        """Full replayed history for a symbol: the first bar plus the recorded recent bars."""
+        if symbol not in self._frames:
+            entry = self.symbols.get(symbol)
+            rows = []
+            if entry and entry['bars']:
+                rows = [[pd.Timestamp(b[0]) + self._shift, *b[1:]] for b in entry['bars']]
+                first = pd.Timestamp(entry['first_date']) if entry.get('first_date') else None
+                if first is not None and first < rows[0][0]:
+                    rows.insert(0, [first, *entry['bars'][0][1:]])
+            frame = pd.DataFrame(rows, columns=['Date', *FIELDS]).set_index('Date')
+            frame.index = pd.DatetimeIndex(frame.index, name='Date')
+            self._frames[symbol] = frame
+        return self._frames[symbol]
+
+    def _window(self, symbol, period):
+        frame = self._frame(symbol)
+        days = PERIOD_DAYS.get(period, 7)
+        if days is None or frame.empty:
+            return frame
+        return frame[frame.index > pd.Timestamp.now().normalize() - pd.Timedelta(days=days)]
+
+    # ---------- yfinance surface ----------
+    def Ticker(self, symbol):
+        return ReplayTicker(self, symbol)
+
+    def download(self, tickers, period='5d', interval='1d', group_by='ticker', **kwargs):
+        symbols = [tickers] if isinstance(tickers, str) else list(tickers)
+        self._call('download', self.download_latency_per_symbol * len(symbols))
+        frames = [self._window(s, period).reindex(columns=FIELDS) for s in symbols]
+        data = pd.concat(frames, axis=1, keys=symbols) if frames else pd.DataFrame()
+        return data.astype(float)
+
+
+class ReplayTicker:
+    """Mimics yf.Ticker for .info and .history()."""
+
+    def __init__(self, backend, symbol):
+        self._backend = backend
+        self.ticker = symbol
+
+    @property
+    def info(self):
+        self._backend._call('info')
+        entry = self._backend.symbols.get(self.ticker)
+        return dict(entry['info']) if entry else {'trailingPegRatio': None}
+
+    def history(self, period='1mo', interval='1d', **kwargs):
+        self._backend._call('history')
+        return self._backend._window(self.ticker, period).copy()
+
+
+@contextmanager
+def patch_yfinance(backend):
+    """Routes yfinance.Ticker and yfinance.download through the replay backend."""
+    with mock.patch('yfinance.Ticker', backend.Ticker), mock.patch('yfinance.download', backend.download):
+        yield backend
+
+
+if __name__ == "__main__":
+    import sys
+    # Usage: python ReplayYahoo.py <master_data.csv> <status_report.csv> <fixtures.json>
+    master_csv, status_csv, fixtures_path = sys.argv[1:4]
+    built = build_fixtures(pd.read_csv(master_csv, dtype=str), pd.read_csv(status_csv, dtype=str))
+    save_fixtures(built, fixtures_path)
+    print(f"Wrote {len(built['symbols'])} symbols to {fixtures_path}")
@@ -0,0 +1,254 @@
+# ========== REVIEW GATE ==========
+# Headless mode and deferred review for the data scripts. With --headless (or BITBOT_HEADLESS=1)
+# every input() prompt is skipped, so runs can be scheduled under cron. Each run instead writes a
+# compact review artifact (new symbols, changed fields, failed rows) to data/reviews/, and the
+# steps that need a human decision - promoting a new master file, uploading to the database -
+# are queued on that artifact instead of running. Approving the review later runs them:
+#
+#   python ReviewGate.py list
+#   python ReviewGate.py show <review_id>
+#   python ReviewGate.py approve <review_id>
+#   python ReviewGate.py reject <review_id>
+
+import hashlib
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+import pandas as pd
+from Storage import parquet_path_for, read_table, write_table
+
+HEADLESS_ENV = 'BITBOT_HEADLESS'
+REVIEW_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'reviews')
+MAX_LISTED_CHANGES = 5000  # Changed fields kept in one artifact; the summary still counts all of them
+
+PENDING, APPROVED, REJECTED = 'pending', 'approved', 'rejected'
+
+
+# ========== HEADLESS PROMPTS ==========
+def is_headless():
+    """True when running with --headless or BITBOT_HEADLESS=1."""
+    return '--headless' in sys.argv or os.getenv(HEADLESS_ENV, '').strip().lower() in ('1', 'true', 'yes')
+
+
+def pause(message):
+    """input() pause that is skipped in headless mode."""
+    if not is_headless():
+        input(message)
+
+
+def confirm(prompt):
+    """Asks a y/n question; headless runs always continue (gated steps go through gated() instead)."""
+    if is_headless():
+        return True
+    return input(f"{prompt} (y/n): ").strip().lower() == 'y'
+
+
+# ========== REVIEW ARTIFACTS ==========
+def diff_tables(old, new, key='symbol'):
+    """Compares two versions of a table keyed by `key`.
+    Returns (new_keys, removed_keys, changes) where changes has columns key, field, old_value, new_value."""
+    old = (old if old is not None else pd.DataFrame(columns=[key])).dropna(subset=[key])
+    new = new.dropna(subset=[key])
+    old = old.drop_duplicates(subset=[key], keep='last').set_index(key)
+    new = new.drop_duplicates(subset=[key], keep='last').set_index(key)
+
+    new_keys = sorted(new.index.difference(old.index).astype(str))
+    removed_keys = sorted(old.index.difference(new.index).astype(str))
+
+    common_keys = new.index.intersection(old.index)
+    common_columns = [c for c in new.columns if c in old.columns]
+    before = old.loc[common_keys, common_columns].astype(object)
+    after = new.loc[common_keys, common_columns].astype(object)
+    differs = (before != after) & ~(before.isna() & after.isna())
+
+    changes = pd.DataFrame({
+        'old_value': before.where(differs).stack(future_stack=True),
+        'new_value': after.where(differs).stack(future_stack=True),
+        'differs': differs.stack(future_stack=True),
+    })
+    changes = changes[changes['differs']].drop(columns='differs')
+    changes.index.names = [key, 'field']
+    return new_keys, removed_keys, changes.reset_index()
+
+
+def _clean(value):
+    """JSON-safe scalar (NaN -> None)."""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    return value if isinstance(value, (bool, int, float, str)) else str(value)
+
+
+def review_path_for(review_id, review_dir=REVIEW_DIR):
+    return os.path.join(review_dir, f"review_{review_id}.json")
+
+
+def write_review(stage, old=None, new=None, failed_rows=None, key='symbol', review_dir=REVIEW_DIR):
+    """Writes a pending review artifact for one run and returns its path.
+    `failed_rows` maps key -> error message (or is a list of keys)."""
+    review_id = f"{stage}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    new_keys, removed_keys, changes = ([], [], pd.DataFrame()) if new is None else diff_tables(old, new, key)
+    if isinstance(failed_rows, dict):
+        failed = [{key: k, 'error': str(v)} for k, v in failed_rows.items()]
+    else:
+        failed = [{key: k} for k in (failed_rows or [])]
+
+    review = {
+        'review_id': review_id,
+        'stage': stage,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'status': PENDING,
+        'summary': {'new': len(new_keys), 'removed': len(removed_keys), 'changed_fields': len(changes),
+                    'failed': len(failed)},
+        'new_symbols': new_keys,
+        'removed_symbols': removed_keys,
+        'changed_fields': [[_clean(v) for v in row] for row in changes.head(MAX_LISTED_CHANGES).itertuples(index=False)],
+        'failed_rows': failed,
+        'pending_actions': [],
+    }
+    _save_review(review, review_path_for(review_id, review_dir))
+    return review_path_for(review_id, review_dir)
+
+
+def _save_review(review, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(review, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_review(review):
+    """Loads a review by id or path."""
+    path = review if os.path.exists(str(review)) else review_path_for(review)
+    with open(path) as f:
+        return json.load(f), path
+
+
+def list_reviews(status=None, review_dir=REVIEW_DIR):
+    """Summaries of the stored reviews, oldest first."""
+    if not os.path.isdir(review_dir):
+        return []
+    reviews = []
+    for name in sorted(os.listdir(review_dir)):
+        if name.startswith('review_') and name.endswith('.json'):
+            review, _ = load_review(os.path.join(review_dir, name))
+            if status is None or review['status'] == status:
+                reviews.append(review)
+    return reviews
+
+
+# ========== GATED ACTIONS ==========
+def table_digest(path):
+    """sha256 over a table's CSV and Parquet copies, so a reviewed candidate can be told apart from a later run's."""
+    digest = hashlib.sha256()
+    for copy_path in (path, parquet_path_for(path)):
+        if os.path.exists(copy_path):
+            digest.update(os.path.basename(copy_path).encode())
+            with open(copy_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def promote_table_action(source, target, schema=None):
+    """Copies a candidate table over the live one (CSV and Parquet copies)."""
+    return {'type': 'promote_table', 'source': os.path.abspath(source), 'target': os.path.abspath(target),
+            'schema': schema, 'sha256': table_digest(source)}
+
+
+def db_upload_action(source, table, key_columns=('symbol',)):
+    """Upserts a saved table into the database."""
+    return {'type': 'db_upload', 'source': os.path.abspath(source), 'table': table, 'key_columns': list(key_columns),
+            'sha256': table_digest(source)}
+
+
+def stale_actions(review):
+    """Queued actions whose source table changed since the review was written (e.g. overwritten by a later run)."""
+    return [action for action in review['pending_actions']
+            if 'sha256' in action and table_digest(action['source']) != action['sha256']]
+
+
+def _run_promote_table(action):
+    write_table(read_table(action['source'], schema=action['schema']), action['target'], schema=action['schema'])
+    print(f"Promoted {action['source']} -> {action['target']}")
+
+
+def _run_db_upload(action):
+    from DatabaseLoader import bulk_upsert  # Only needed once an upload is approved
+    row_count = bulk_upsert(read_table(action['source'], schema='master_data'), action['table'],
+                            key_columns=action['key_columns'])
+    print(f"Upserted {row_count} rows from {action['source']} into {action['table']}")
+
+
+ACTION_HANDLERS = {'promote_table': _run_promote_table, 'db_upload': _run_db_upload}
+
+
+def run_action(action):
+    ACTION_HANDLERS[action['type']](action)
+
+
+def gated(prompt, action, review_path=None):
+    """Interactive runs ask `prompt` and run the action right away; headless runs queue it on the review.
+    Returns True if the action ran."""
+    if not is_headless():
+        if input(f"{prompt} (y/n): ").strip().lower() != 'y':
+            return False
+        run_action(action)
+        return True
+
+    if review_path is None:
+        logging.error(f"Headless run has no review artifact; skipped gated action {action['type']}")
+        return False
+    review, path = load_review(review_path)
+    review['pending_actions'].append(action)
+    _save_review(review, path)
+    print(f"[HEADLESS] {action['type']} queued for approval in {path}")
+    return False
+
+
+def approve(review_id):
+    """Marks a pending review approved and runs its queued actions in order."""
+    review, path = load_review(review_id)
+    if review['status'] != PENDING:
+        raise ValueError(f"Review {review['review_id']} is already {review['status']}")
+    stale = stale_actions(review)
+    if stale:
+        sources = ', '.join(action['source'] for action in stale)
+        raise ValueError(f"Review {review['review_id']} is out of date: {sources} changed since it was reviewed; "
+                         f"approve the newer review instead")
+    for action in review['pending_actions']:
+        run_action(action)
+    review['status'] = APPROVED
+    review['approved_at'] = datetime.now().isoformat(timespec='seconds')
+    _save_review(review, path)
+    return review
+
+
+def reject(review_id):
+    """Marks a pending review rejected; its queued actions never run."""
+    review, path = load_review(review_id)
+    if review['status'] != PENDING:
+        raise ValueError(f"Review {review['review_id']} is already {review['status']}")
+    review['status'] = REJECTED
+    review['rejected_at'] = datetime.now().isoformat(timespec='seconds')
+    _save_review(review, path)
+    return review
+
+
+if __name__ == "__main__":
+    command, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else ('list', [])
+    if command == 'list':
+        for item in list_reviews(status=args[0] if args else None):
+            actions = ', '.join(a['type'] for a in item['pending_actions']) or 'none'
+            print(f"{item['review_id']}  {item['status']:<8}  {item['summary']}  actions: {actions}")
+    elif command == 'show':
+        review, _ = load_review(args[0])
+        print(json.dumps({k: v for k, v in review.items() if k != 'changed_fields'}, indent=1))
+        for row in review['changed_fields'][:50]:
+            print(row)
+    elif command == 'approve':
+        print(f"Approved {approve(args[0])['review_id']}")
+    elif command == 'reject':
+        print(f"Rejected {reject(args[0])['review_id']}")
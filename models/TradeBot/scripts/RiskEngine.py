@@ -0,0 +1,297 @@
+# ========== RISK ENGINE ==========
+# Pre-trade checks and bracket exits for the trading loop and the ledger portfolios. Gross
+# exposure (|quantity| x mark x multiplier) is kept as running counters per (portfolio, symbol),
+# per (portfolio, sector) and per portfolio. Every order, fill and price tick changes them by a
+# delta, so check() costs a few dict lookups no matter how many positions are open, and a price
+# tick only touches the portfolios that hold that symbol.
+#
+# Working (submitted, unfilled) quantity counts towards exposure, so a burst of orders cannot
+# slip past a limit before the first fill arrives. Orders that only reduce exposure always pass.
+#
+#   risk = RiskEngine.from_position_engine(PositionEngine.load(), load_sectors())
+#   ok, reason = risk.check('Macro Thesis', 'AAPL', 10, 190.0)
+#   exits = risk.on_price('AAPL', 171.0)    # [(portfolio, symbol, quantity, 'stop_loss'), ...]
+#
+#   python RiskEngine.py                    # exposure report for the position snapshot
+#   python RiskEngine.py --benchmark 1000000
+
+import argparse
+import logging
+import time
+import numpy as np
+import pandas as pd
+from Backfill import CRYPTO, calendar_for
+from BarStore import BarStore
+from Instrumentation import metrics
+from PositionEngine import EPSILON, PositionEngine
+from Storage import read_table, table_exists
+
+master_data_file = r'C:\Users\Lane\Documents\Projects\trading_bot\programs\master_data14.csv'
+
+# Limits are gross notional in quote currency; stop_loss/take_profit are fractions of the average cost
+DEFAULT_LIMITS = {
+    'max_order': 10000.0,
+    'symbol': 25000.0,
+    'sector': 75000.0,
+    'portfolio': 250000.0,
+    'stop_loss': 0.05,
+    'take_profit': 0.15,
+}
+# Per-portfolio overrides of DEFAULT_LIMITS, keyed by ledger portfolio_name,
+# e.g. {'Macro Thesis': {'sector': 150000.0}}
+PORTFOLIO_LIMITS = {}
+UNKNOWN_SECTOR = 'Unknown'
+CRYPTO_SECTOR = 'Crypto'
+
+STOP_LOSS, TAKE_PROFIT = 'stop_loss', 'take_profit'
+NO_EXITS = ()
+
+
+def load_sectors(master_data_path=master_data_file):
+    """symbol -> sector from master_data (empty if the file is missing)."""
+    if not master_data_path or not table_exists(master_data_path):
+        logging.error(f"Master data file not found: {master_data_path}; every symbol maps to {UNKNOWN_SECTOR}")
+        return {}
+    master = read_table(master_data_path, columns=['symbol', 'sector'], schema='master_data')
+    master = master.dropna(subset=['symbol'])
+    return dict(zip(master['symbol'].str.strip(), master['sector'].fillna(UNKNOWN_SECTOR)))
+
+
+def _new_position(sector, multiplier):
+    return {'held': 0.0, 'working': 0.0, 'avg_cost': 0.0, 'multiplier': multiplier, 'mark': 0.0,
+            'exposure': 0.0, 'sector': sector, 'stop': None, 'take': None}
+
+
+class RiskEngine:
+    """Incremental exposure counters, O(1) pre-trade checks and stop-loss/take-profit brackets."""
+
+    def __init__(self, sectors=None, limits=None, portfolio_limits=None):
+        self.sectors = sectors or {}
+        self.default_limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.limits = {name: {**self.default_limits, **overrides}
+                       for name, overrides in (PORTFOLIO_LIMITS if portfolio_limits is None else portfolio_limits).items()}
+        self.positions = {}           # (portfolio, symbol) -> position state
+        self.holders = {}             # symbol -> {portfolio: position} with a position or working order
+        self.sector_exposure = {}     # (portfolio, sector) -> gross exposure
+        self.portfolio_exposure = {}  # portfolio -> gross exposure
+
+    @classmethod
+    def from_position_engine(cls, engine, sectors=None, prices=None, **kwargs):
+        """Seeds the counters from ledger positions; marks come from `prices` or the average cost."""
+        risk = cls(sectors, **kwargs)
+        prices = prices or {}
+        for (portfolio, symbol), p in engine.positions.items():
+            if abs(p['quantity']) <= EPSILON:
+                continue
+            position = risk._position(portfolio, symbol, p['multiplier'])
+            position['held'], position['avg_cost'] = p['quantity'], p['avg_cost']
+            risk._set_brackets(portfolio, position)
+            risk._mark(portfolio, position, prices.get(symbol, p['avg_cost']))
+        return risk
+
+    # ---------- Counters ----------
+    def sector_for(self, symbol):
+        sector = self.sectors.get(symbol)
+        if sector:
+            return sector
+        return CRYPTO_SECTOR if calendar_for(symbol) == CRYPTO else UNKNOWN_SECTOR
+
+    def limits_for(self, portfolio):
+        return self.limits.get(portfolio, self.default_limits)
+
+    def _position(self, portfolio, symbol, multiplier=1.0):
+        key = (portfolio, symbol)
+        position = self.positions.get(key)
+        if position is None:
+            position = self.positions[key] = _new_position(self.sector_for(symbol), multiplier)
+            self.holders.setdefault(symbol, {})[portfolio] = position
+        return position
+
+    def _mark(self, portfolio, position, price):
+        """Re-marks one position and moves its exposure delta into the sector and portfolio counters."""
+        position['mark'] = price
+        exposure = abs(position['held'] + position['working']) * price * position['multiplier']
+        delta = exposure - position['exposure']
+        if delta:
+            position['exposure'] = exposure
+            key = (portfolio, position['sector'])
+            self.sector_exposure[key] = self.sector_exposure.get(key, 0.0) + delta
+            self.portfolio_exposure[portfolio] = self.portfolio_exposure.get(portfolio, 0.0) + delta
+
+    def _set_brackets(self, portfolio, position):
+        held, cost = position['held'], position['avg_cost']
+        if abs(held) <= EPSILON or cost <= 0:
+            position['stop'] = position['take'] = None
+            return
+        limits = self.limits_for(portfolio)
+        direction = 1.0 if held > 0 else -1.0
+        position['stop'] = cost * (1 - direction * limits['stop_loss']) if limits['stop_loss'] else None
+        position['take'] = cost * (1 + direction * limits['take_profit']) if limits['take_profit'] else None
+
+    # ---------- Pre-trade ----------
+    def check(self, portfolio, symbol, quantity, price):
+        """Validates a signed order at `price` against the portfolio's limits. Returns (ok, reason)."""
+        position = self.positions.get((portfolio, symbol))
+        if position is None:
+            multiplier, current, exposure = 1.0, 0.0, 0.0
+            sector = self.sector_for(symbol)
+        else:
+            multiplier, sector = position['multiplier'], position['sector']
+            current, exposure = position['held'] + position['working'], position['exposure']
+        after = abs(current + quantity) * price * multiplier
+        if after <= abs(current) * price * multiplier:
+            return True, None  # Reduces exposure
+
+        limits = self.limits_for(portfolio)
+        delta = after - exposure
+        if abs(quantity) * price * multiplier > limits['max_order']:
+            reason = 'max_order'
+        elif after > limits['symbol']:
+            reason = 'symbol'
+        elif self.sector_exposure.get((portfolio, sector), 0.0) + delta > limits['sector']:
+            reason = 'sector'
+        elif self.portfolio_exposure.get(portfolio, 0.0) + delta > limits['portfolio']:
+            reason = 'portfolio'
+        else:
+            return True, None
+        metrics.incr(f'risk.rejected.{reason}')
+        return False, reason
+
+    # ---------- Order lifecycle ----------
+    def on_order(self, portfolio, symbol, quantity, price, multiplier=1.0):
+        """An accepted order: its quantity counts towards exposure until filled or cancelled."""
+        position = self._position(portfolio, symbol, multiplier)
+        position['working'] += quantity
+        self._mark(portfolio, position, price)
+
+    def on_cancel(self, portfolio, symbol, quantity):
+        position = self.positions.get((portfolio, symbol))
+        if position is None:
+            return
+        position['working'] -= quantity
+        self._mark(portfolio, position, position['mark'])
+
+    def on_fill(self, portfolio, symbol, quantity, price):
+        """Moves a filled quantity from working to held and resets the bracket around the new cost."""
+        position = self._position(portfolio, symbol)
+        held = position['held']
+        position['working'] -= quantity
+        if held * quantity >= 0:  # Opening or adding
+            total = abs(held) + abs(quantity)
+            position['avg_cost'] = (abs(held) * position['avg_cost'] + abs(quantity) * price) / total
+        elif abs(quantity) > abs(held):  # Flipping through flat
+            position['avg_cost'] = price
+        position['held'] = held + quantity
+        if abs(position['held']) <= EPSILON:
+            position['held'], position['avg_cost'] = 0.0, 0.0
+        if abs(position['working']) <= EPSILON:
+            position['working'] = 0.0
+        self._set_brackets(portfolio, position)
+        self._mark(portfolio, position, price)
+
+    # ---------- Marks and exits ----------
+    def on_price(self, symbol, price):
+        """Re-marks every holder of `symbol`. Returns exit orders (portfolio, symbol, quantity, reason)
+        for positions whose stop or take-profit was hit or whose exposure now breaches a limit."""
+        holders = self.holders.get(symbol)
+        if not holders:
+            return NO_EXITS
+        exits = None
+        for portfolio, position in holders.items():
+            self._mark(portfolio, position, price)
+            held = position['held']
+            if abs(held) <= EPSILON or position['working']:
+                continue  # Flat, or an order (possibly an exit) is already working
+            exit_ = self._exit_for(portfolio, position, held, price)
+            if exit_ is not None:
+                exits = exits or []
+                exits.append((portfolio, symbol, *exit_))
+        return exits or NO_EXITS
+
+    def _exit_for(self, portfolio, position, held, price):
+        stop, take = position['stop'], position['take']
+        if stop is not None and (price <= stop if held > 0 else price >= stop):
+            return -held, STOP_LOSS
+        if take is not None and (price >= take if held > 0 else price <= take):
+            return -held, TAKE_PROFIT
+
+        # Limit breaches from price moves: trim this position by the excess
+        limits = self.limits_for(portfolio)
+        excess = max(position['exposure'] - limits['symbol'],
+                     self.sector_exposure.get((portfolio, position['sector']), 0.0) - limits['sector'],
+                     self.portfolio_exposure.get(portfolio, 0.0) - limits['portfolio'])
+        if excess <= EPSILON:
+            return None
+        trim = min(abs(held), excess / (price * position['multiplier']))
+        return (-trim if held > 0 else trim), 'limit_breach'
+
+    # ---------- Reporting ----------
+    def exposure_frame(self):
+        """Open positions with their exposure and brackets, plus sector and portfolio totals."""
+        rows = [{'portfolio_name': portfolio, 'symbol': symbol, 'sector': p['sector'], 'quantity': p['held'],
+                 'working': p['working'], 'mark': p['mark'], 'exposure': p['exposure'], 'avg_cost': p['avg_cost'],
+                 'stop': p['stop'], 'take': p['take'],
+                 'sector_exposure': self.sector_exposure.get((portfolio, p['sector']), 0.0),
+                 'portfolio_exposure': self.portfolio_exposure.get(portfolio, 0.0)}
+                for (portfolio, symbol), p in self.positions.items() if p['held'] or p['working']]
+        columns = ['portfolio_name', 'symbol', 'sector', 'quantity', 'working', 'mark', 'exposure', 'avg_cost',
+                   'stop', 'take', 'sector_exposure', 'portfolio_exposure']
+        return pd.DataFrame(rows, columns=columns)
+
+
+def last_closes(symbols, store=None):
+    """Latest stored daily close per symbol (symbols without daily bars are left out)."""
+    store = store or BarStore()
+    prices = {}
+    for symbol in symbols:
+        if store.has(symbol, '1d'):
+            close = store.read_columns(symbol, '1d')['close']
+            if len(close):
+                prices[symbol] = float(close[-1])
+    return prices
+
+
+def benchmark(orders, symbols=500, portfolios=4, seed=0):
+    """Times check + on_order + on_fill + on_price for `orders` random orders. Returns orders/second."""
+    rng = np.random.default_rng(seed)
+    names = [f'SYM{i:04d}' for i in range(symbols)]
+    risk = RiskEngine({name: f'Sector{i % 11}' for i, name in enumerate(names)},
+                      limits={'symbol': 1e6, 'sector': 1e7, 'portfolio': 5e7, 'max_order': 1e5})
+    picks, books = rng.integers(symbols, size=orders), rng.integers(portfolios, size=orders)
+    quantities, prices = rng.normal(0, 50, size=orders), rng.uniform(90, 110, size=orders)
+    accepted = 0
+    started = time.perf_counter()
+    for i in range(orders):
+        symbol, portfolio, quantity, price = names[picks[i]], books[i], float(quantities[i]), float(prices[i])
+        ok, _ = risk.check(portfolio, symbol, quantity, price)
+        if ok:
+            risk.on_order(portfolio, symbol, quantity, price)
+            risk.on_fill(portfolio, symbol, quantity, price)
+            accepted += 1
+        risk.on_price(symbol, price)
+    seconds = time.perf_counter() - started
+    print(f"{orders} orders in {seconds:.2f}s ({orders / seconds:,.0f}/s, {seconds / orders * 1e6:.2f}us each); "
+          f"{accepted} accepted, {len(risk.positions)} positions")
+    return orders / seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exposure report for the position snapshot, or a throughput benchmark")
+    parser.add_argument('--benchmark', type=int, help="Run this many random orders through the engine")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+    else:
+        engine = PositionEngine.load()
+        symbols = {symbol for _, symbol in engine.positions}
+        risk = RiskEngine.from_position_engine(engine, load_sectors(), last_closes(symbols))
+        report = risk.exposure_frame()
+        if report.empty:
+            print("No open positions in the snapshot")
+        else:
+            print(report.sort_values(['portfolio_name', 'exposure'], ascending=[True, False]).to_string(index=False))
+            for symbol in sorted(symbols):
+                position = next(iter(risk.holders.get(symbol, {}).values()), None)
+                for portfolio, _, quantity, reason in (risk.on_price(symbol, position['mark']) if position else ()):
+                    print(f"{reason}: {portfolio} {symbol} {quantity:+g}")
@@ -0,0 +1,140 @@
+# ========== COLUMNAR STORAGE ==========
+# Typed Parquet storage for master_data, cleaned ledgers and equities files.
+# Each table keeps its existing .csv path; the Parquet copy lives next to it with the same
+# stem and is preferred on read whenever it is at least as new as the CSV. Reads support
+# column projection and predicate pushdown (pyarrow-style filters). The CSV copy is still
+# written for human review unless EXPORT_CSV is turned off.
+
+import logging
+import os
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (only needed for Parquet I/O)
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+EXPORT_CSV = True            # If True, write_table also writes the .csv copy for review
+PARQUET_COMPRESSION = 'zstd'  # Compresses the long equities `summary` strings well
+
+# Column types per table; columns not listed are left to pandas inference
+SCHEMAS = {
+    'master_data': {
+        'symbol': str, 'asset_name': str, 'longname': str, 'sector': str, 'industry': str,
+        'first_traded': str, 'index_inclusion': str,
+    },
+    'ledger': {
+        'symbol': str, 'asset_name': str, 'quantity': 'float64', 'price': 'float64',
+        'transaction_amount': 'float64', 'commission': 'float64', 'fees': 'float64',
+        'portfolio_name': str, 'transaction_date': str, 'notes': str,
+        'action_type': 'category', 'is_margin': 'boolean', 'parsed_symbol': str,
+    },
+    'equities': {
+        'name': str, 'summary': str, 'currency': str, 'sector': str, 'industry_group': str,
+        'industry': str, 'exchange': str, 'market': str, 'country': str, 'state': str, 'city': str,
+        'zipcode': str, 'website': str, 'market_cap': str, 'isin': str, 'cusip': str, 'figi': str,
+        'composite_figi': str, 'shareclass_figi': str,
+    },
+}
+
+FILTER_OPS = {
+    '==': lambda s, v: s == v, '=': lambda s, v: s == v, '!=': lambda s, v: s != v,
+    '<': lambda s, v: s < v, '<=': lambda s, v: s <= v, '>': lambda s, v: s > v, '>=': lambda s, v: s >= v,
+    'in': lambda s, v: s.isin(v), 'not in': lambda s, v: ~s.isin(v),
+}
+
+
+def parquet_path_for(path):
+    """Returns the Parquet path stored next to a table's .csv path."""
+    return os.path.splitext(str(path))[0] + '.parquet'
+
+
+def table_exists(path):
+    """True if either the CSV or the Parquet copy of a table exists."""
+    return os.path.exists(path) or os.path.exists(parquet_path_for(path))
+
+
+def _use_parquet(path):
+    """Parquet is used when available and not older than the CSV (a hand-edited CSV wins)."""
+    parquet_path = parquet_path_for(path)
+    if not PARQUET_AVAILABLE or not os.path.exists(parquet_path):
+        return False
+    return not os.path.exists(path) or os.path.getmtime(parquet_path) >= os.path.getmtime(path)
+
+
+def _apply_filters(data, filters):
+    """Applies pyarrow-style filters ([(column, op, value), ...], ANDed) to a DataFrame."""
+    mask = pd.Series(True, index=data.index)
+    for column, op, value in filters:
+        mask &= FILTER_OPS[op](data[column], value)
+    return data[mask]
+
+
+def _apply_schema(data, schema):
+    """Casts the columns present in data to the types in the named schema."""
+    dtypes = {col: dtype for col, dtype in SCHEMAS.get(schema, {}).items() if col in data.columns}
+    # Cast text columns without turning missing values into the string 'nan'
+    for col, dtype in dtypes.items():
+        if dtype is str:
+            data[col] = data[col].where(data[col].isna(), data[col].astype(str))
+        elif dtype in ('category', 'boolean'):
+            data[col] = data[col].astype(dtype)
+        else:
+            data[col] = pd.to_numeric(data[col], errors='coerce').astype(dtype)
+    return data
+
+
+def read_table(path, columns=None, filters=None, schema=None):
+    """Reads a table, loading only `columns` and rows matching `filters`.
+    Prefers the Parquet copy (pushing both down to the file) and falls back to the CSV."""
+    if _use_parquet(path):
+        return pd.read_parquet(parquet_path_for(path), columns=columns, filters=filters or None)
+
+    # CSV fallback: project while parsing, filter afterwards
+    needed = None
+    if columns is not None:
+        needed = set(columns) | {column for column, _, _ in (filters or [])}
+    dtypes = SCHEMAS.get(schema, {})
+    data = pd.read_csv(path, usecols=(lambda c: c in needed) if needed else None,
+                       dtype={c: t for c, t in dtypes.items() if needed is None or c in needed})
+    if filters:
+        data = _apply_filters(data, filters)
+    if columns is not None:
+        data = data[[c for c in columns if c in data.columns]]
+    return data
+
+
+def write_table(data, path, schema=None, export_csv=None):
+    """Writes a table as typed Parquet next to `path`, plus the CSV at `path` for review."""
+    export_csv = EXPORT_CSV if export_csv is None else export_csv
+    # The CSV is written first so the Parquet copy is never older than it
+    if export_csv or not PARQUET_AVAILABLE:
+        data.to_csv(path, index=False)
+    if PARQUET_AVAILABLE:
+        typed = _apply_schema(data.copy(), schema)
+        typed.to_parquet(parquet_path_for(path), index=False, compression=PARQUET_COMPRESSION)
+    return path
+
+
+def convert_csv_to_parquet(path, schema=None):
+    """Creates the Parquet copy of an existing CSV table."""
+    data = pd.read_csv(path, dtype=SCHEMAS.get(schema, {}))
+    write_table(data, path, schema=schema, export_csv=False)
+    return parquet_path_for(path)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Usage: python Storage.py <schema> <file.csv> [<file.csv> ...]
+    if not PARQUET_AVAILABLE:
+        print("pyarrow is not installed; install it to enable Parquet storage.")
+        sys.exit(1)
+    table_schema, csv_paths = sys.argv[1], sys.argv[2:]
+    for csv_path in csv_paths:
+        try:
+            print(f"Converted {csv_path} -> {convert_csv_to_parquet(csv_path, table_schema)}")
+        except Exception as e:
+            logging.error(f"Error converting {csv_path} to Parquet: {e}")
+            print(f"Error converting {csv_path}: {e}")
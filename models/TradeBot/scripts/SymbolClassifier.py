@@ -0,0 +1,73 @@
+# ========== SYMBOL CLASSIFIER ==========
+# Cheap, network-free classification of ledger and master_data symbols, shared by
+# checkDelistings, DataCleaning and DataProcessing. Patterns are compiled once and applied
+# with vectorized pandas string operations across a whole ticker column, so only symbols
+# that really need a live Yahoo lookup reach the fetch stage.
+
+import numpy as np
+import pandas as pd
+
+VERIFIED_DELISTED = {"SRCL", "STER"}  # Symbols confirmed delisted by hand
+
+# Categories, in the order they are tested (first match wins)
+VERIFIED_DELISTED_CATEGORY = "Verified Delisted"
+OPTION = "Options Contract"
+CUSIP = "CUSIP"
+MONEY_MARKET = "Money Market"
+CASH_SWEEP = "Cash Sweep"
+EQUITY = "Equity"
+UNRECOGNIZED = "Unrecognized"
+CATEGORIES = [VERIFIED_DELISTED_CATEGORY, OPTION, CUSIP, MONEY_MARKET, CASH_SWEEP, EQUITY, UNRECOGNIZED]
+
+# Only these categories need a live lookup
+LOOKUP_CATEGORIES = {EQUITY}
+
+# Fidelity option symbols: optional leading dash, root, YYMMDD expiry, C/P, strike (e.g. -CMG260116P50)
+OPTION_PATTERN = r'^-?[A-Z]{1,6}\d{6}[CP]\d+(?:\.\d+)?$'
+# 9-character CUSIPs shown for positions after corporate actions (e.g. 00507V109, 362307100)
+CUSIP_PATTERN = r'^\d{3}[0-9A-Z]{5}\d$'
+# Money market funds end in XX (SPAXX, FDRXX, FZFXX); Fidelity marks core positions with **
+MONEY_MARKET_PATTERN = r'^[A-Z]{3}XX\**$'
+# Sweep/core placeholders; CORE needs its ** marker because CASH and CORE alone can be real tickers
+CASH_SWEEP_PATTERN = r'^(?:FCASH\**|CORE\*\*|PENDING ACTIVITY)$'
+# Exchange-listed tickers, including share classes written as BRK-B or BRK.B
+EQUITY_PATTERN = r'^[A-Z]{1,5}(?:[.-][A-Z]{1,2})?$'
+
+
+def normalize_symbols(symbols):
+    """Trims and upper-cases symbols, and drops the leading dash Fidelity puts on non-option symbols."""
+    symbols = pd.Series(symbols, dtype=object).astype(str).str.strip().str.upper()
+    is_option = symbols.str.match(OPTION_PATTERN)
+    return symbols.where(is_option, symbols.str.lstrip('-'))
+
+
+def classify_symbols(symbols, known_delisted=VERIFIED_DELISTED):
+    """Returns a categorical Series with one of CATEGORIES for each symbol, aligned to the input."""
+    raw = pd.Series(symbols, dtype=object)
+    normalized = normalize_symbols(raw)
+    conditions = [
+        normalized.isin(known_delisted),
+        normalized.str.match(OPTION_PATTERN),
+        normalized.str.match(CUSIP_PATTERN),
+        normalized.str.match(MONEY_MARKET_PATTERN),
+        normalized.str.match(CASH_SWEEP_PATTERN),
+        normalized.str.match(EQUITY_PATTERN),
+    ]
+    categories = np.select(conditions, CATEGORIES[:-1], default=UNRECOGNIZED)
+    categories[raw.isna().to_numpy()] = UNRECOGNIZED
+    return pd.Series(pd.Categorical(categories, categories=CATEGORIES), index=raw.index, name='category')
+
+
+def needs_lookup(symbols, known_delisted=VERIFIED_DELISTED):
+    """Boolean mask of symbols that should go to the live Yahoo fetch stage."""
+    return classify_symbols(symbols, known_delisted).isin(LOOKUP_CATEGORIES)
+
+
+def classify_symbol(symbol, known_delisted=VERIFIED_DELISTED):
+    """Classifies a single symbol (convenience wrapper around classify_symbols)."""
+    return classify_symbols([symbol], known_delisted).iloc[0]
+
+
+def to_yahoo_symbols(symbols):
+    """Normalizes symbols and rewrites share classes to Yahoo's dash form (BRK.B -> BRK-B)."""
+    return normalize_symbols(symbols).str.replace('.', '-', regex=False)
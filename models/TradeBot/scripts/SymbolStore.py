@@ -0,0 +1,207 @@
+# ========== VERSIONED SYMBOL STORE ==========
+# One SQLite table of (symbol, field, value, valid_from_version) holding every master_dataNN
+# version as deltas: recording a new version writes only the fields that changed since the
+# previous one (a NULL value marks a field or symbol that was removed). A `current` table keeps
+# the latest value per (symbol, field) so deltas are computed in one vectorized comparison,
+# and point-in-time lookups are a single index seek on (symbol, field, valid_from_version).
+#
+# Answers "when did symbol X first appear" and "what changed between 12 and 13" without
+# loading and diffing whole master_data files.
+#
+# Version numbers are only comparable within one lineage of files (DataCleaning's master_data69
+# and DataProcessingBackUp's master_data14 are numbered independently), so each lineage has its
+# own store file: SymbolStore(store_path('cleaning')).
+
+import os
+import re
+import sqlite3
+import sys
+import time
+from pathlib import Path
+import pandas as pd
+
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+DEFAULT_STORE_PATH = os.path.join(STORE_DIR, 'symbol_store.sqlite')
+PRESENT_FIELD = '__present__'  # Set to '1' while a symbol is in the master data, NULL once it is dropped
+
+
+def version_from_path(path):
+    """Parses the version number out of a master_dataNN file name (same rule as increment_filename_version)."""
+    digits = re.sub(r'\D', '', Path(path).stem)
+    return int(digits) if digits else 0
+
+
+def store_path(lineage):
+    """Store file for one master_data lineage, e.g. data/symbol_store_cleaning.sqlite."""
+    return os.path.join(STORE_DIR, f'symbol_store_{lineage}.sqlite')
+
+
+class SymbolStore:
+    """Delta-encoded history of master_data versions, keyed by symbol and field."""
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS symbol_fields (
+                symbol TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT,
+                valid_from_version INTEGER NOT NULL,
+                PRIMARY KEY (symbol, field, valid_from_version)
+            );
+            CREATE TABLE IF NOT EXISTS current (
+                symbol TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT,
+                PRIMARY KEY (symbol, field)
+            );
+            CREATE TABLE IF NOT EXISTS versions (
+                version INTEGER PRIMARY KEY,
+                source TEXT,
+                recorded_at REAL NOT NULL,
+                symbols INTEGER NOT NULL,
+                changed_fields INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_symbol_fields_version ON symbol_fields (valid_from_version);
+        """)
+        self._conn.commit()
+
+    # ---------- Writes ----------
+    def latest_version(self):
+        """Highest version recorded so far, or None."""
+        return self._conn.execute("SELECT MAX(version) FROM versions").fetchone()[0]
+
+    def record_version(self, master_data, version, source=None, skip_unchanged=False):
+        """Stores a master_data DataFrame as `version`, writing only fields that differ from the latest state.
+        Re-recording the latest version (e.g. after enrichment) updates it in place. With skip_unchanged, a
+        table identical to the latest state records nothing. Returns the number of changed fields."""
+        latest = self.latest_version()
+        if latest is not None and version < latest:
+            raise ValueError(f"Version {version} is older than the latest recorded version {latest}")
+
+        new_state = _to_long(master_data)
+        current = pd.read_sql_query("SELECT symbol, field, value FROM current", self._conn)
+
+        # Changed or new fields, plus fields that disappeared (written as NULL tombstones)
+        merged = new_state.merge(current, on=['symbol', 'field'], how='outer', suffixes=('', '_old'), indicator=True)
+        changed = merged[(merged['_merge'] == 'left_only') |
+                         ((merged['_merge'] == 'both') & (merged['value'].fillna('\0') != merged['value_old'].fillna('\0')))]
+        removed = merged[(merged['_merge'] == 'right_only') & merged['value_old'].notna()]
+        deltas = pd.concat([changed[['symbol', 'field', 'value']],
+                            removed[['symbol', 'field']].assign(value=None)], ignore_index=True)
+        deltas = deltas.astype(object).where(deltas.notna(), None)
+        if skip_unchanged and deltas.empty:
+            return 0
+
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO symbol_fields (symbol, field, value, valid_from_version) VALUES (?, ?, ?, ?)",
+                [(s, f, v, int(version)) for s, f, v in deltas[['symbol', 'field', 'value']].itertuples(index=False)])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO current (symbol, field, value) VALUES (?, ?, ?)",
+                deltas[['symbol', 'field', 'value']].itertuples(index=False))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO versions (version, source, recorded_at, symbols, changed_fields) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (int(version), source, time.time(), int(master_data['symbol'].nunique()), len(deltas)))
+        return len(deltas)
+
+    # ---------- Point-in-time reads ----------
+    def get(self, symbol, field, version=None):
+        """Value of one field as of `version` (latest if None)."""
+        if version is None:
+            row = self._conn.execute("SELECT value FROM current WHERE symbol = ? AND field = ?",
+                                     (symbol, field)).fetchone()
+        else:
+            row = self._conn.execute(
+                "SELECT value FROM symbol_fields WHERE symbol = ? AND field = ? AND valid_from_version <= ? "
+                "ORDER BY valid_from_version DESC LIMIT 1", (symbol, field, version)).fetchone()
+        return row[0] if row else None
+
+    def get_symbol(self, symbol, version=None):
+        """All fields of a symbol as of `version` (latest if None); empty dict if it was not present."""
+        rows = self._conn.execute(
+            "SELECT field, value FROM symbol_fields AS s WHERE symbol = ? AND valid_from_version = ("
+            "  SELECT MAX(valid_from_version) FROM symbol_fields "
+            "  WHERE symbol = s.symbol AND field = s.field AND valid_from_version <= ?)",
+            (symbol, version if version is not None else sys.maxsize)).fetchall()
+        fields = dict(rows)
+        if fields.pop(PRESENT_FIELD, None) is None:
+            return {}
+        return {field: value for field, value in fields.items() if value is not None}
+
+    def first_seen(self, symbol):
+        """First version in which the symbol appeared, or None."""
+        return self._conn.execute(
+            "SELECT MIN(valid_from_version) FROM symbol_fields WHERE symbol = ? AND field = ? AND value IS NOT NULL",
+            (symbol, PRESENT_FIELD)).fetchone()[0]
+
+    def diff(self, old_version, new_version):
+        """Fields that changed between two versions: symbol, field, old_value, new_value."""
+        changes = pd.read_sql_query(
+            "SELECT symbol, field, value AS new_value, MAX(valid_from_version) AS valid_from_version "
+            "FROM symbol_fields WHERE valid_from_version > ? AND valid_from_version <= ? "
+            "GROUP BY symbol, field", self._conn, params=(old_version, new_version))
+        changes['old_value'] = [self.get(s, f, old_version) for s, f in zip(changes['symbol'], changes['field'])]
+        changes = changes[changes['old_value'].fillna('\0') != changes['new_value'].fillna('\0')]
+        return changes[['symbol', 'field', 'old_value', 'new_value']].reset_index(drop=True)
+
+    def snapshot(self, version=None):
+        """Rebuilds the full master_data table as of `version` (latest if None)."""
+        long = pd.read_sql_query(
+            "SELECT symbol, field, value FROM symbol_fields AS s WHERE valid_from_version = ("
+            "  SELECT MAX(valid_from_version) FROM symbol_fields "
+            "  WHERE symbol = s.symbol AND field = s.field AND valid_from_version <= ?)",
+            self._conn, params=(version if version is not None else sys.maxsize,))
+        wide = long.pivot(index='symbol', columns='field', values='value')
+        if PRESENT_FIELD not in wide.columns:
+            return pd.DataFrame(columns=['symbol'])
+        wide = wide[wide[PRESENT_FIELD].notna()].drop(columns=PRESENT_FIELD)
+        return wide.reset_index().rename_axis(columns=None)
+
+    def versions(self):
+        """Recorded versions with their source file and delta size."""
+        return pd.read_sql_query("SELECT * FROM versions ORDER BY version", self._conn)
+
+    def close(self):
+        self._conn.close()
+
+
+def _to_long(master_data):
+    """Melts master_data into (symbol, field, value) text rows, one row per non-empty field plus a presence marker."""
+    data = master_data.dropna(subset=['symbol']).drop_duplicates(subset=['symbol'], keep='last')
+    data = data.astype(object).where(data.notna(), None)
+    long = data.melt(id_vars='symbol', var_name='field', value_name='value')
+    long = long[long['value'].notna()]
+    long['value'] = long['value'].astype(str)
+    present = pd.DataFrame({'symbol': data['symbol'], 'field': PRESENT_FIELD, 'value': '1'})
+    long = pd.concat([long, present], ignore_index=True)
+    long['symbol'] = long['symbol'].astype(str)
+    return long
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python SymbolStore.py import master_data10.csv master_data11.csv ...
+    #   python SymbolStore.py first-seen AAPL
+    #   python SymbolStore.py diff 12 13
+    #   python SymbolStore.py --lineage cleaning diff 69 70    # a lineage's own store
+    argv = sys.argv[1:]
+    lineage = None
+    if argv[:1] == ['--lineage']:
+        lineage, argv = argv[1], argv[2:]
+    store = SymbolStore(store_path(lineage) if lineage else DEFAULT_STORE_PATH)
+    command, args = argv[0], argv[1:]
+    if command == 'import':
+        for csv_path in sorted(args, key=version_from_path):
+            changed = store.record_version(pd.read_csv(csv_path, dtype=str), version_from_path(csv_path), source=csv_path)
+            print(f"Recorded {csv_path} as version {version_from_path(csv_path)}: {changed} changed fields")
+    elif command == 'first-seen':
+        for symbol in args:
+            print(f"{symbol}: {store.first_seen(symbol)}")
+    elif command == 'diff':
+        print(store.diff(int(args[0]), int(args[1])).to_string(index=False))
+    store.close()
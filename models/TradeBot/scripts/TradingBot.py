@@ -0,0 +1,408 @@
+# ========== EVENT-DRIVEN TRADING LOOP ==========
+# One asyncio loop drives live trading. A feed pushes bar and quote events into a bounded queue;
+# the loop feeds each completed 1m bar into the live features (InferenceServer) and, once the queue
+# is drained, decides every symbol with a new bar in one batched model call. Each decision becomes
+# a target position and any order goes to a broker adapter. Orders are
+# submitted without waiting for the fill: the broker reports fills later through a callback on the
+# same loop, so a slow exchange never stalls market data.
+#
+#   feed = ReplayFeed(['BTC-USD'])                     # or SyntheticFeed for load tests
+#   bot = TradingBot(feed, SimulatedExchange(), InferenceServer.from_store(['BTC-USD']))
+#   asyncio.run(bot.run())
+#
+#   python TradingBot.py --symbols 50 --rate 5000 --seconds 10    # offline tick-to-order load test
+#
+# The load test runs the baseline models on a cold server, whose scores stay well inside
+# ENTRY_THRESHOLD, so synthetic runs default to SYNTHETIC_ENTRY_THRESHOLD and actually place orders
+# (--entry overrides either default).
+#
+# Broker adapters implement submit(order) (async, returns once the order is accepted),
+# set_fill_handler(callback) and optionally on_market_data(event). SimulatedExchange is the local
+# stand-in: it fills market orders at the last quote after a configurable latency, with fees and
+# slippage from the trade ledger calibration (Backtester.calibrate_costs).
+#
+# With a RiskEngine attached, every new order is checked against the exposure limits before it
+# reaches the broker, and each quote/bar re-marks the held symbol and sends any bracket exit
+# (stop-loss, take-profit, limit breach) for the bot's own portfolio.
+
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+import numpy as np
+import pandas as pd
+from BarStore import BarStore, NS_PER_MINUTE, TIMEFRAMES
+from Backtester import default_costs
+from FeatureEngine import IncrementalFeatures, MultiTimeframeFeatures
+from InferenceServer import InferenceServer, load_models
+from Instrumentation import metrics
+from RiskEngine import RiskEngine, load_sectors
+
+QUEUE_SIZE = 10000           # Events buffered between the feed and the loop (back-pressure beyond this)
+ENTRY_THRESHOLD = 0.3        # Decision score needed to open a position
+SYNTHETIC_ENTRY_THRESHOLD = 0.02  # Default for SyntheticFeed runs, where cold-server scores stay near 0
+EXIT_THRESHOLD = 0.0         # Score at or below which a long position is closed
+ALLOW_SHORT = False
+ORDER_NOTIONAL = 1000.0      # Position size per symbol in quote currency
+EXCHANGE_LATENCY = 0.001     # Seconds from submit to fill in the simulated exchange
+QUOTE_SPREAD_BPS = 2.0       # Synthetic bid/ask spread around the bar close
+FILL_TIMEOUT = 5.0           # Seconds to wait for outstanding fills when the feed ends
+BOT_PORTFOLIO = 'TradingBot'  # Portfolio name the bot's orders are risk-checked under
+
+BUY, SELL = 'buy', 'sell'
+BAR, QUOTE = 'bar', 'quote'
+
+
+# ========== EVENTS ==========
+class Bar:
+    __slots__ = ('kind', 'symbol', 'ts', 'open', 'high', 'low', 'close', 'volume', 'received')
+
+    def __init__(self, symbol, ts, open_, high, low, close, volume):
+        self.kind = BAR
+        self.symbol, self.ts = symbol, ts
+        self.open, self.high, self.low, self.close, self.volume = open_, high, low, close, volume
+        self.received = time.perf_counter()
+
+
+class Quote:
+    __slots__ = ('kind', 'symbol', 'ts', 'bid', 'ask', 'received')
+
+    def __init__(self, symbol, ts, bid, ask):
+        self.kind = QUOTE
+        self.symbol, self.ts, self.bid, self.ask = symbol, ts, bid, ask
+        self.received = time.perf_counter()
+
+
+class Order:
+    __slots__ = ('order_id', 'symbol', 'side', 'quantity', 'signal_time', 'submitted')
+
+    def __init__(self, order_id, symbol, side, quantity, signal_time):
+        self.order_id, self.symbol, self.side, self.quantity = order_id, symbol, side, quantity
+        self.signal_time = signal_time  # perf_counter() when the triggering event arrived
+        self.submitted = None
+
+
+class Fill:
+    __slots__ = ('order', 'price', 'fees', 'received')
+
+    def __init__(self, order, price, fees):
+        self.order, self.price, self.fees = order, price, fees
+        self.received = time.perf_counter()
+
+
+# ========== FEEDS ==========
+class ReplayFeed:
+    """Replays stored 1m bars for several symbols in timestamp order, each preceded by a quote
+    around its close. `speed` replays that many bar-minutes per second (None: as fast as possible)."""
+
+    def __init__(self, symbols, store=None, start=None, end=None, speed=None, spread_bps=QUOTE_SPREAD_BPS):
+        self.symbols = list(symbols)
+        self.store = store or BarStore()
+        self.start, self.end, self.speed = start, end, speed
+        self.half_spread = spread_bps / 2e4
+
+    async def events(self):
+        frames = []
+        for i, symbol in enumerate(self.symbols):
+            columns = self.store.read_columns(symbol, '1m', start=self.start, end=self.end)
+            frames.append(pd.DataFrame({'symbol': i, **columns}))
+        if not frames:
+            return
+        bars = pd.concat(frames, ignore_index=True).sort_values('ts', kind='stable')
+        if bars.empty:
+            return
+        first_ts, started = int(bars['ts'].iloc[0]), time.perf_counter()
+        for row in bars.itertuples(index=False):
+            if self.speed:
+                due = started + (row.ts - first_ts) / NS_PER_MINUTE / self.speed
+                if due > time.perf_counter():
+                    await asyncio.sleep(due - time.perf_counter())
+            symbol = self.symbols[row.symbol]
+            yield Quote(symbol, row.ts, row.close * (1 - self.half_spread), row.close * (1 + self.half_spread))
+            yield Bar(symbol, row.ts, row.open, row.high, row.low, row.close, row.volume)
+
+
+class SyntheticFeed:
+    """Random-walk bars and quotes at a fixed event rate, for offline load tests. Symbols take
+    turns; each symbol's bars are one minute apart. `quotes_per_bar` quotes precede every bar."""
+
+    def __init__(self, symbols, rate=1000, seconds=10, quotes_per_bar=1, seed=0, spread_bps=QUOTE_SPREAD_BPS):
+        self.symbols = list(symbols)
+        self.rate, self.seconds, self.quotes_per_bar = rate, seconds, quotes_per_bar
+        self.rng = np.random.default_rng(seed)
+        self.half_spread = spread_bps / 2e4
+
+    async def events(self):
+        total = int(self.rate * self.seconds)
+        per_bar = self.quotes_per_bar + 1
+        prices = np.full(len(self.symbols), 100.0)
+        start_ts = pd.Timestamp.now(tz='UTC').floor('D').value
+        minute = np.zeros(len(self.symbols), dtype=np.int64)
+        # Pre-drawn log returns; one per bar
+        moves = self.rng.normal(0, 0.001, size=total // per_bar + 1)
+        batch = max(1, self.rate // 1000)  # Yield to the loop about once per millisecond of schedule
+        started = time.perf_counter()
+        for n in range(total):
+            if n % batch == 0:
+                due = started + n / self.rate
+                delay = due - time.perf_counter()
+                await asyncio.sleep(delay if delay > 0 else 0)
+            bar_index, step = divmod(n, per_bar)
+            i = bar_index % len(self.symbols)
+            symbol, ts = self.symbols[i], start_ts + int(minute[i]) * NS_PER_MINUTE
+            if step < self.quotes_per_bar:
+                mid = prices[i] * (1 + self.rng.normal(0, 0.0002))
+                yield Quote(symbol, ts, mid * (1 - self.half_spread), mid * (1 + self.half_spread))
+                continue
+            open_ = prices[i]
+            close = open_ * np.exp(moves[bar_index])
+            prices[i] = close
+            minute[i] += 1
+            yield Bar(symbol, ts, open_, max(open_, close), min(open_, close), close, 1000.0)
+
+
+# ========== BROKERS ==========
+class SimulatedExchange:
+    """Local broker stand-in: market orders fill at the last bid/ask after `latency` seconds, with
+    the ledger-calibrated fee rate and slippage. Market data reaches it through on_market_data()."""
+
+    def __init__(self, latency=EXCHANGE_LATENCY, costs=None):
+        self.latency = latency
+        self.costs = costs or default_costs()
+        self.quotes = {}  # symbol -> (bid, ask)
+        self.on_fill = None
+        self.pending = set()
+
+    def set_fill_handler(self, callback):
+        self.on_fill = callback
+
+    def on_market_data(self, event):
+        if event.kind == QUOTE:
+            self.quotes[event.symbol] = (event.bid, event.ask)
+        elif event.symbol not in self.quotes:
+            self.quotes[event.symbol] = (event.close, event.close)
+
+    async def submit(self, order):
+        if order.symbol not in self.quotes:
+            raise ValueError(f"No market data for {order.symbol}; cannot fill order {order.order_id}")
+        task = asyncio.get_running_loop().create_task(self._execute(order))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+        return order.order_id
+
+    async def _execute(self, order):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        bid, ask = self.quotes[order.symbol]
+        if order.side == BUY:
+            price = ask * (1 + self.costs['slippage'])
+            fee_rate = self.costs['buy_fee']
+        else:
+            price = bid * (1 - self.costs['slippage'])
+            fee_rate = self.costs['sell_fee']
+        self.on_fill(Fill(order, price, price * order.quantity * fee_rate))
+
+
+# ========== TRADING LOOP ==========
+class TradingBot:
+    """Consumes feed events, updates features and models on every bar and trades the decisions."""
+
+    def __init__(self, feed, broker, server, queue_size=QUEUE_SIZE, entry_threshold=ENTRY_THRESHOLD,
+                 exit_threshold=EXIT_THRESHOLD, risk=None, portfolio=BOT_PORTFOLIO):
+        self.feed = feed
+        self.broker = broker
+        self.server = server
+        self.risk = risk
+        self.portfolio = portfolio
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.entry_threshold, self.exit_threshold = entry_threshold, exit_threshold
+        self.positions = {symbol: 0.0 for symbol in server.symbols}
+        self.cash = 0.0
+        self.fees = 0.0
+        self.pending = {}  # symbol -> Order awaiting its fill (one working order per symbol)
+        self.events = 0
+        self._order_ids = itertools.count(1)
+        self._flat = None  # Set while no order is working
+        broker.set_fill_handler(self.handle_fill)
+
+    async def _pump(self):
+        try:
+            async for event in self.feed.events():
+                await self.queue.put(event)
+        finally:
+            await self.queue.put(None)
+
+    async def run(self):
+        """Runs until the feed ends and every working order has been filled (or FILL_TIMEOUT)."""
+        self._flat = asyncio.Event()
+        self._flat.set()
+        pump = asyncio.get_running_loop().create_task(self._pump())
+        started = time.perf_counter()
+        try:
+            with metrics.stage('trading_loop') as stage:
+                await self._consume()
+                stage.rows = self.events
+            try:
+                await asyncio.wait_for(self._flat.wait(), timeout=FILL_TIMEOUT)
+            except asyncio.TimeoutError:
+                logging.error(f"{len(self.pending)} orders still unfilled after {FILL_TIMEOUT}s")
+        finally:
+            pump.cancel()
+        seconds = time.perf_counter() - started
+        metrics.incr('bot.events', self.events)
+        return {'events': self.events, 'seconds': round(seconds, 3),
+                'events_per_sec': round(self.events / seconds, 1) if seconds else None,
+                'open_orders': len(self.pending), 'cash': round(self.cash, 2), 'fees': round(self.fees, 2),
+                'positions': {s: q for s, q in self.positions.items() if q}}
+
+    async def _consume(self):
+        on_market_data = getattr(self.broker, 'on_market_data', None)
+        bars = {}  # symbol -> newest bar fed to the server and awaiting its decision
+        while True:
+            if bars and self.queue.empty():
+                # Queue drained: decide every symbol with a new bar in one batch
+                await self.handle_bars(bars)
+                bars = {}
+            event = await self.queue.get()
+            if event is None:  # Feed finished
+                if bars:
+                    await self.handle_bars(bars)
+                return
+            self.events += 1
+            if on_market_data:
+                on_market_data(event)
+            if self.risk is not None:
+                price = event.close if event.kind == BAR else (event.bid + event.ask) / 2
+                exits = self.risk.on_price(event.symbol, price)
+                if exits:
+                    await self.handle_exits(exits, price, event.received)
+            if event.kind == BAR and event.symbol in self.server.index:
+                if event.symbol in bars:
+                    # A symbol's next minute arrived first; decide the batch before its features move on
+                    await self.handle_bars(bars)
+                    bars = {}
+                with metrics.timer('bot.bar_update'):
+                    self.server.on_bar(event.symbol, event.ts, event.open, event.high, event.low, event.close,
+                                       event.volume)
+                bars[event.symbol] = event
+
+    async def handle_bars(self, bars):
+        """Runs the models once for every symbol with a new bar and trades the resulting decisions."""
+        with metrics.timer('bot.decision'):
+            scores = self.server.decide()
+        metrics.incr('bot.decision_batches')
+        metrics.incr('bot.decided_symbols', len(scores))
+        for symbol, bar in bars.items():
+            if symbol not in scores:
+                continue
+            target = self.target_position(symbol, scores[symbol], bar.close)
+            quantity = target - self.positions[symbol]
+            if abs(quantity) > 1e-12 and symbol not in self.pending:
+                await self.place_order(symbol, quantity, bar.close, bar.received)
+
+    async def handle_exits(self, exits, price, signal_time):
+        """Sends the bracket exits for the bot's portfolio; exits for other portfolios are only counted."""
+        for portfolio, symbol, quantity, reason in exits:
+            metrics.incr(f'risk.exits.{reason}')
+            if portfolio != self.portfolio:
+                continue
+            if symbol not in self.pending:
+                await self.place_order(symbol, quantity, price, signal_time, exit_reason=reason)
+
+    def target_position(self, symbol, score, price):
+        """Position (units) wanted for a decision score: ORDER_NOTIONAL long above the entry
+        threshold, flat at or below the exit threshold, otherwise unchanged."""
+        held = self.positions[symbol]
+        if score >= self.entry_threshold:
+            return held if held > 0 else ORDER_NOTIONAL / price
+        if ALLOW_SHORT and score <= -self.entry_threshold:
+            return held if held < 0 else -ORDER_NOTIONAL / price
+        if (held > 0 and score <= self.exit_threshold) or (held < 0 and score >= -self.exit_threshold):
+            return 0.0
+        return held
+
+    async def place_order(self, symbol, quantity, price, signal_time, exit_reason=None):
+        """Risk-checks (unless it is a bracket exit) and submits a market order without awaiting the fill."""
+        if self.risk is not None:
+            if exit_reason is None:
+                ok, reason = self.risk.check(self.portfolio, symbol, quantity, price)
+                if not ok:
+                    metrics.incr('bot.risk_rejects')
+                    return
+            self.risk.on_order(self.portfolio, symbol, quantity, price)
+        order = Order(next(self._order_ids), symbol, BUY if quantity > 0 else SELL, abs(quantity), signal_time)
+        self.pending[symbol] = order
+        self._flat.clear()
+        try:
+            order.submitted = time.perf_counter()
+            metrics.observe('bot.tick_to_order', order.submitted - signal_time)
+            await self.broker.submit(order)
+            metrics.incr('bot.orders')
+        except Exception as e:
+            del self.pending[symbol]
+            if not self.pending:
+                self._flat.set()
+            if self.risk is not None:
+                self.risk.on_cancel(self.portfolio, symbol, quantity)
+            metrics.incr('bot.order_errors')
+            logging.error(f"Order {order.order_id} {order.side} {symbol} rejected: {e}")
+
+    def handle_fill(self, fill):
+        """Fill callback from the broker (runs on the loop; never blocks the event stream)."""
+        order = fill.order
+        signed = order.quantity if order.side == BUY else -order.quantity
+        self.positions[order.symbol] = self.positions.get(order.symbol, 0.0) + signed
+        self.cash -= signed * fill.price + fill.fees
+        self.fees += fill.fees
+        if self.risk is not None:
+            self.risk.on_fill(self.portfolio, order.symbol, signed, fill.price)
+        if self.pending.get(order.symbol) is order:
+            del self.pending[order.symbol]
+            if not self.pending:
+                self._flat.set()
+        metrics.observe('bot.order_to_fill', fill.received - order.submitted)
+        metrics.observe('bot.tick_to_fill', fill.received - order.signal_time)
+        metrics.incr('bot.fills')
+
+
+def cold_server(symbols, timeframes=TIMEFRAMES):
+    """InferenceServer with empty feature state (no stored history), for synthetic runs."""
+    models, meta_model = load_models(timeframes=timeframes)
+    features = {symbol: MultiTimeframeFeatures({tf: IncrementalFeatures() for tf in timeframes}) for symbol in symbols}
+    return InferenceServer(symbols, models, meta_model, features, timeframes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the trading loop against the simulated exchange")
+    parser.add_argument('--replay', help="Comma-separated symbols to replay from the bar store instead of synthetic data")
+    parser.add_argument('--symbols', type=int, default=20, help="Synthetic symbols")
+    parser.add_argument('--rate', type=int, default=2000, help="Synthetic events per second")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--quotes-per-bar', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=EXCHANGE_LATENCY * 1000)
+    parser.add_argument('--entry', type=float, help=f"Decision score that opens a position (default {ENTRY_THRESHOLD}, "
+                                                    f"or {SYNTHETIC_ENTRY_THRESHOLD} for synthetic runs)")
+    parser.add_argument('--no-risk', action='store_true', help="Skip the pre-trade risk checks")
+    args = parser.parse_args()
+
+    metrics.run_name = 'trading_bot'
+    if args.replay:
+        symbols = args.replay.split(',')
+        feed, server = ReplayFeed(symbols), InferenceServer.from_store(symbols)
+    else:
+        symbols = [f'SYM{i:03d}' for i in range(args.symbols)]
+        feed = SyntheticFeed(symbols, args.rate, args.seconds, args.quotes_per_bar)
+        server = cold_server(symbols)
+    entry = args.entry
+    if entry is None:
+        entry = ENTRY_THRESHOLD if args.replay else SYNTHETIC_ENTRY_THRESHOLD
+    risk = None if args.no_risk else RiskEngine(load_sectors() if args.replay else None)
+    bot = TradingBot(feed, SimulatedExchange(latency=args.latency_ms / 1000), server, entry_threshold=entry,
+                     risk=risk)
+    result = asyncio.run(bot.run())
+    print(f"{result['events']} events in {result['seconds']}s ({result['events_per_sec']}/s); "
+          f"{metrics.counters.get('bot.orders', 0)} orders, {metrics.counters.get('bot.fills', 0)} fills, "
+          f"fees {result['fees']}")
+    metrics.print_summary()
+    print(f"Run summary saved to {metrics.write_summary()}")
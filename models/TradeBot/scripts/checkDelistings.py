@@ -1,57 +1,91 @@
 import pandas as pd
 import yfinance as yf
 from datetime import datetime, timedelta
-import re
 import os
+import csv
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import time
+from RateLimiter import RateLimiter
+from PriceBatch import fetch_history_summary
+from BarStore import BarStore
+from MetadataCache import MetadataCache
+from Storage import read_table, table_exists
+from Instrumentation import metrics
+from SymbolClassifier import (classify_symbols, to_yahoo_symbols, VERIFIED_DELISTED, LOOKUP_CATEGORIES,
+                              VERIFIED_DELISTED_CATEGORY, OPTION, CUSIP, MONEY_MARKET, CASH_SWEEP, UNRECOGNIZED)
 
 # ======= Configuration Section =======
 # Define the expected master data file and output file paths
 master_data_file = r'C:\Users\Lane\Documents\Projects\trading_bot\programs\master_data14.csv'
 output_path = r'C:\Users\Lane\Documents\Projects\trading_bot\data\old data\report-weekly_symbol_status.csv'
-verified_delisted_list = {"SRCL", "STER"}  # Verified Delisted List
+verified_delisted_list = set(VERIFIED_DELISTED)  # Verified Delisted List
+scan_workers = 8                 # Number of concurrent lookups; set to 1 for a sequential scan
+max_requests_per_second = 5      # Per-host rate limit shared by all workers
+history_chunk_size = 100         # Symbols per batched 5-day history download
+read_bars_from_store = False     # True: check against the local bar store only, with no Yahoo history calls
 # =====================================
 
+# Report status for symbols settled by the classifier without a network call
+status_by_category = {
+    VERIFIED_DELISTED_CATEGORY: "Verified Delisted",
+    OPTION: "Options Contract",
+    CUSIP: "Bought Out",
+    MONEY_MARKET: "Cash Equivalent",
+    CASH_SWEEP: "Cash Equivalent",
+    UNRECOGNIZED: "Unrecognized Symbol",
+}
+
+# Shared limiter so concurrent workers stay under Yahoo's request threshold
+yahoo_limiter = RateLimiter(max_requests_per_second)
+
+# On-disk .info cache so repeat weekly runs skip the metadata round trip
+info_cache = MetadataCache(limiter=yahoo_limiter)
+
+# Local daily bars; fetched history is kept here and offline scans read from it
+bar_store = BarStore()
+
 # Set the date threshold dynamically to 3 days before the current date
 last_known_trading_date = datetime.now() - timedelta(days=3)
 print(f"Checking for delistings with last trading date on or before: {last_known_trading_date.date()}")
 
 # Function to check if a ticker is a mutual fund using metadata from yfinance
 def is_mutual_fund(ticker):
-    stock = yf.Ticker(ticker)
-    asset_type = stock.info.get("quoteType", "")
+    asset_type = info_cache.get(ticker, "quoteType", "")
     return asset_type == "MUTUALFUND"
 
+# Daily bars for one ticker: from the bar store when offline, otherwise from Yahoo (and kept in the store)
+def recent_history(stock, ticker, period, offline=False):
+    if offline:
+        return bar_store.history(ticker, period=period)
+    yahoo_limiter.acquire()
+    with metrics.timer('yahoo.history'):
+        data = stock.history(period=period)
+    if not data.empty:
+        bar_store.append(ticker, '1d', data)
+    return data
+
 # Function to process tickers, handling cases where they start with a dash and include additional characters
-def check_ticker_status(ticker, max_retries=3, delay=2):
-    # Handle tickers that start with a dash by extracting the symbol
-    if ticker.startswith('-'):
-        # Remove the dash and capture the initial letters of the symbol (e.g., "-ABC123" becomes "ABC")
-        match = re.match(r'-([A-Za-z]+)', ticker)
-        if match:
-            ticker = match.group(1)
-            tqdm.write(f"Adjusted ticker to '{ticker}' for lookup")
-
-    # Check if ticker is in Verified Delisted List
-    if ticker in verified_delisted_list:
-        message = f"{ticker}: Verified Delisted"
-        tqdm.write(message)
-        return "Verified Delisted"
+def check_ticker_status(ticker, max_retries=3, delay=2, history_summary=None, offline=False, category=None,
+                        yahoo_symbol=None):
+    """Classifies a ticker's trading status. When history_summary (from PriceBatch) holds a
+    row for the ticker, its 5-day bars are used instead of a per-symbol history() call.
+    With offline=True the bars come from the local bar store only. perform_symbol_activity_check
+    classifies and normalizes the whole list once and passes category and yahoo_symbol in."""
+    # Settle verified delistings, options, CUSIPs and cash positions without a network call
+    if category is None:
+        category = classify_symbols([ticker], verified_delisted_list).iloc[0]
+    if category not in LOOKUP_CATEGORIES:
+        return status_by_category[category]
+
+    # Strip Fidelity's leading dash and use Yahoo's share-class form for the lookup
+    ticker = yahoo_symbol or to_yahoo_symbols([ticker]).iloc[0]
 
     try:
-        # Check if ticker resembles an options contract
-        if re.search(r'-\w+\d+', ticker):
-            return "Options Contract"
-
-        # Check if ticker is a string of letters and numbers, indicating a 'Bought Out' case
-        if re.match(r'^\d+[A-Z]+\d+$', ticker):
-            return "Bought Out"
-
         # Determine if it's a mutual fund using metadata
         stock = yf.Ticker(ticker)
         if is_mutual_fund(ticker):
-            data = stock.history(period="1mo")  # Use 1mo for mutual funds
+            data = recent_history(stock, ticker, "1mo", offline)  # Use 1mo for mutual funds
             if not data.empty:
                 message = f"{ticker}: Active (Mutual Fund)"
                 tqdm.write(message)
@@ -61,28 +95,41 @@ def check_ticker_status(ticker, max_retries=3, delay=2):
                 tqdm.write(message)
                 return "Possibly Delisted"
 
-        # Default handling for regular stocks
-        data = stock.history(period="5d")  # Default to 5 days for regular stocks
-
-        # Retry mechanism to handle intermittent data fetching issues
-        for attempt in range(max_retries):
-            if not data.empty:
-                break
-            if attempt < max_retries - 1:
-                time.sleep(delay)
-                data = stock.history(period="5d")
-
-        # If data is still empty after retries, flag as possibly delisted
-        if data.empty:
-            return "Possibly Delisted"
+        # Use the batched 5-day summary when the ticker came back with bars
+        summary = None
+        if history_summary is not None and ticker in history_summary.index:
+            summary = history_summary.loc[ticker]
+            if summary['bars'] == 0:
+                summary = None  # Fall back to the per-symbol retry path below
+
+        if summary is not None:
+            last_trading_day = summary['last_date']
+            volume_sum = summary['volume_sum']
+        else:
+            # Default handling for regular stocks
+            data = recent_history(stock, ticker, "5d", offline)  # Default to 5 days for regular stocks
+
+            # Retry mechanism to handle intermittent data fetching issues (the store gives the same answer)
+            for attempt in range(0 if offline else max_retries):
+                if not data.empty:
+                    break
+                if attempt < max_retries - 1:
+                    metrics.incr('yahoo.history.retries')
+                    time.sleep(delay)
+                    data = recent_history(stock, ticker, "5d")
+
+            # If data is still empty after retries, flag as possibly delisted
+            if data.empty:
+                return "Possibly Delisted"
+            last_trading_day = data.index[-1]
+            volume_sum = data['Volume'].sum()
 
         # Check the last available trading date without implying it's a delisting date match
-        last_trading_day = data.index[-1] if not data.empty else None
         if last_trading_day and last_trading_day.to_pydatetime().date() <= last_known_trading_date.date():
             return "Possibly Delisted"
 
         # For regular stocks only, check if there is no volume
-        if data['Volume'].sum() == 0 and not is_mutual_fund(ticker):
+        if volume_sum == 0 and not is_mutual_fund(ticker):
             return "Possibly Delisted"
 
         return "Active"
@@ -91,53 +138,101 @@ def check_ticker_status(ticker, max_retries=3, delay=2):
         return "Possibly Delisted"
 
 # Main function to check all symbols in tickers
-def perform_symbol_activity_check(tickers):
+def perform_symbol_activity_check(tickers, workers=scan_workers, output_path=None, offline=read_bars_from_store):
+    """Checks every ticker, optionally across a thread pool, and streams each result to output_path as it finishes.
+    With offline=True the bars are read from the local bar store instead of Yahoo."""
     results = {}
-    start_time = time.time()
-    progress_bar = tqdm(tickers, desc="Checking ticker status", unit="ticker")
 
-    # Calculate velocity and estimated time remaining
-    for i, ticker in enumerate(progress_bar):
-        status = check_ticker_status(ticker)
+    # Classify the whole ticker column up front; only lookup symbols go to the fetch stage
+    symbols = pd.Series(tickers, dtype=object)
+    categories = classify_symbols(symbols, verified_delisted_list)
+    lookup_mask = categories.isin(LOOKUP_CATEGORIES)
+    lookup_tickers = symbols[lookup_mask].tolist()
+    lookup_categories = dict(zip(lookup_tickers, categories[lookup_mask]))
+    yahoo_symbols = dict(zip(lookup_tickers, to_yahoo_symbols(lookup_tickers)))
+
+    # Fetch 5-day bars for the lookup symbols in a few multi-ticker downloads before the per-symbol checks
+    with metrics.stage('history_prefetch', rows=len(lookup_tickers)):
+        if offline:
+            history_summary = bar_store.history_summary(list(yahoo_symbols.values()), period="5d")
+        else:
+            history_summary = fetch_history_summary(list(yahoo_symbols.values()), period="5d",
+                                                    chunk_size=history_chunk_size, limiter=yahoo_limiter,
+                                                    store=bar_store)
+
+    # tqdm's own rate-based ETA replaces the old hand-rolled estimate
+    progress_bar = tqdm(total=len(tickers), desc="Checking ticker status", unit="ticker")
+
+    # Open the report up front so results are written as soon as they are known
+    report_file = open(output_path, 'w', newline='') if output_path else None
+    writer = csv.writer(report_file) if report_file else None
+    if writer:
+        writer.writerow(['Ticker', 'Status'])
+
+    def record_result(ticker, status):
         results[ticker] = status
+        metrics.incr(f'status.{status}')
+        if writer:
+            writer.writerow([ticker, status])
+            report_file.flush()
 
         # Only display important statuses, excluding "Active"
         if status != "Active":
             tqdm.write(f"{ticker}: {status}")
 
-        # When 25% progress is reached, estimate time remaining
-        if i == int(len(tickers) * 0.25):
-            elapsed_time = time.time() - start_time
-            velocity = i / elapsed_time
-            estimated_total_time = len(tickers) / velocity
-            remaining_time = estimated_total_time - elapsed_time
-            progress_bar.set_postfix_str(f"Estimated time left: {int(remaining_time)}s")
+        progress_bar.update(1)
 
-        # Update estimated time left dynamically after 25% completion
-        elif i > int(len(tickers) * 0.25):
-            elapsed_time = time.time() - start_time
-            remaining_time = (len(tickers) - i) / velocity
-            progress_bar.set_postfix_str(f"Estimated time left: {int(remaining_time)}s")
+    def timed_check(ticker):
+        with metrics.timer('check_ticker_status'):
+            return check_ticker_status(ticker, history_summary=history_summary, offline=offline,
+                                       category=lookup_categories[ticker], yahoo_symbol=yahoo_symbols[ticker])
+
+    try:
+        # Record the statuses the classifier already settled
+        for ticker, category in zip(symbols[~lookup_mask], categories[~lookup_mask]):
+            record_result(ticker, status_by_category[category])
+
+        with metrics.stage('symbol_checks', rows=len(lookup_tickers)):
+            if workers <= 1:
+                for ticker in lookup_tickers:
+                    record_result(ticker, timed_check(ticker))
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = {executor.submit(timed_check, ticker): ticker for ticker in lookup_tickers}
+                    for future in as_completed(futures):
+                        record_result(futures[future], future.result())
+    finally:
+        progress_bar.close()
+        if report_file:
+            report_file.close()
 
     return results
 
 # Main script execution
 if __name__ == "__main__":
+    metrics.run_name = 'check_delistings'
+    metrics.event('config', workers=scan_workers, max_requests_per_second=max_requests_per_second,
+                  history_chunk_size=history_chunk_size, read_bars_from_store=read_bars_from_store)
+
     # Check if the expected file exists
-    if os.path.exists(master_data_file):
-        # Load tickers from the specified master_data file
-        master_data = pd.read_csv(master_data_file)
+    if table_exists(master_data_file):
+        # Load only the symbol column from the specified master_data file
+        master_data = read_table(master_data_file, columns=['symbol'], schema='master_data')
         tickers = master_data['symbol'].tolist()
         print(f"Running symbol activity integrity check on tickers from {master_data_file}")
         print(f"Total tickers loaded: {len(tickers)}")
 
         # Run the symbol activity check if tickers are loaded
         if tickers:
-            results = perform_symbol_activity_check(tickers)
-            
-            # Save results to the specified path
-            results_df = pd.DataFrame(list(results.items()), columns=['Ticker', 'Status'])
+            results = perform_symbol_activity_check(tickers, workers=scan_workers, output_path=output_path)
+
+            # Rewrite the streamed report in master_data order so weekly reports diff cleanly
+            results_df = pd.DataFrame([(t, results[t]) for t in dict.fromkeys(tickers)], columns=['Ticker', 'Status'])
             results_df.to_csv(output_path, index=False)
             print(f"Results saved to {output_path}")
+
+            # Stage timings, fetch latency percentiles and cache hit rates for tuning scan_workers
+            metrics.print_summary()
+            print(f"Run summary saved to {metrics.write_summary()}")
     else:
         print(f"Error: Please ensure the file '{master_data_file}' is loaded in the directory.")
@@ -0,0 +1,46 @@
+# test_DatabaseLoader.py
+# Purpose: Runs DatabaseLoader.bulk_upsert against its SQLite path (staging table + ON CONFLICT upsert),
+#          so the loader is exercised without a PostgreSQL server.
+
+import logging
+
+import pandas as pd
+import pytest
+
+from DatabaseLoader import bulk_upsert, get_engine
+from Instrumentation import metrics
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return get_engine(f"sqlite:///{tmp_path / 'bitbot_test.db'}")
+
+
+def read_table(engine, table):
+    return pd.read_sql(f"SELECT * FROM {table} ORDER BY symbol", engine).set_index('symbol')
+
+
+def test_upsert_twice_updates_overlapping_keys(engine):
+    first = pd.DataFrame({'symbol': ['AAPL', 'MSFT'], 'sector': ['Technology', None]})
+    second = pd.DataFrame({'symbol': ['MSFT', 'XOM'], 'sector': ['Technology', 'Energy']})
+
+    assert bulk_upsert(first, 'master_data', key_columns=['symbol'], engine=engine) == 2
+    assert bulk_upsert(second, 'master_data', key_columns=['symbol'], engine=engine) == 2
+
+    stored = read_table(engine, 'master_data')
+    assert list(stored.index) == ['AAPL', 'MSFT', 'XOM']  # MSFT was updated in place, not duplicated
+    assert stored.loc['MSFT', 'sector'] == 'Technology'
+    assert stored.loc['AAPL', 'sector'] == 'Technology'
+
+
+def test_rows_without_key_are_reported(engine, caplog):
+    data = pd.DataFrame({'symbol': ['AAPL', None, None], 'sector': ['Technology', 'Energy', 'Utilities']})
+    counter = 'db_upsert.master_data.missing_key_rows'
+    before = metrics.counters.get(counter, 0)
+
+    with caplog.at_level(logging.ERROR):
+        assert bulk_upsert(data, 'master_data', key_columns=['symbol'], engine=engine) == 1
+
+    assert metrics.counters[counter] - before == 2
+    assert any("2 rows without ['symbol']" in message for message in caplog.messages)
+    assert list(read_table(engine, 'master_data').index) == ['AAPL']